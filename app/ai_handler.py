@@ -5,18 +5,24 @@ Rotate giữa nhiều API keys để tăng rate limit
 import logging
 from colorama import Fore
 import random
+import threading
 import time
-from typing import List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
 
 try:
     import google.generativeai as genai
+    from google.ai import generativelanguage as glm
     HAS_GEMINI = True
 except ImportError:
     HAS_GEMINI = False
     print(Fore.YELLOW + "⚠ Gemini chưa cài: pip install google-generativeai" + Fore.RESET)
 
+from .key_scheduler import KeyScheduler, is_rate_limit_error
+from .session_store import create_session_store
+
 try:
-    from .rag_handler import RAGKnowledgeBase
+    from .rag_handler import get_shared_knowledge_base
     HAS_RAG = True
 except ImportError:
     HAS_RAG = False
@@ -24,13 +30,25 @@ except ImportError:
 
 
 class GeminiMultiKeyHandler:
-    def __init__(self, api_keys):
+    # Trả về khi tất cả keys đều fail (không được cache như câu trả lời thật)
+    FALLBACK_RESPONSES = (
+        "Úi zời oi bot đang bị limit rồi, anh em chờ tí nha! 🙏",
+        "Ôi không, bot bị quá tải rồi! Anh em đợi tí nha! ⏳",
+        "Huhu, bot mệt quá không trả lời được! Anh em thông cảm nha! 😢",
+    )
+    
+    def __init__(self, api_keys, rag_config: Optional[Dict] = None, sessions=None):
         """
         Khởi tạo với nhiều API keys
         
         Args:
             api_keys: List các Gemini API keys hoặc dict config
+            rag_config: Config cho RAG knowledge base (section 'rag' trong ai config)
+            sessions: SessionStore dùng chung (vd. sau ProviderRouter), mặc định tạo store riêng
         """
+        # Quota mỗi key (free tier gemini-2.5-flash: 10 RPM, 250 RPD)
+        limits = api_keys if isinstance(api_keys, dict) else {}
+        
         # Xử lý input - có thể là list, dict, hoặc single string
         if isinstance(api_keys, str):
             api_keys = [api_keys]
@@ -52,17 +70,27 @@ class GeminiMultiKeyHandler:
         
         if not self.api_keys:
             raise ValueError("❌ Không có API key hợp lệ!")
+        # Số thứ tự cố định của key trong log (không đổi khi key khác bị bỏ)
+        self.key_labels = {key: f"#{i+1}" for i, key in enumerate(self.api_keys)}
+        # warm_up bỏ key sai trên worker thread trong lúc request khác có thể đang chạy
+        self._keys_lock = threading.Lock()
         
-        self.current_key_index = 0
-        self.key_usage = {key: {'count': 0, 'errors': 0, 'last_reset': time.time()} 
-                         for key in self.api_keys}
+        # generate_content stateless + client riêng mỗi key -> 1 key chạy được nhiều request cùng lúc
+        self.scheduler = KeyScheduler(
+            self.api_keys,
+            rpm=limits.get('gemini_rpm', 10),
+            rpd=limits.get('gemini_rpd', 250),
+            max_inflight_per_key=limits.get('gemini_max_inflight_per_key', 4)
+        )
+        # Số giây chờ key có capacity trước khi trả fallback (mặc định: chờ bằng timeout của !ask)
+        self.key_wait = limits.get('gemini_key_wait', limits.get('ask_timeout', 60))
         
         # Initialize RAG Knowledge Base
         self.rag = None
         if HAS_RAG:
             try:
-                self.rag = RAGKnowledgeBase('config/knowledge.json')
-                print(Fore.GREEN + f"  ✓ RAG Knowledge Base: {len(self.rag.knowledge)} entries loaded" + Fore.RESET)
+                self.rag = get_shared_knowledge_base('config/knowledge.json', rag_config)
+                print(Fore.GREEN + f"  ✓ RAG Knowledge Base: {len(self.rag)} entries loaded" + Fore.RESET)
             except Exception as e:
                 print(Fore.YELLOW + f"  ⚠ RAG failed to load: {e}" + Fore.RESET)
                 self.rag = None
@@ -79,20 +107,25 @@ TUYỆT ĐỐI:
 - Nếu có CONTEXT bên dưới, PHẢI trả lời dựa 100% vào CONTEXT đó
 - KHÔNG được tự sáng tác thông tin nếu đã có CONTEXT"""
         
-        # Khởi tạo models cho từng key
+        # Lịch sử hội thoại riêng từng viewer, giới hạn theo token (lượt cũ bị bỏ hoặc tóm tắt)
+        self.sessions = sessions if sessions is not None else create_session_store(limits.get('sessions'))
+        if limits.get('gemini_summarize', False) and self.sessions.summarizer is None:
+            self.sessions.summarizer = self._summarize_turns
+        
+        # Khởi tạo models cho từng key (system prompt là system_instruction, không gửi lại mỗi lượt)
+        self.clients = {}
         self.models = {}
-        self.chats = {}
         
         print(Fore.CYAN + "\n🤖 Đang khởi tạo Gemini Multi-Key Handler..." + Fore.RESET)
         
         failed_keys = []
         for i, key in enumerate(self.api_keys):
             try:
-                genai.configure(api_key=key)
-                model = genai.GenerativeModel('gemini-2.5-flash')
-                self.models[key] = model
-                self.chats[key] = model.start_chat(history=[])
+                self.models[key] = self._create_model(key, self.system_prompt)
                 print(Fore.GREEN + f"  ✓ Gemini Key #{i+1} ready" + Fore.RESET)
+            except RuntimeError:
+                # SDK không tương thích -> không phải lỗi của key
+                raise
             except Exception as e:
                 print(Fore.YELLOW + f"  ⚠ Key #{i+1} failed: {e}" + Fore.RESET)
                 failed_keys.append(key)
@@ -100,67 +133,58 @@ TUYỆT ĐỐI:
         # Remove failed keys
         for key in failed_keys:
             self.api_keys.remove(key)
+            self.scheduler.remove(key)
         
         if not self.models:
             raise Exception("❌ Không có key nào hoạt động!")
         
         print(Fore.GREEN + f"\n✓ Gemini Multi-Key Handler: {len(self.api_keys)} keys active\n" + Fore.RESET)
     
-    def _get_next_key(self) -> Optional[str]:
+    def _create_model(self, key: str, system_instruction: Optional[str] = None):
         """
-        Lấy key tiếp theo theo round-robin
-        Tự động bỏ qua keys có quá nhiều lỗi
+        Model dùng client riêng của key (genai.configure() là global -> không dùng được song song)
+
+        Raises:
+            RuntimeError: Phiên bản google-generativeai không còn cho gắn client riêng vào model
         """
-        attempts = 0
-        while attempts < len(self.api_keys):
-            # Round-robin
-            key = self.api_keys[self.current_key_index]
-            self.current_key_index = (self.current_key_index + 1) % len(self.api_keys)
-            
-            # Reset counter mỗi ngày (86400 giây)
-            if time.time() - self.key_usage[key]['last_reset'] > 86400:
-                self.key_usage[key]['count'] = 0
-                self.key_usage[key]['errors'] = 0
-                self.key_usage[key]['last_reset'] = time.time()
-            
-            # Skip keys có quá nhiều lỗi
-            if self.key_usage[key]['errors'] < 5:
-                return key
-            
-            attempts += 1
-        
-        # Nếu tất cả keys đều lỗi, reset và thử lại
-        for key in self.api_keys:
-            self.key_usage[key]['errors'] = 0
-        
-        return self.api_keys[0] if self.api_keys else None
+        if key not in self.clients:
+            self.clients[key] = glm.GenerativeServiceClient(client_options={'api_key': key})
+        model = genai.GenerativeModel('gemini-2.5-flash', system_instruction=system_instruction)
+        # GenerativeModel không có API public để truyền client: gắn vào _client (model tự tạo client
+        # global khi _client là None). SDK đổi tên attribute -> dừng hẳn thay vì âm thầm dùng chung 1 key
+        if not hasattr(model, '_client'):
+            raise RuntimeError("google-generativeai không còn GenerativeModel._client, "
+                               "không gắn được client riêng cho từng key - kiểm tra phiên bản SDK")
+        model._client = self.clients[key]
+        return model
     
-    def get_response(self, user_message: str, user_name: str = "") -> str:
+    def get_response(self, user_message: str, user_name: str = "", session_id: Optional[str] = None) -> str:
         """
         Lấy response từ Gemini với auto key rotation
         
         Args:
             user_message: Tin nhắn từ user
             user_name: Tên user
+            session_id: channelId của user (lịch sử hội thoại riêng, None = không nhớ)
             
         Returns:
             Câu trả lời từ AI
         """
         # Thử tối đa 3 keys khác nhau
+        tried = []
         for attempt in range(min(3, len(self.api_keys))):
-            key = self._get_next_key()
+            # Key rảnh còn nhiều quota nhất, chờ 1 chút nếu tất cả đang bận / hết capacity / bị 429
+            key = self.scheduler.acquire(timeout=self.key_wait, exclude=tried)
             
             if not key:
-                logging.error("[Gemini] Tất cả keys đều fail!")
+                logging.error("[Gemini] Không còn key nào có quota!")
                 break
+            tried.append(key)
             
             try:
-                # Configure key hiện tại
-                genai.configure(api_key=key)
-                
                 # Get RAG context if available
                 context = None
-                if self.rag:
+                if self.rag is not None:
                     context = self.rag.get_context(user_message, max_length=300)
                     if context:
                         logging.info(f"[RAG] ✓ Context found for: '{user_message[:50]}...'")
@@ -169,22 +193,20 @@ TUYỆT ĐỐI:
                         logging.info(f"[RAG] ✗ No context for: '{user_message[:50]}...'")
                         print(Fore.YELLOW + f"[RAG] ✗ No match for: '{user_message[:60]}...'" + Fore.RESET)
                 
-                # Tạo prompt với hoặc không có context
+                # Tạo prompt với hoặc không có context (context chỉ gửi ở lượt hiện tại, không lưu vào lịch sử)
+                user_text = f"User {user_name}: {user_message}"
                 if context:
-                    prompt = f"""{self.system_prompt}
-
-⚠️ CONTEXT - THÔNG TIN CHÍNH THỨC VỀ ACN (BẮT BUỘC PHẢI SỬ DỤNG):
+                    prompt = f"""⚠️ CONTEXT - THÔNG TIN CHÍNH THỨC VỀ ACN (BẮT BUỘC PHẢI SỬ DỤNG):
 {context}
 
-User {user_name}: {user_message}
+{user_text}
 
 Bot (BẮT BUỘC trả lời dựa 100% vào CONTEXT trên, không được tự sáng tác):"""
                 else:
-                    prompt = f"{self.system_prompt}\n\nUser {user_name}: {user_message}\n\nBot:"
+                    prompt = user_text
                 
-                # Gửi request qua chat để maintain context
-                chat = self.chats[key]
-                response = chat.send_message(prompt)
+                # Lịch sử gần đây (đã giới hạn token) + lượt hiện tại
+                response = self.models[key].generate_content(self._build_contents(prompt, session_id))
                 
                 # Lấy text
                 if hasattr(response, 'text') and response.text:
@@ -192,6 +214,7 @@ Bot (BẮT BUỘC trả lời dựa 100% vào CONTEXT trên, không được t
                 else:
                     logging.warning(f"[Gemini] No text in response")
                     continue
+                self.sessions.add_turn(session_id, user_text, ai_response)
                 
                 # Thêm mention tên user vào đầu response (nếu có user_name)
                 if user_name:
@@ -202,50 +225,136 @@ Bot (BẮT BUỘC trả lời dựa 100% vào CONTEXT trên, không được t
                     ai_response = ai_response[:197] + "..."
                 
                 # Update usage
-                self.key_usage[key]['count'] += 1
+                self.scheduler.report_success(key)
                 
-                key_num = self.api_keys.index(key) + 1
-                logging.info(f"[Gemini Key #{key_num}] '{user_message}' -> '{ai_response}'")
+                logging.info(f"[Gemini Key {self.key_labels[key]}] '{user_message}' -> '{ai_response}'")
                 
                 return ai_response
                 
             except Exception as e:
-                # Đánh dấu key bị lỗi
-                self.key_usage[key]['errors'] += 1
+                # Đánh dấu key bị lỗi (429 -> key nghỉ theo Retry-After)
+                self.scheduler.report_error(key, e)
                 
-                key_num = self.api_keys.index(key) + 1
+                label = self.key_labels[key]
                 error_msg = str(e)
-                logging.warning(f"[Gemini Key #{key_num}] Error: {error_msg}")
+                logging.warning(f"[Gemini Key {label}] Error: {error_msg}")
                 
                 # Nếu lỗi rate limit, thử key khác ngay
-                if "429" in error_msg or "quota" in error_msg.lower() or "resource" in error_msg.lower():
-                    logging.info(f"[Gemini Key #{key_num}] Rate limited, switching key...")
+                if is_rate_limit_error(e):
+                    logging.info(f"[Gemini Key {label}] Rate limited, switching key...")
                     continue
                 
                 # Nếu lỗi khác, thử lại với key khác
                 continue
+            
+            finally:
+                # Key rảnh cho request khác
+                self.scheduler.release(key)
         
         # Tất cả keys đều fail
-        fallbacks = [
-            "Úi zời oi bot đang bị limit rồi, anh em chờ tí nha! 🙏",
-            "Ôi không, bot bị quá tải rồi! Anh em đợi tí nha! ⏳",
-            "Huhu, bot mệt quá không trả lời được! Anh em thông cảm nha! 😢",
-        ]
-        return random.choice(fallbacks)
+        return random.choice(self.FALLBACK_RESPONSES)
     
     def get_stats(self) -> str:
         """Lấy thống kê sử dụng keys"""
         stats = []
-        for i, key in enumerate(self.api_keys):
-            usage = self.key_usage[key]
-            stats.append(f"Key #{i+1}: {usage['count']} requests, {usage['errors']} errors")
+        capacity = self.scheduler.capacity()
+        with self._keys_lock:
+            keys = list(self.api_keys)
+        for key in keys:
+            usage = capacity.get(key)
+            if usage is None:
+                continue
+            line = f"Key {self.key_labels[key]}: {usage['count']} requests, {usage['errors']} errors"
+            if usage['minute_remaining'] is not None:
+                line += f", {usage['minute_remaining']}/{self.scheduler.rpm} RPM left"
+            if usage['day_remaining'] is not None:
+                line += f", {usage['day_remaining']}/{self.scheduler.rpd} RPD left"
+            if usage['cooldown'] > 0:
+                line += f", cooldown {usage['cooldown']:.0f}s"
+            stats.append(line)
         return "\n".join(stats)
     
+    def warm_up(self) -> Dict:
+        """
+        Health-check tất cả keys song song (count_tokens: không tốn quota generate)
+        Key sai bị bỏ khỏi rotation, key đang bị 429 được cho nghỉ
+        
+        Returns:
+            {'ok': bool, 'seconds': float, 'detail': str}
+        """
+        start = time.monotonic()
+        
+        def check(key):
+            try:
+                self.models[key].count_tokens("ping")
+                return key, None
+            except Exception as e:
+                return key, e
+        
+        with self._keys_lock:
+            keys = list(self.api_keys)
+        with ThreadPoolExecutor(max_workers=len(keys)) as executor:
+            results = list(executor.map(check, keys))
+        
+        healthy = 0
+        for key, error in results:
+            label = self.key_labels[key]
+            if error is None:
+                healthy += 1
+            elif "api key not valid" in str(error).lower() or "api_key_invalid" in str(error).lower():
+                logging.error(f"[Gemini Key {label}] Invalid key, removed: {error}")
+                # Bỏ khỏi scheduler trước -> không request mới nào nhận key này nữa
+                self.scheduler.remove(key)
+                with self._keys_lock:
+                    self.api_keys.remove(key)
+                    self.models.pop(key, None)
+            else:
+                logging.warning(f"[Gemini Key {label}] Health check failed: {error}")
+                self.scheduler.report_error(key, error)
+        
+        return {
+            'ok': healthy > 0,
+            'seconds': time.monotonic() - start,
+            'detail': f"{healthy}/{len(results)} keys healthy"
+        }
+    
+    def _build_contents(self, prompt: str, session_id: Optional[str] = None) -> List[Dict]:
+        """Gemini contents: tóm tắt (nếu có) + lịch sử của viewer + prompt hiện tại"""
+        contents = []
+        history = self.sessions.get(session_id)
+        if history is None:
+            return [{'role': 'user', 'parts': [prompt]}]
+        if history.summary:
+            contents.append({'role': 'user', 'parts': [f"(Tóm tắt cuộc trò chuyện trước đó: {history.summary})"]})
+            contents.append({'role': 'model', 'parts': ["Ok!"]})
+        for message in history.messages():
+            role = 'model' if message['role'] == 'assistant' else 'user'
+            contents.append({'role': role, 'parts': [message['content']]})
+        contents.append({'role': 'user', 'parts': [prompt]})
+        return contents
+    
+    def _summarize_turns(self, summary: str, turns: List) -> Optional[str]:
+        """Gộp các lượt cũ bị đẩy khỏi window vào đoạn tóm tắt (dùng key đang rảnh, không chờ)"""
+        key = self.scheduler.acquire(timeout=0)
+        if not key:
+            return None
+        try:
+            transcript = "\n".join(f"{user_text}\nBot: {reply}" for user_text, reply in turns)
+            prompt = (f"Tóm tắt cuộc trò chuyện livestream sau trong tối đa 3 câu tiếng Việt, "
+                      f"giữ lại tên viewer và các thông tin quan trọng.\n\n"
+                      f"Tóm tắt trước đó: {summary or '(chưa có)'}\n\n{transcript}")
+            response = self._create_model(key).generate_content(prompt)
+            self.scheduler.report_success(key)
+            return response.text
+        except Exception as e:
+            self.scheduler.report_error(key, e)
+            raise
+        finally:
+            self.scheduler.release(key)
+    
     def reset_conversation(self):
         """Reset tất cả conversations"""
-        for key in self.api_keys:
-            if key in self.models:
-                self.chats[key] = self.models[key].start_chat(history=[])
+        self.sessions.clear()
         logging.info("All conversations reset")
     
     def is_available(self) -> bool:
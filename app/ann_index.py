@@ -0,0 +1,290 @@
+"""
+ANN Index
+Approximate nearest-neighbour (IVF) cho vector store lớn, brute-force cho collection nhỏ
+"""
+import logging
+import os
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+
+
+def _top_k(scores: "np.ndarray", top_k: int) -> "np.ndarray":
+    """Vị trí top-k scores (giảm dần, hòa điểm thì vị trí nhỏ trước)"""
+    if len(scores) > top_k:
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+    else:
+        top = np.arange(len(scores))
+    return top[np.lexsort((top, -scores[top]))]
+
+
+class BruteForceIndex:
+    """Exact search: 1 phép matrix-vector trên toàn bộ vectors"""
+
+    def __init__(self, vectors: "np.ndarray"):
+        self.vectors = vectors
+
+    def __len__(self) -> int:
+        return self.vectors.shape[0]
+
+    def search(self, query_vector: "np.ndarray", top_k: int) -> Tuple["np.ndarray", "np.ndarray"]:
+        """
+        Args:
+            query_vector: L2-normalized query vector
+            top_k: Number of neighbours
+
+        Returns:
+            (row ids, cosine scores), sorted by score
+        """
+        if len(self) == 0 or top_k <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        scores = self.vectors @ query_vector
+        top = _top_k(scores, top_k)
+        return top, scores[top]
+
+    def search_batch(self, query_vectors: "np.ndarray", top_k: int,
+                     block_size: int = 1 << 24) -> List[Tuple["np.ndarray", "np.ndarray"]]:
+        """
+        Exact search cho nhiều query: (n x dim) @ (dim x n_queries), chia block để giới hạn bộ nhớ
+
+        Args:
+            query_vectors: (n_queries x dim) L2-normalized query vectors
+            top_k: Number of neighbours
+            block_size: Số score tối đa tính trong 1 block (n_vectors x queries trong block)
+
+        Returns:
+            List (row ids, cosine scores) cho từng query
+        """
+        if len(self) == 0 or top_k <= 0:
+            return [(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)) for _ in query_vectors]
+        step = max(1, block_size // len(self))
+        results = []
+        for start in range(0, len(query_vectors), step):
+            scores = self.vectors @ query_vectors[start:start + step].T
+            for column in range(scores.shape[1]):
+                column_scores = scores[:, column]
+                top = _top_k(column_scores, top_k)
+                results.append((top, column_scores[top]))
+        return results
+
+
+class IVFIndex:
+    """
+    Inverted file index: k-means chia vectors thành nlist cluster, query chỉ quét nprobe cluster gần nhất
+    Vectors được lưu theo thứ tự cluster để mỗi list là 1 block liên tục (đọc mmap tuần tự)
+    """
+
+    def __init__(self, centroids: "np.ndarray", offsets: "np.ndarray", ids: "np.ndarray",
+                 vectors: "np.ndarray", nprobe: int = 8):
+        """
+        Args:
+            centroids: (nlist x dim) L2-normalized centroids
+            offsets: (nlist + 1) vị trí bắt đầu của từng list trong ids/vectors
+            ids: Row id gốc của từng vector (theo thứ tự cluster)
+            vectors: Vectors đã sắp theo thứ tự cluster
+            nprobe: Số cluster quét mỗi query (tăng = recall cao hơn, chậm hơn)
+        """
+        self.centroids = centroids
+        self.offsets = offsets
+        self.ids = ids
+        self.vectors = vectors
+        self.nprobe = nprobe
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def nlist(self) -> int:
+        return self.centroids.shape[0]
+
+    @classmethod
+    def build(cls, vectors: "np.ndarray", nlist: int, nprobe: int = 8, iterations: int = 10,
+              train_size: Optional[int] = None, seed: int = 0) -> "IVFIndex":
+        """
+        Train spherical k-means trên 1 sample và gán toàn bộ vectors vào cluster
+
+        Args:
+            vectors: (n x dim) L2-normalized vectors
+            nlist: Số cluster
+            nprobe: Số cluster quét mỗi query
+            iterations: Số vòng k-means
+            train_size: Số vectors dùng để train (mặc định 64 * nlist)
+            seed: Random seed
+
+        Returns:
+            IVFIndex
+        """
+        rng = np.random.default_rng(seed)
+        n = vectors.shape[0]
+        nlist = max(1, min(nlist, n))
+        train_size = min(n, train_size or 64 * nlist)
+        sample = np.asarray(vectors[np.sort(rng.choice(n, train_size, replace=False))], dtype=np.float32)
+
+        centroids = sample[rng.choice(train_size, nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assign = cls._assign(sample, centroids)
+            order = np.argsort(assign, kind='stable')
+            counts = np.bincount(assign, minlength=nlist)
+            starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+            non_empty = counts > 0
+            sums = np.add.reduceat(sample[order], starts[non_empty], axis=0)
+            centroids[non_empty] = sums
+            # Cluster rỗng -> khởi tạo lại bằng điểm ngẫu nhiên
+            if not non_empty.all():
+                empty = np.flatnonzero(~non_empty)
+                centroids[empty] = sample[rng.choice(train_size, len(empty), replace=False)]
+            centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+
+        assign = cls._assign(vectors, centroids)
+        ids = np.argsort(assign, kind='stable')
+        counts = np.bincount(assign, minlength=nlist)
+        offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+        logging.info(f"[ANN] IVF built: {n} vectors, {nlist} lists, nprobe={nprobe}")
+        return cls(centroids, offsets, ids.astype(np.int64), np.asarray(vectors[ids], dtype=np.float32), nprobe)
+
+    @staticmethod
+    def _assign(vectors: "np.ndarray", centroids: "np.ndarray", batch_size: int = 8192) -> "np.ndarray":
+        """Cluster gần nhất (cosine) của mỗi vector, theo batch để giới hạn bộ nhớ"""
+        assign = np.empty(vectors.shape[0], dtype=np.int64)
+        for start in range(0, vectors.shape[0], batch_size):
+            batch = np.asarray(vectors[start:start + batch_size], dtype=np.float32)
+            assign[start:start + batch_size] = np.argmax(batch @ centroids.T, axis=1)
+        return assign
+
+    def search(self, query_vector: "np.ndarray", top_k: int) -> Tuple["np.ndarray", "np.ndarray"]:
+        """
+        Args:
+            query_vector: L2-normalized query vector
+            top_k: Number of neighbours
+
+        Returns:
+            (row ids gốc, cosine scores), sorted by score
+        """
+        return self.search_batch(query_vector[np.newaxis, :], top_k)[0]
+
+    def search_batch(self, query_vectors: "np.ndarray", top_k: int) -> List[Tuple["np.ndarray", "np.ndarray"]]:
+        """
+        Search nhiều query (list mỗi query probe khác nhau nên chỉ gộp bước chọn cluster)
+
+        Args:
+            query_vectors: (n_queries x dim) L2-normalized query vectors
+            top_k: Number of neighbours
+
+        Returns:
+            List (row ids gốc, cosine scores) cho từng query
+        """
+        empty = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32))
+        if len(self) == 0 or top_k <= 0:
+            return [empty for _ in query_vectors]
+        nprobe = min(self.nprobe, self.nlist)
+        centroid_scores = query_vectors @ self.centroids.T
+
+        results = []
+        for query_vector, row in zip(query_vectors, centroid_scores):
+            positions, scores = [], []
+            for probe in _top_k(row, nprobe):
+                start, end = self.offsets[probe], self.offsets[probe + 1]
+                if start == end:
+                    continue
+                positions.append(np.arange(start, end))
+                scores.append(self.vectors[start:end] @ query_vector)
+            if not positions:
+                results.append(empty)
+                continue
+            positions = np.concatenate(positions)
+            scores = np.concatenate(scores)
+            top = _top_k(scores, top_k)
+            results.append((self.ids[positions[top]], scores[top]))
+        return results
+
+    def save(self, path_prefix: str, fingerprint: str):
+        """
+        Ghi index ra disk: <prefix>.ivf.npz (centroids, offsets, ids) + <prefix>.ivf.npy (vectors, mmap được)
+
+        Args:
+            path_prefix: Đường dẫn không có đuôi
+            fingerprint: Hash của vector store + tham số build, dùng để validate khi load
+        """
+        meta_path = Path(f"{path_prefix}.ivf.npz")
+        vectors_path = Path(f"{path_prefix}.ivf.npy")
+        tmp_meta = Path(f"{path_prefix}.ivf.tmp.npz")
+        tmp_vectors = Path(f"{path_prefix}.ivf.tmp.npy")
+        np.save(tmp_vectors, self.vectors)
+        np.savez(tmp_meta, centroids=self.centroids, offsets=self.offsets, ids=self.ids,
+                 fingerprint=np.array(fingerprint))
+        os.replace(tmp_vectors, vectors_path)
+        os.replace(tmp_meta, meta_path)
+
+    @classmethod
+    def load(cls, path_prefix: str, fingerprint: str, nprobe: int = 8) -> Optional["IVFIndex"]:
+        """
+        Load index đã lưu (vectors memory-mapped)
+
+        Args:
+            path_prefix: Đường dẫn không có đuôi
+            fingerprint: Hash hiện tại của vector store + tham số build
+            nprobe: Số cluster quét mỗi query
+
+        Returns:
+            IVFIndex hoặc None nếu chưa có / đã cũ
+        """
+        meta_path = Path(f"{path_prefix}.ivf.npz")
+        vectors_path = Path(f"{path_prefix}.ivf.npy")
+        if not meta_path.exists() or not vectors_path.exists():
+            return None
+        try:
+            with np.load(meta_path) as meta:
+                if str(meta['fingerprint']) != fingerprint:
+                    logging.info(f"[ANN] Cached IVF index {meta_path} is stale "
+                                 f"(vectors or ANN config changed), rebuilding")
+                    return None
+                centroids, offsets, ids = meta['centroids'], meta['offsets'], meta['ids']
+            vectors = np.load(vectors_path, mmap_mode='r')
+            return cls(centroids, offsets, ids, vectors, nprobe)
+        except Exception as e:
+            logging.warning(f"[ANN] Could not load IVF index: {e}")
+            return None
+
+
+def build_ann_index(vectors: "np.ndarray", config: Dict, path_prefix: Optional[str] = None,
+                    fingerprint: str = ""):
+    """
+    Chọn index theo kích thước collection
+
+    Args:
+        vectors: (n x dim) L2-normalized vectors
+        config: RAG config ('ann_min_vectors', 'ann_nlist', 'ann_nprobe', 'ann_iterations', 'ann_train_size')
+        path_prefix: Nơi lưu/đọc IVF index (None = không cache)
+        fingerprint: Hash của vector store
+
+    Returns:
+        BruteForceIndex (collection nhỏ) hoặc IVFIndex
+    """
+    n = vectors.shape[0]
+    if n < config.get('ann_min_vectors', 10000):
+        return BruteForceIndex(vectors)
+
+    nprobe = config.get('ann_nprobe', 8)
+    nlist = config.get('ann_nlist') or int(4 * np.sqrt(n))
+    iterations = config.get('ann_iterations', 10)
+    train_size = config.get('ann_train_size')
+    # nprobe chỉ dùng lúc search; đổi tham số build -> index đã lưu không còn dùng được
+    build_fingerprint = f"{fingerprint}:nlist={nlist}:iterations={iterations}:train_size={train_size}:seed=0"
+    if path_prefix:
+        index = IVFIndex.load(path_prefix, build_fingerprint, nprobe=nprobe)
+        if index is not None:
+            logging.info(f"[ANN] IVF loaded: {len(index)} vectors, {index.nlist} lists")
+            return index
+
+    index = IVFIndex.build(vectors, nlist, nprobe=nprobe, iterations=iterations, train_size=train_size, seed=0)
+    if path_prefix:
+        try:
+            index.save(path_prefix, build_fingerprint)
+        except Exception as e:
+            logging.warning(f"[ANN] Could not save IVF index: {e}")
+    return index
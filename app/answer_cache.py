@@ -0,0 +1,267 @@
+"""
+Answer Cache
+Cache câu trả lời AI cho các câu hỏi lặp lại (key = câu hỏi đã normalize + hash của RAG context)
+Viewer hỏi đi hỏi lại vài câu giống nhau -> phần lớn !ask không cần gọi LLM / tốn quota
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+from .lru_cache import LRUCache
+from .rag_text import normalize_text, trigrams
+
+CACHE_VERSION = 1
+_WORD_RE = re.compile(r'\w+')
+
+
+def normalize_question(question: str) -> str:
+    """Câu hỏi đã normalize, bỏ dấu câu ("ACN là ai??" và "acn la ai" cùng 1 key)"""
+    return " ".join(_WORD_RE.findall(normalize_text(question)))
+
+
+def context_hash(context: Optional[str]) -> str:
+    """sha1 của RAG context ('' nếu không có context)"""
+    if not context:
+        return ""
+    return hashlib.sha1(context.encode('utf-8')).hexdigest()
+
+
+def strip_mention(response: str, user_name: str) -> Optional[str]:
+    """
+    Bỏ "@user_name " ở đầu response của handler
+
+    Returns:
+        Câu trả lời không có mention, None nếu response không bắt đầu bằng mention (vd. câu báo lỗi)
+    """
+    response = response.strip()
+    if not user_name:
+        return response
+    prefix = f"@{user_name} "
+    return response[len(prefix):] if response.startswith(prefix) else None
+
+
+def apply_mention(answer: str, user_name: str, max_length: int = 200) -> str:
+    """Gắn @mention của người hỏi, cắt ở ranh giới từ nếu vượt max_length"""
+    response = f"@{user_name} {answer}" if user_name else answer
+    if len(response) > max_length:
+        response = response[:max_length - 3].rsplit(' ', 1)[0] + "..."
+    return response
+
+
+class AnswerCache:
+    def __init__(self, maxsize: int = 512, ttl: float = 600, near_duplicate: bool = False,
+                 similarity: float = 0.8, persist_path: Optional[str] = None, persist_interval: float = 30):
+        """
+        Args:
+            maxsize: Số câu trả lời tối đa
+            ttl: Số giây một câu trả lời còn hiệu lực
+            near_duplicate: Dùng lại câu trả lời của câu hỏi gần giống (trigram similarity, cùng RAG context)
+            similarity: Dice similarity tối thiểu để tính là gần giống
+            persist_path: File JSON lưu cache qua các lần restart (None = chỉ trong bộ nhớ)
+            persist_interval: Số giây tối thiểu giữa 2 lần ghi file
+        """
+        self.near_duplicate = near_duplicate
+        self.similarity = similarity
+        self.persist_path = Path(persist_path) if persist_path else None
+        self.persist_interval = persist_interval
+        self.near_hits = 0
+        self._cache = LRUCache(maxsize=maxsize, ttl=ttl)
+        self._save_lock = threading.Lock()
+        self._last_save = time.monotonic()
+        self._dirty = False
+        if self.persist_path:
+            self._load()
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    def get(self, question: str, context: Optional[str] = None) -> Optional[str]:
+        """
+        Câu trả lời đã cache (không có @mention)
+
+        Args:
+            question: Câu hỏi của viewer
+            context: RAG context dùng cho câu hỏi này
+
+        Returns:
+            Câu trả lời hoặc None
+        """
+        normalized = normalize_question(question)
+        c_hash = context_hash(context)
+        item = self._cache.get((normalized, c_hash))
+        if item is not None:
+            return item[0]
+
+        # Câu hỏi gần giống chỉ được dùng lại khi có cùng RAG context - không có context thì
+        # "acn bao nhiêu tuổi" và "acn bao nhiêu kg" rất giống nhau nhưng cần câu trả lời khác
+        if not self.near_duplicate or not c_hash:
+            return None
+        query_trigrams = trigrams(normalized)
+        if not query_trigrams:
+            return None
+        best, best_similarity = None, self.similarity
+        for (cached_question, cached_hash), (answer, cached_trigrams) in self._cache.items():
+            if cached_hash != c_hash or not cached_trigrams:
+                continue
+            similarity = 2 * len(query_trigrams & cached_trigrams) / (len(query_trigrams) + len(cached_trigrams))
+            if similarity >= best_similarity:
+                best, best_similarity = answer, similarity
+        if best is not None:
+            self.near_hits += 1
+            logging.info(f"[AnswerCache] Near-duplicate hit ({best_similarity:.2f}) for: '{question}'")
+        return best
+
+    def put(self, question: str, context: Optional[str], answer: str, ttl: Optional[float] = None):
+        """
+        Lưu câu trả lời (không có @mention)
+
+        Args:
+            question: Câu hỏi của viewer
+            context: RAG context dùng cho câu hỏi này
+            answer: Câu trả lời
+            ttl: TTL riêng (mặc định dùng ttl của cache)
+        """
+        normalized = normalize_question(question)
+        self._cache.put((normalized, context_hash(context)), (answer, frozenset(trigrams(normalized))), ttl=ttl)
+        self._dirty = True
+        if self.persist_path and time.monotonic() - self._last_save >= self.persist_interval:
+            self.save()
+
+    def clear(self):
+        self._cache.clear()
+        self._dirty = True
+
+    def stats(self) -> Dict:
+        return {**self._cache.stats(), 'near_hits': self.near_hits}
+
+    def save(self):
+        """Ghi cache ra persist_path (atomically qua file tạm)"""
+        if not self.persist_path:
+            return
+        with self._save_lock:
+            if not self._dirty:
+                return
+            now = time.time()
+            entries = [
+                {'question': question, 'context_hash': c_hash, 'answer': answer,
+                 'expires_at': None if remaining is None else now + remaining}
+                for (question, c_hash), (answer, _), remaining in self._cache.items_with_ttl()
+            ]
+            try:
+                self.persist_path.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = self.persist_path.with_suffix(self.persist_path.suffix + '.tmp')
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump({'version': CACHE_VERSION, 'entries': entries}, f, ensure_ascii=False)
+                os.replace(tmp_path, self.persist_path)
+                self._dirty = False
+                self._last_save = time.monotonic()
+                logging.info(f"[AnswerCache] Saved {len(entries)} answers to {self.persist_path}")
+            except Exception as e:
+                logging.warning(f"[AnswerCache] Could not save {self.persist_path}: {e}")
+
+    def _load(self):
+        """Load cache từ persist_path (bỏ qua entries đã hết hạn)"""
+        if not self.persist_path.exists():
+            return
+        try:
+            with open(self.persist_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') != CACHE_VERSION:
+                return
+            now = time.time()
+            loaded = 0
+            for entry in data.get('entries', []):
+                expires_at = entry.get('expires_at')
+                if expires_at is not None and expires_at <= now:
+                    continue
+                question = entry['question']
+                self._cache.put((question, entry['context_hash']),
+                                (entry['answer'], frozenset(trigrams(question))),
+                                ttl=None if expires_at is None else expires_at - now)
+                loaded += 1
+            self._dirty = False
+            logging.info(f"[AnswerCache] Loaded {loaded} answers from {self.persist_path}")
+        except Exception as e:
+            logging.warning(f"[AnswerCache] Could not load {self.persist_path}: {e}")
+
+
+class CachedAIHandler:
+    """
+    Đứng trước AI handler (Gemini / Ollama): trả câu trả lời đã cache, chỉ gọi LLM khi miss
+    Mọi attribute khác (rag, get_stats, is_available...) được chuyển thẳng cho handler gốc
+    """
+
+    def __init__(self, handler, cache: AnswerCache, max_length: Optional[int] = None):
+        """
+        Args:
+            handler: GeminiMultiKeyHandler / OllamaHandler
+            cache: AnswerCache
+            max_length: Độ dài tối đa của reply sau khi gắn @mention (default: theo handler, hoặc 200)
+        """
+        self.handler = handler
+        self.cache = cache
+        self.max_length = max_length or getattr(handler, 'max_length', 200)
+
+    def __getattr__(self, name):
+        if name == 'handler':
+            raise AttributeError(name)
+        return getattr(self.handler, name)
+
+    def _get_context(self, user_message: str) -> Optional[str]:
+        """RAG context giống handler dùng (RAG query cache nên lần gọi thứ 2 gần như miễn phí)"""
+        rag = getattr(self.handler, 'rag', None)
+        if rag is None:
+            return None
+        try:
+            return rag.get_context(user_message, max_length=300)
+        except Exception as e:
+            logging.warning(f"[AnswerCache] RAG context failed: {e}")
+            return None
+
+    def get_response(self, user_message: str, user_name: str = "", session_id: Optional[str] = None) -> str:
+        """
+        Câu trả lời từ cache nếu có, không thì hỏi handler và cache lại
+
+        Args:
+            user_message: Câu hỏi của viewer
+            user_name: Tên viewer
+            session_id: channelId của viewer
+
+        Returns:
+            Câu trả lời (có @mention)
+        """
+        # Viewer đang hỏi tiếp (có lịch sử) -> câu trả lời phụ thuộc lịch sử, không dùng / không lưu cache
+        sessions = getattr(self.handler, 'sessions', None)
+        if sessions is not None and sessions.has_history(session_id):
+            return self.handler.get_response(user_message, user_name, session_id=session_id)
+
+        context = self._get_context(user_message)
+        answer = self.cache.get(user_message, context)
+        if answer is not None:
+            logging.info(f"[AnswerCache] Hit for: '{user_message}'")
+            if sessions is not None:
+                sessions.add_turn(session_id, user_message, answer)
+            return apply_mention(answer, user_name, self.max_length)
+
+        response = self.handler.get_response(user_message, user_name, session_id=session_id)
+        # Không cache câu báo lỗi / fallback khi hết quota
+        if not response or response in getattr(self.handler, 'FALLBACK_RESPONSES', ()):
+            return response
+
+        answer = strip_mention(response, user_name)
+        if answer:
+            self.cache.put(user_message, context, answer)
+        return response
+
+    def close(self):
+        """Lưu cache (nếu có persist_path) và đóng handler gốc"""
+        self.cache.save()
+        close = getattr(self.handler, 'close', None)
+        if close:
+            close()
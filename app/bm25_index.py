@@ -0,0 +1,154 @@
+"""
+BM25 Index
+Xếp hạng knowledge entries bằng BM25 trên keywords + content (sparse term-document matrix)
+"""
+import logging
+from typing import Dict, List
+
+try:
+    import numpy as np
+    from scipy import sparse
+    HAS_BM25 = True
+except ImportError:
+    HAS_BM25 = False
+
+from .rag_text import tokenize
+
+
+class BM25Index:
+    # BM25 score không cùng thang với keyword scoring (10/5/2)
+    default_min_score = 4.0
+
+    def __init__(self, knowledge: Dict, k1: float = 1.5, b: float = 0.75, keyword_weight: float = 2.0):
+        """
+        Build BM25 weight matrix từ knowledge dict
+
+        Args:
+            knowledge: Dict entry_key -> {'keywords': [...], 'content': '...'}
+            k1: Term frequency saturation
+            b: Document length normalization
+            keyword_weight: Hệ số nhân term frequency của field keywords so với content
+        """
+        if not HAS_BM25:
+            raise ImportError("BM25 cần numpy và scipy: pip install numpy scipy")
+
+        self.k1 = k1
+        self.b = b
+        self.entry_keys = list(knowledge.keys())
+        self.entry_contents = [entry.get('content', '') for entry in knowledge.values()]
+        self.entry_keywords = [entry.get('keywords', []) for entry in knowledge.values()]
+        self.vocabulary = {}
+
+        # Term frequency của từng document (keywords được nhân keyword_weight)
+        rows, cols, tfs = [], [], []
+        doc_lengths = np.zeros(len(self.entry_keys), dtype=np.float32)
+        for doc_id, (keywords, content) in enumerate(zip(self.entry_keywords, self.entry_contents)):
+            term_freqs = {}
+            for keyword in keywords:
+                for token in tokenize(keyword):
+                    term_freqs[token] = term_freqs.get(token, 0.0) + keyword_weight
+            for token in tokenize(content):
+                term_freqs[token] = term_freqs.get(token, 0.0) + 1.0
+
+            for token, tf in term_freqs.items():
+                term_id = self.vocabulary.setdefault(token, len(self.vocabulary))
+                rows.append(term_id)
+                cols.append(doc_id)
+                tfs.append(tf)
+            doc_lengths[doc_id] = sum(term_freqs.values())
+
+        rows = np.asarray(rows, dtype=np.int32)
+        cols = np.asarray(cols, dtype=np.int32)
+        tfs = np.asarray(tfs, dtype=np.float32)
+
+        # Precompute BM25 weight cho mỗi cặp (term, doc) - query chỉ còn là 1 phép sparse dot
+        n_docs = len(self.entry_keys)
+        avg_length = float(doc_lengths.mean()) if n_docs else 0.0
+        doc_freqs = np.bincount(rows, minlength=len(self.vocabulary)).astype(np.float32)
+        idf = np.log1p((n_docs - doc_freqs + 0.5) / (doc_freqs + 0.5))
+        norm = k1 * (1.0 - b + b * doc_lengths[cols] / max(avg_length, 1e-9))
+        weights = idf[rows] * tfs * (k1 + 1.0) / (tfs + norm)
+
+        self.matrix = sparse.csr_matrix(
+            (weights, (rows, cols)), shape=(len(self.vocabulary), n_docs), dtype=np.float32
+        )
+        logging.info(f"[BM25] Index built: {n_docs} docs, {len(self.vocabulary)} terms")
+
+    def __len__(self) -> int:
+        return len(self.entry_keys)
+
+    def _query_matrix(self, queries: List[str]):
+        """Sparse n_queries x n_terms matrix đếm số lần mỗi term xuất hiện trong từng query"""
+        rows, cols = [], []
+        for row, query in enumerate(queries):
+            for token in tokenize(query):
+                term_id = self.vocabulary.get(token)
+                if term_id is not None:
+                    rows.append(row)
+                    cols.append(term_id)
+        # csr_matrix cộng dồn các cặp (row, term) trùng nhau -> term frequency
+        return sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.float32), (rows, cols)),
+            shape=(len(queries), len(self.vocabulary)), dtype=np.float32
+        )
+
+    def search(self, query: str, top_k: int = 3) -> List[Dict[str, any]]:
+        """
+        Chấm điểm BM25 cho query và lấy top-k entries
+
+        Args:
+            query: User query
+            top_k: Number of top results to return
+
+        Returns:
+            List of dicts with content and scores, sorted by score
+        """
+        return self.search_batch([query], top_k=top_k)[0]
+
+    def search_batch(self, queries: List[str], top_k: int = 3) -> List[List[Dict[str, any]]]:
+        """
+        Chấm điểm nhiều query cùng lúc: 1 phép sparse (queries x terms) @ (terms x docs)
+
+        Args:
+            queries: List of user queries
+            top_k: Number of top results per query
+
+        Returns:
+            List kết quả (như search) cho từng query, cùng thứ tự với queries
+        """
+        if not self.entry_keys or top_k <= 0 or not queries:
+            return [[] for _ in queries]
+
+        scores = (self._query_matrix(queries) @ self.matrix).tocsr()
+        scores.sum_duplicates()
+
+        batch_results = []
+        for row, query in enumerate(queries):
+            start, end = scores.indptr[row], scores.indptr[row + 1]
+            batch_results.append(self._top_results(query, scores.indices[start:end], scores.data[start:end], top_k))
+        return batch_results
+
+    def _top_results(self, query: str, doc_ids: "np.ndarray", values: "np.ndarray",
+                     top_k: int) -> List[Dict[str, any]]:
+        """Top-k docs của 1 query từ các (doc id, score) khác 0"""
+        if len(values) == 0:
+            return []
+
+        # Top-k bằng argpartition, hòa điểm thì giữ thứ tự entry
+        if len(values) > top_k:
+            top = np.argpartition(-values, top_k - 1)[:top_k]
+            doc_ids, values = doc_ids[top], values[top]
+        order = np.lexsort((doc_ids, -values))
+
+        query_tokens = set(tokenize(query))
+        results = []
+        for i in order:
+            doc_id = int(doc_ids[i])
+            results.append({
+                'score': round(float(values[i]), 3),
+                'content': self.entry_contents[doc_id],
+                'matched_keywords': [kw for kw in self.entry_keywords[doc_id]
+                                     if query_tokens.intersection(tokenize(kw))],
+                'entry_key': self.entry_keys[doc_id]
+            })
+        return results
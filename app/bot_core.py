@@ -5,6 +5,7 @@ Main bot logic and YouTube Live Chat integration
 import re
 import time
 import logging
+import threading
 from datetime import datetime
 from typing import Optional
 import pytchat
@@ -35,6 +36,7 @@ class YouTubeChatBot:
         self.processed_message_ids = set()  # Track processed messages to avoid duplicates
         self.last_auto_message_time = time.time()  # Track last auto message
         self.auto_message_interval = 180  # 3 minutes in seconds
+        self._send_lock = threading.Lock()  # AI replies are sent from worker threads
         
     def authenticate(self):
         """Authenticate with YouTube API"""
@@ -109,18 +111,19 @@ class YouTubeChatBot:
             if len(message) > 500:
                 message = message[:497] + "..."
             
-            self.youtube.liveChatMessages().insert(
-                part="snippet",
-                body={
-                    "snippet": {
-                        "liveChatId": self.live_chat_id,
-                        "type": "textMessageEvent",
-                        "textMessageDetails": {
-                            "messageText": message
+            with self._send_lock:
+                self.youtube.liveChatMessages().insert(
+                    part="snippet",
+                    body={
+                        "snippet": {
+                            "liveChatId": self.live_chat_id,
+                            "type": "textMessageEvent",
+                            "textMessageDetails": {
+                                "messageText": message
+                            }
                         }
                     }
-                }
-            ).execute()
+                ).execute()
             logging.info(f"Bot message sent: {message}")
         except Exception as e:
             print(Fore.RED + f"Error sending message: {e}" + Fore.RESET)
@@ -247,6 +250,8 @@ class YouTubeChatBot:
         except Exception as e:
             print(Fore.RED + f"Chat listener error: {e}" + Fore.RESET)
             logging.error(f"Chat listener error: {e}")
+        finally:
+            self.command_handler.close()
 
 def start_bot():
     """Initialize and start the bot"""
@@ -283,5 +288,8 @@ def start_bot():
     bot.live_chat_id = live_chat_id
     print(Fore.GREEN + f"✓ Connected to live chat!" + Fore.RESET)
     
+    # AI đã warm-up song song trong lúc xác thực / kết nối - chờ xong trước khi nghe chat
+    bot.command_handler.report_readiness()
+    
     # Start listening
     bot.start_chat_listener()
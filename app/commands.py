@@ -2,10 +2,13 @@
 Command Handler
 Processes chat commands like !say, !hello, !joke, etc.
 """
+import threading
 import time
 import random
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from typing import Optional
 from colorama import Fore
 
 try:
@@ -44,6 +47,12 @@ try:
 except ImportError:
     HAS_OLLAMA = False
 
+from .answer_cache import AnswerCache, CachedAIHandler, apply_mention, normalize_question, strip_mention
+from .micro_batch import MicroBatchingHandler
+from .provider_router import ProviderRouter
+from .session_store import SessionView, create_session_store
+from .single_flight import SingleFlight
+
 class CommandHandler:
     def __init__(self, bot):
         self.bot = bot
@@ -52,29 +61,76 @@ class CommandHandler:
         
         # Khởi tạo AI Handler (Gemini hoặc Ollama)
         self.ai_handler = None
+        self.ask_flight = None
+        self.ai_readiness = {}
+        self._ai_ready = None
         ai_config = self.bot.config.get('ai', {})
         ai_enabled = ai_config.get('enabled', False)
         provider = ai_config.get('provider', 'gemini')
+        rag_config = ai_config.get('rag', {})
         
-        print(Fore.CYAN + f"[AI] Enabled: {ai_enabled}, Provider: {provider}" + Fore.RESET)
+        print(Fore.CYAN + f"[AI] Enabled: {ai_enabled}, Provider: {', '.join(ai_config.get('providers') or [provider])}" + Fore.RESET)
         
         if ai_enabled:
             try:
-                if provider == 'ollama':
-                    if not HAS_OLLAMA:
-                        raise ImportError("Ollama handler not available. `pip install ollama`")
-                    
-                    ollama_model = ai_config.get('ollama_model', 'llama3')
-                    ollama_host = ai_config.get('ollama_host', 'http://localhost:11434')
-                    self.ai_handler = OllamaHandler(model=ollama_model, host=ollama_host)
-                    print(Fore.GREEN + f"✓ AI Handler: Ollama (Model: {ollama_model})" + Fore.RESET)
-
-                else: # Mặc định là Gemini
-                    if not HAS_GEMINI:
-                        raise ImportError("Gemini handler not available")
-                    
-                    self.ai_handler = GeminiMultiKeyHandler(ai_config)
-                    print(Fore.GREEN + f"✓ AI Handler: Gemini Multi-Key" + Fore.RESET)
+                # Nhiều provider (vd. ["ollama", "gemini"]) -> router với circuit breaker + hedged requests
+                providers = ai_config.get('providers') or [provider]
+                if len(providers) == 1:
+                    self.ai_handler = self._create_ai_provider(providers[0], ai_config, rag_config)
+                else:
+                    # 1 lịch sử cho mỗi viewer dù câu trả lời đến từ backend nào
+                    sessions = create_session_store(ai_config.get('sessions'))
+                    # Khởi tạo các provider song song
+                    backends = []
+                    with ThreadPoolExecutor(max_workers=len(providers)) as executor:
+                        futures = [(name, executor.submit(self._create_ai_provider, name, ai_config, rag_config,
+                                                          SessionView(sessions)))
+                                   for name in providers]
+                        for name, future in futures:
+                            try:
+                                backends.append((name, future.result()))
+                            except Exception as e:
+                                print(Fore.YELLOW + f"⚠ AI provider {name} unavailable: {e}" + Fore.RESET)
+                    if not backends:
+                        raise Exception("Không có AI provider nào hoạt động")
+                    router_config = ai_config.get('router', {})
+                    self.ai_handler = ProviderRouter(
+                        backends,
+                        hedge=router_config.get('hedge', True),
+                        hedge_delay=router_config.get('hedge_delay'),
+                        min_hedge_delay=router_config.get('min_hedge_delay', 0.5),
+                        timeout=router_config.get('timeout', 30),
+                        failure_threshold=router_config.get('failure_threshold', 0.5),
+                        cooldown=router_config.get('cooldown', 30),
+                        max_workers=router_config.get('workers', 8),
+                        sessions=sessions
+                    )
+                    print(Fore.GREEN + f"✓ AI Router: {' -> '.join(name for name, _ in backends)}" + Fore.RESET)
+                
+                # Cache câu trả lời cho câu hỏi lặp lại (đứng trước handler)
+                cache_config = ai_config.get('answer_cache', {})
+                if cache_config.get('enabled', True):
+                    answer_cache = AnswerCache(
+                        maxsize=cache_config.get('size', 512),
+                        ttl=cache_config.get('ttl', 600),
+                        near_duplicate=cache_config.get('near_duplicate', False),
+                        similarity=cache_config.get('similarity', 0.8),
+                        persist_path=cache_config.get('persist_path')
+                    )
+                    self.ai_handler = CachedAIHandler(self.ai_handler, answer_cache)
+                    print(Fore.GREEN + f"✓ Answer cache: {len(answer_cache)} answers loaded" + Fore.RESET)
+                
+                # !ask chạy trên worker threads, câu hỏi giống nhau đang chạy được gộp làm 1
+                self.ask_flight = SingleFlight(
+                    max_inflight=ai_config.get('ask_max_inflight', 8),
+                    timeout=ai_config.get('ask_timeout', 60),
+                    max_workers=ai_config.get('ask_workers', 4)
+                )
+                
+                # Warm-up chạy nền trong lúc bot xác thực YouTube / chờ nhập URL
+                self._ai_ready = threading.Event()
+                self._ai_providers = providers
+                threading.Thread(target=self._warm_up_ai, name="ai-warm-up", daemon=True).start()
                     
             except Exception as e:
                 print(Fore.YELLOW + f"⚠ AI disabled: {e}" + Fore.RESET)
@@ -84,6 +140,100 @@ class CommandHandler:
         else:
             print(Fore.YELLOW + "[AI] Disabled in config" + Fore.RESET)
         
+    def _create_ai_provider(self, provider: str, ai_config: dict, rag_config: dict, sessions=None):
+        """Tạo AI handler cho 1 provider ('ollama' / 'gemini'), sessions: lịch sử dùng chung (router)"""
+        if provider == 'ollama':
+            if not HAS_OLLAMA:
+                raise ImportError("Ollama handler not available. `pip install ollama`")
+            
+            ollama_model = ai_config.get('ollama_model', 'llama3')
+            # Nhiều Ollama server -> cân bằng tải theo số request đang chạy
+            ollama_host = ai_config.get('ollama_hosts') or ai_config.get('ollama_host', 'http://localhost:11434')
+            handler = OllamaHandler(
+                model=ollama_model,
+                host=ollama_host,
+                rag_config=rag_config,
+                stream=ai_config.get('ollama_stream', True),
+                num_predict=ai_config.get('ollama_num_predict'),
+                max_sentences=ai_config.get('ollama_max_sentences', 2),
+                session_config=ai_config.get('sessions'),
+                keep_alive=ai_config.get('ollama_keep_alive', '30m'),
+                host_concurrency=ai_config.get('ollama_host_concurrency', 4),
+                sessions=sessions
+            )
+            print(Fore.GREEN + f"✓ AI Handler: Ollama (Model: {ollama_model}, {len(handler.pool)} host(s))" + Fore.RESET)
+
+            # Chat storm: gộp các câu hỏi đang chờ vào 1 prompt
+            batch_config = ai_config.get('batch', {})
+            if batch_config.get('enabled', False):
+                handler = MicroBatchingHandler(
+                    handler,
+                    max_batch=batch_config.get('max_batch', 4),
+                    max_wait=batch_config.get('max_wait', 0.5),
+                    concurrency=batch_config.get('concurrency', 1)
+                )
+                print(Fore.GREEN + f"✓ Micro-batching: up to {handler.max_batch} questions/prompt" + Fore.RESET)
+
+        else: # Mặc định là Gemini
+            if not HAS_GEMINI:
+                raise ImportError("Gemini handler not available")
+            
+            handler = GeminiMultiKeyHandler(ai_config, rag_config=rag_config, sessions=sessions)
+            print(Fore.GREEN + f"✓ AI Handler: Gemini Multi-Key" + Fore.RESET)
+        
+        return handler
+    
+    def _warm_up_ai(self):
+        """Load model / health-check keys của mọi provider (chạy trên thread riêng)"""
+        try:
+            warm_up = getattr(self.ai_handler, 'warm_up', None)
+            if warm_up is not None:
+                results = warm_up()
+                # 1 provider trả về 1 kết quả, router trả về kết quả theo tên provider
+                self.ai_readiness = {self._ai_providers[0]: results} if 'ok' in results else results
+        except Exception as e:
+            logging.error(f"[AI] Warm-up error: {e}")
+            self.ai_readiness = {name: {'ok': False, 'seconds': 0.0, 'detail': str(e)} for name in self._ai_providers}
+        finally:
+            self._ai_ready.set()
+    
+    def report_readiness(self, timeout: Optional[float] = None) -> bool:
+        """
+        Chờ warm-up xong và in trạng thái từng AI provider (gọi trước khi bắt đầu nghe chat)
+        
+        Args:
+            timeout: Số giây chờ tối đa (default: ai.warm_up_timeout)
+            
+        Returns:
+            True nếu có ít nhất 1 provider sẵn sàng
+        """
+        if self._ai_ready is None:
+            return self.ai_handler is not None
+        if timeout is None:
+            timeout = self.bot.config.get('ai', {}).get('warm_up_timeout', 120)
+        print(Fore.CYAN + "[AI] Đang chờ AI sẵn sàng..." + Fore.RESET)
+        if not self._ai_ready.wait(timeout):
+            print(Fore.YELLOW + f"⚠ AI warm-up chưa xong sau {timeout}s, bot vẫn bắt đầu nghe chat" + Fore.RESET)
+            return False
+        
+        for name, result in self.ai_readiness.items():
+            if result['ok']:
+                print(Fore.GREEN + f"✓ AI {name} ready ({result['seconds']:.1f}s): {result['detail']}" + Fore.RESET)
+            else:
+                print(Fore.YELLOW + f"⚠ AI {name} not ready ({result['seconds']:.1f}s): {result['detail']}" + Fore.RESET)
+        return any(result['ok'] for result in self.ai_readiness.values())
+    
+    def close(self):
+        """Dọn dẹp khi bot dừng (dừng AI workers, lưu answer cache)"""
+        if self.ask_flight:
+            self.ask_flight.shutdown()
+        close = getattr(self.ai_handler, 'close', None)
+        if close:
+            try:
+                close()
+            except Exception as e:
+                logging.error(f"[AI] Close error: {e}")
+    
     def check_permission(self, author, permission_type: str) -> bool:
         """Check if user has permission for a command"""
         permission = self.bot.config['permissions'].get(permission_type, 'all')
@@ -279,6 +429,8 @@ class CommandHandler:
             return
         
         self.processing_commands.add(cmd_key)
+        # AI request chạy async -> cmd_key được bỏ khi có câu trả lời
+        handed_off = False
         
         try:
             # Ưu tiên dùng AI nếu có
@@ -291,31 +443,10 @@ class CommandHandler:
                     self.processing_commands.discard(cmd_key)
                     return
                 
-                try:
-                    logging.info(f"[AI Request] {author.name}: '{query}'")
-                    # Lấy response từ AI (synchronous - chờ đến khi có response)
-                    ai_response = self.ai_handler.get_response(query, author.name)
-                    
-                    # Validate AI response
-                    if not ai_response or not ai_response.strip():
-                        logging.warning(f"[AI] Returned empty response, using fallback")
-                        ai_response = "Xin lỗi, tôi đang suy nghĩ quá nhiều! 🤔"
-                    
-                    logging.info(f"[AI Response] '{ai_response}'")
-                    print(Fore.GREEN + f"[AI] Response: '{ai_response[:80]}...'" + Fore.RESET)
-                    
-                    # Không mention username - YouTube tự động mention khi reply
-                    self.bot.send_message(ai_response)
-                    self.processing_commands.discard(cmd_key)
-                    return
-                    
-                except Exception as e:
-                    logging.error(f"[AI Error] {e}")
-                    print(Fore.RED + f"[AI Error] {e}" + Fore.RESET)
-                    # Send fallback message instead of using Wikipedia
-                    self.bot.send_message("Hmm, để tôi nghĩ lại nhé... 💭")
-                    self.processing_commands.discard(cmd_key)
-                    return
+                # Chạy trên worker thread, câu hỏi giống nhau đang chạy thì chờ chung kết quả
+                self._ask_ai(author, query, cmd_key)
+                handed_off = True
+                return
             else:
                 print(Fore.YELLOW + "[DEBUG] AI handler not available, using Wikipedia fallback" + Fore.RESET)
             
@@ -361,7 +492,61 @@ class CommandHandler:
             self.bot.send_message(f"{author.name} Có lỗi xảy ra khi tìm kiếm.")
         finally:
             # Always remove from processing set
+            if not handed_off:
+                self.processing_commands.discard(cmd_key)
+    
+    def _ask_ai(self, author, query: str, cmd_key: str):
+        """
+        Gửi câu hỏi cho AI qua single-flight: viewer hỏi cùng câu (sau normalize) trong lúc câu đó
+        đang được trả lời sẽ nhận chung kết quả, mention được đổi sang tên của từng người
+        """
+        logging.info(f"[AI Request] {author.name}: '{query}'")
+        asked_by = author.name
+        session_id = author.channelId
+        
+        def ask():
+            return self.ai_handler.get_response(query, asked_by, session_id=session_id), asked_by
+        
+        def deliver(result, error):
+            try:
+                if error is not None:
+                    logging.error(f"[AI Error] {error}")
+                    print(Fore.RED + f"[AI Error] {error}" + Fore.RESET)
+                    # Send fallback message instead of using Wikipedia
+                    self.bot.send_message("Hmm, để tôi nghĩ lại nhé... 💭")
+                    return
+                
+                ai_response, leader_name = result
+                # Validate AI response
+                if not ai_response or not ai_response.strip():
+                    logging.warning(f"[AI] Returned empty response, using fallback")
+                    ai_response = "Xin lỗi, tôi đang suy nghĩ quá nhiều! 🤔"
+                elif leader_name != author.name:
+                    answer = strip_mention(ai_response, leader_name)
+                    if answer is not None:
+                        ai_response = apply_mention(answer, author.name,
+                                                    getattr(self.ai_handler, 'max_length', 200))
+                
+                logging.info(f"[AI Response] '{ai_response}'")
+                print(Fore.GREEN + f"[AI] Response: '{ai_response[:80]}...'" + Fore.RESET)
+                
+                # Không mention username - YouTube tự động mention khi reply
+                self.bot.send_message(ai_response)
+            finally:
+                self.processing_commands.discard(cmd_key)
+        
+        # Câu hỏi tiếp theo dựa vào lịch sử riêng của viewer -> chỉ gộp với chính viewer đó
+        flight_key = normalize_question(query)
+        sessions = getattr(self.ai_handler, 'sessions', None)
+        if sessions is not None and sessions.has_history(session_id):
+            flight_key = (flight_key, session_id)
+        status = self.ask_flight.submit(flight_key, ask, deliver)
+        if status == SingleFlight.JOINED:
+            logging.info(f"[AI] Coalesced with in-flight request: '{query}'")
+        elif status == SingleFlight.REJECTED:
             self.processing_commands.discard(cmd_key)
+            logging.warning(f"[AI] Too many requests in flight, rejected: '{query}'")
+            self.bot.send_message(f"{author.name} Bot đang trả lời nhiều câu quá, hỏi lại sau chút nha! ⏳")
     
     def cmd_time(self, author):
         """Get current time"""
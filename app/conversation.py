@@ -0,0 +1,115 @@
+"""
+Conversation Memory
+Lịch sử hội thoại có giới hạn token (sliding window), các lượt cũ bị bỏ hoặc gộp vào 1 đoạn tóm tắt
+Giữ prompt size / latency ổn định suốt stream dài thay vì tăng dần đến khi request fail
+"""
+import logging
+import threading
+from collections import deque
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Ước lượng thô cho tiếng Việt (đủ để giữ budget, không cần tokenizer thật)
+CHARS_PER_TOKEN = 2
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+class ConversationWindow:
+    def __init__(self, max_tokens: int = 2000,
+                 summarizer: Optional[Callable[[str, List[Tuple[str, str]]], Optional[str]]] = None,
+                 max_summary_chars: int = 600, on_change: Optional[Callable[[], None]] = None):
+        """
+        Args:
+            max_tokens: Budget token cho lịch sử (tóm tắt + các lượt gần nhất)
+            summarizer: summarizer(summary_cũ, các_lượt_bị_đẩy_ra) -> summary mới (None = chỉ bỏ lượt cũ)
+            max_summary_chars: Độ dài tối đa của đoạn tóm tắt
+            on_change: Gọi (trên thread tóm tắt) sau khi tóm tắt nền làm đổi số token
+        """
+        self.max_tokens = max_tokens
+        self.summarizer = summarizer
+        self.max_summary_chars = max_summary_chars
+        self.on_change = on_change
+        self.summary = ""
+        self._turns = deque()  # (user_text, reply, tokens)
+        self._tokens = 0
+        self._pending = []  # Lượt bị đẩy ra đang chờ tóm tắt
+        self._summarizing = False
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._turns)
+
+    @property
+    def tokens(self) -> int:
+        """Số token ước lượng của lịch sử (gồm tóm tắt)"""
+        return self._tokens + (estimate_tokens(self.summary) if self.summary else 0)
+
+    def turns(self) -> List[Tuple[str, str]]:
+        """Các lượt (user_text, reply) còn trong window, cũ nhất trước"""
+        with self._lock:
+            return [(user_text, reply) for user_text, reply, _ in self._turns]
+
+    def messages(self) -> List[Dict[str, str]]:
+        """Lịch sử dạng [{'role': 'user' | 'assistant', 'content': ...}] (không gồm tóm tắt)"""
+        messages = []
+        for user_text, reply in self.turns():
+            messages.append({'role': 'user', 'content': user_text})
+            messages.append({'role': 'assistant', 'content': reply})
+        return messages
+
+    def add_turn(self, user_text: str, reply: str):
+        """
+        Thêm 1 lượt hỏi-đáp, đẩy lượt cũ nhất ra khi vượt budget
+
+        Args:
+            user_text: Tin nhắn của user (không gồm RAG context)
+            reply: Câu trả lời của bot
+        """
+        evicted = []
+        with self._lock:
+            tokens = estimate_tokens(user_text) + estimate_tokens(reply)
+            self._turns.append((user_text, reply, tokens))
+            self._tokens += tokens
+            budget = self.max_tokens - (estimate_tokens(self.summary) if self.summary else 0)
+            # Luôn giữ lượt mới nhất
+            while self._tokens > budget and len(self._turns) > 1:
+                old_user, old_reply, old_tokens = self._turns.popleft()
+                self._tokens -= old_tokens
+                evicted.append((old_user, old_reply))
+            if evicted and self.summarizer:
+                self._pending.extend(evicted)
+                if self._summarizing:
+                    return
+                self._summarizing = True
+            else:
+                return
+        # Tóm tắt chạy nền để không làm chậm câu trả lời hiện tại
+        threading.Thread(target=self._summarize, daemon=True).start()
+
+    def _summarize(self):
+        while True:
+            with self._lock:
+                turns, self._pending = self._pending, []
+                summary = self.summary
+                if not turns:
+                    self._summarizing = False
+                    return
+            try:
+                new_summary = self.summarizer(summary, turns)
+            except Exception as e:
+                logging.warning(f"[Conversation] Summarize failed: {e}")
+                new_summary = None
+            if new_summary:
+                with self._lock:
+                    self.summary = new_summary.strip()[:self.max_summary_chars]
+                if self.on_change:
+                    self.on_change()
+
+    def clear(self):
+        with self._lock:
+            self._turns.clear()
+            self._tokens = 0
+            self._pending = []
+            self.summary = ""
@@ -0,0 +1,263 @@
+"""
+FTS Knowledge Store
+Knowledge base lưu trong SQLite FTS5 - không cần load toàn bộ JSON, share read-only giữa nhiều bot process
+
+Import từ JSON:
+    python -m app.fts_store import config/knowledge.json config/knowledge.db
+Upsert 1 entry (không cần reload bot):
+    python -m app.fts_store upsert config/knowledge.db acn_discord --keywords "discord acn" "link dc" --content "..."
+"""
+import argparse
+import json
+import logging
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, List
+
+from .rag_text import normalize_text, tokenize
+
+
+def _has_fts5() -> bool:
+    try:
+        conn = sqlite3.connect(':memory:')
+        conn.execute("CREATE VIRTUAL TABLE t USING fts5(x)")
+        conn.close()
+        return True
+    except sqlite3.Error:
+        return False
+
+
+HAS_FTS5 = _has_fts5()
+
+# entries_fts.rowid = entries.id (INTEGER PRIMARY KEY -> rowid ổn định kể cả sau VACUUM)
+# Xóa / cập nhật FTS row theo rowid thay vì lọc cột key (UNINDEXED -> full table scan)
+SCHEMA_VERSION = 1
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL UNIQUE,
+    keywords TEXT NOT NULL,
+    content TEXT NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts USING fts5(
+    keywords, content,
+    tokenize = 'unicode61 remove_diacritics 2'
+);
+"""
+
+
+class FTSKnowledgeStore:
+    # Điểm FTS5 bm25() cùng thang với BM25 backend
+    default_min_score = 4.0
+
+    def __init__(self, db_path: str = "config/knowledge.db", read_only: bool = False,
+                 keyword_weight: float = 2.0):
+        """
+        Mở SQLite knowledge store
+
+        Args:
+            db_path: Path to SQLite database
+            read_only: Mở ở chế độ read-only (bot process chỉ đọc)
+            keyword_weight: Trọng số bm25 của cột keywords so với content
+        """
+        if not HAS_FTS5:
+            raise ImportError("SQLite build không hỗ trợ FTS5")
+
+        self.db_path = Path(db_path)
+        self.read_only = read_only
+        self.keyword_weight = keyword_weight
+        self._local = threading.local()
+        # Connection riêng chỉ để đọc PRAGMA data_version (giá trị chỉ so sánh được trên cùng 1 connection)
+        self._version_conn = None
+        self._version_lock = threading.Lock()
+
+        if not read_only:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            self._migrate(self._conn())
+
+    def _conn(self) -> sqlite3.Connection:
+        """1 connection cho mỗi thread (sqlite3 connection không share được giữa threads)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+        return conn
+
+    def _connect(self, **kwargs) -> sqlite3.Connection:
+        if self.read_only:
+            return sqlite3.connect(f"file:{self.db_path.as_posix()}?mode=ro", uri=True, **kwargs)
+        return sqlite3.connect(str(self.db_path), **kwargs)
+
+    def data_version(self) -> int:
+        """Đổi mỗi khi connection / process khác ghi database (vd. CLI upsert) -> cache kết quả đã cũ"""
+        with self._version_lock:
+            if self._version_conn is None:
+                self._version_conn = self._connect(check_same_thread=False)
+            return self._version_conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def __len__(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def _migrate(self, conn: sqlite3.Connection):
+        """Tạo schema, hoặc chuyển database cũ (FTS row theo cột key) sang FTS row theo rowid"""
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            return
+        with conn:
+            has_entries = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'entries'").fetchone()
+            rows = conn.execute("SELECT key, keywords, content FROM entries").fetchall() if has_entries else []
+            conn.execute("DROP TABLE IF EXISTS entries_fts")
+            conn.execute("DROP TABLE IF EXISTS entries")
+            for statement in SCHEMA.split(';'):
+                if statement.strip():
+                    conn.execute(statement)
+            for key, keywords_json, content in rows:
+                self._upsert(conn, key, json.loads(keywords_json), content)
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        if rows:
+            logging.info(f"[FTS] Migrated {len(rows)} entries in {self.db_path} to rowid-keyed index")
+
+    def upsert(self, key: str, keywords: List[str], content: str):
+        """
+        Thêm hoặc cập nhật 1 entry (có hiệu lực ngay cho mọi process đang đọc)
+
+        Args:
+            key: Entry key
+            keywords: List of keywords
+            content: Entry content
+        """
+        conn = self._conn()
+        with conn:
+            self._upsert(conn, key, keywords, content)
+
+    def _upsert(self, conn: sqlite3.Connection, key: str, keywords: List[str], content: str):
+        # ON CONFLICT DO UPDATE giữ nguyên id -> FTS row cũ nằm ở cùng rowid
+        conn.execute(
+            "INSERT INTO entries (key, keywords, content) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET keywords = excluded.keywords, content = excluded.content",
+            (key, json.dumps(keywords, ensure_ascii=False), content)
+        )
+        row_id = conn.execute("SELECT id FROM entries WHERE key = ?", (key,)).fetchone()[0]
+        conn.execute("DELETE FROM entries_fts WHERE rowid = ?", (row_id,))
+        # FTS index text đã normalize (bỏ dấu, kể cả đ) để khớp với query tokens
+        conn.execute(
+            "INSERT INTO entries_fts (rowid, keywords, content) VALUES (?, ?, ?)",
+            (row_id, normalize_text(" | ".join(keywords)), normalize_text(content))
+        )
+
+    @staticmethod
+    def _delete(conn: sqlite3.Connection, key: str):
+        row = conn.execute("SELECT id FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return
+        conn.execute("DELETE FROM entries_fts WHERE rowid = ?", row)
+        conn.execute("DELETE FROM entries WHERE id = ?", row)
+
+    def delete(self, key: str):
+        """Xóa 1 entry"""
+        conn = self._conn()
+        with conn:
+            self._delete(conn, key)
+
+    def import_json(self, json_path: str, prune: bool = True) -> int:
+        """
+        Import knowledge từ file JSON (format config/knowledge.json)
+
+        Args:
+            json_path: Path to knowledge JSON file
+            prune: Xóa các entry không còn trong JSON
+
+        Returns:
+            Số entries đã import
+        """
+        with open(json_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+
+        conn = self._conn()
+        with conn:
+            for key, entry in data.items():
+                self._upsert(conn, key, entry.get('keywords', []), entry.get('content', ''))
+            if prune:
+                existing = {row[0] for row in conn.execute("SELECT key FROM entries")}
+                for key in existing - data.keys():
+                    self._delete(conn, key)
+        logging.info(f"[FTS] Imported {len(data)} entries from {json_path} into {self.db_path}")
+        return len(data)
+
+    def search(self, query: str, top_k: int = 3) -> List[Dict[str, any]]:
+        """
+        Full-text search với FTS5 bm25 ranking
+
+        Args:
+            query: User query
+            top_k: Number of top results to return
+
+        Returns:
+            List of dicts with content and scores, sorted by score
+        """
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens or top_k <= 0:
+            return []
+
+        match = " OR ".join(f'"{token}"' for token in tokens)
+        rows = self._conn().execute(
+            "SELECT e.key, e.keywords, e.content, -bm25(entries_fts, ?, 1.0) AS score "
+            "FROM entries_fts JOIN entries e ON e.id = entries_fts.rowid "
+            "WHERE entries_fts MATCH ? ORDER BY score DESC LIMIT ?",
+            (self.keyword_weight, match, top_k)
+        ).fetchall()
+
+        query_tokens = set(tokens)
+        results = []
+        for key, keywords_json, content, score in rows:
+            keywords = json.loads(keywords_json)
+            results.append({
+                'score': round(score, 3),
+                'content': content,
+                'matched_keywords': [kw for kw in keywords if query_tokens.intersection(tokenize(kw))],
+                'entry_key': key
+            })
+        return results
+
+    def search_batch(self, queries: List[str], top_k: int = 3) -> List[List[Dict[str, any]]]:
+        """Search nhiều query trên cùng 1 connection (FTS5 MATCH không gộp được nhiều query)"""
+        return [self.search(query, top_k=top_k) for query in queries]
+
+
+def main():
+    """CLI: import JSON / upsert / delete entries"""
+    parser = argparse.ArgumentParser(description="SQLite FTS5 knowledge store tool")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p_import = sub.add_parser('import', help="Import knowledge JSON vào database")
+    p_import.add_argument('json_path')
+    p_import.add_argument('db_path')
+    p_import.add_argument('--keep', action='store_true', help="Không xóa entries không còn trong JSON")
+
+    p_upsert = sub.add_parser('upsert', help="Thêm/cập nhật 1 entry")
+    p_upsert.add_argument('db_path')
+    p_upsert.add_argument('key')
+    p_upsert.add_argument('--keywords', nargs='+', required=True)
+    p_upsert.add_argument('--content', required=True)
+
+    p_delete = sub.add_parser('delete', help="Xóa 1 entry")
+    p_delete.add_argument('db_path')
+    p_delete.add_argument('key')
+
+    args = parser.parse_args()
+    store = FTSKnowledgeStore(args.db_path)
+    if args.command == 'import':
+        count = store.import_json(args.json_path, prune=not args.keep)
+        print(f"✓ Imported {count} entries into {args.db_path}")
+    elif args.command == 'upsert':
+        store.upsert(args.key, args.keywords, args.content)
+        print(f"✓ Upserted '{args.key}'")
+    elif args.command == 'delete':
+        store.delete(args.key)
+        print(f"✓ Deleted '{args.key}'")
+
+
+if __name__ == "__main__":
+    main()
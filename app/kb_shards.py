@@ -0,0 +1,295 @@
+"""
+Sharded Knowledge Base
+Nhiều knowledge base (shard) theo channel / topic, mỗi shard chỉ load + index khi được dùng lần đầu
+và bị giải phóng khi idle -> bộ nhớ tỉ lệ với số stream đang chạy thay vì tổng số creator
+
+Config (section 'rag'):
+    "shards": {"global": "config/knowledge.json", "acn": "config/knowledge/acn.json"}
+    "shard_dir": "config/knowledge"       # <shard_dir>/<name>.json cho shard không khai báo trong 'shards'
+    "active_shards": ["acn", "global"]    # shards mặc định cho mỗi query
+    "shard_idle_timeout": 900             # giây không dùng trước khi shard bị evict
+"""
+import logging
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from .lru_cache import LRUCache
+from .rag_handler import RAGKnowledgeBase, pack_context
+from .rag_text import normalize_text
+
+
+class ShardedKnowledgeBase:
+    def __init__(self, config: Optional[Dict] = None):
+        """
+        Args:
+            config: RAG config (dùng chung cho mọi shard) + các key 'shards', 'shard_dir',
+                'active_shards', 'shard_idle_timeout'
+        """
+        self.config = config or {}
+        self.shard_paths = {name: Path(path) for name, path in self.config.get('shards', {}).items()}
+        shard_dir = self.config.get('shard_dir')
+        self.shard_dir = Path(shard_dir) if shard_dir else None
+        self.active_shards = list(self.config.get('active_shards') or self.shard_paths or ['global'])
+        self.idle_timeout = self.config.get('shard_idle_timeout', 900)
+
+        # Config của từng RAGKnowledgeBase (bỏ các key của sharding để cache key / fingerprint không đổi)
+        self._shard_config = {key: value for key, value in self.config.items()
+                              if key not in ('shards', 'shard_dir', 'active_shards', 'shard_idle_timeout')}
+        self._shards = {}       # name -> RAGKnowledgeBase
+        self._last_used = {}    # name -> time.monotonic() lần dùng cuối
+        self._load_locks = {}   # name -> Lock (2 query cùng lúc không load 1 shard 2 lần)
+        self._missing = set()   # shard không có file (chỉ warning 1 lần)
+        self._lock = threading.Lock()
+        self._cache = LRUCache(maxsize=self.config.get('cache_size', 1024),
+                               ttl=self.config.get('cache_ttl', 300))
+        self._reaper_stop = threading.Event()
+        self._reaper_thread = None
+        if self.idle_timeout:
+            self._reaper_thread = threading.Thread(target=self._reap_loop, name="rag-shard-reaper", daemon=True)
+            self._reaper_thread.start()
+
+        logging.info(f"[RAG] Sharded knowledge base: {len(self.available_shards())} shards, "
+                     f"active: {self.active_shards}")
+
+    def __len__(self) -> int:
+        """Số knowledge entries của các shard đang load"""
+        with self._lock:
+            shards = list(self._shards.values())
+        return sum(len(shard) for shard in shards)
+
+    def available_shards(self) -> List[str]:
+        """Tên các shard có thể load (khai báo trong config + file trong shard_dir)"""
+        names = set(self.shard_paths)
+        if self.shard_dir and self.shard_dir.is_dir():
+            names.update(path.stem for path in self.shard_dir.glob('*.json'))
+        return sorted(names)
+
+    def loaded_shards(self) -> List[str]:
+        """Tên các shard đang nằm trong bộ nhớ"""
+        with self._lock:
+            return sorted(self._shards)
+
+    def _shard_path(self, name: str) -> Optional[Path]:
+        path = self.shard_paths.get(name)
+        if path is None and self.shard_dir:
+            path = self.shard_dir / f"{name}.json"
+        if path is None or not path.exists():
+            return None
+        return path
+
+    def get_shard(self, name: str) -> Optional[RAGKnowledgeBase]:
+        """
+        Lấy shard, load + index nếu chưa có trong bộ nhớ
+
+        Args:
+            name: Tên shard
+
+        Returns:
+            RAGKnowledgeBase hoặc None nếu shard không tồn tại
+        """
+        with self._lock:
+            shard = self._shards.get(name)
+            if shard is not None:
+                self._last_used[name] = time.monotonic()
+                return shard
+            load_lock = self._load_locks.setdefault(name, threading.Lock())
+
+        with load_lock:
+            with self._lock:
+                shard = self._shards.get(name)
+            if shard is not None:
+                return shard
+
+            path = self._shard_path(name)
+            if path is None:
+                if name not in self._missing:
+                    self._missing.add(name)
+                    logging.warning(f"[RAG] Shard '{name}' not found")
+                return None
+
+            config = dict(self._shard_config)
+            # Mỗi shard FTS có database riêng cạnh file JSON
+            if config.get('backend') == 'fts':
+                config['fts_path'] = str(path.with_suffix('.db'))
+            shard = RAGKnowledgeBase(str(path), config=config)
+            if config.get('watch', True):
+                shard.start_watching(config.get('watch_interval', 2.0))
+
+            with self._lock:
+                self._shards[name] = shard
+                self._last_used[name] = time.monotonic()
+            logging.info(f"[RAG] Shard '{name}' loaded: {len(shard)} entries")
+            return shard
+
+    def evict(self, name: str) -> bool:
+        """
+        Giải phóng 1 shard (query đang chạy trên shard đó vẫn hoàn thành bình thường)
+
+        Returns:
+            True nếu shard đang được load
+        """
+        with self._lock:
+            shard = self._shards.pop(name, None)
+            self._last_used.pop(name, None)
+        if shard is None:
+            return False
+        shard.stop_watching()
+        logging.info(f"[RAG] Shard '{name}' evicted")
+        return True
+
+    def evict_idle(self, max_idle: Optional[float] = None) -> List[str]:
+        """
+        Evict các shard không được dùng trong max_idle giây
+
+        Args:
+            max_idle: Số giây idle tối đa (default: shard_idle_timeout)
+
+        Returns:
+            Tên các shard đã evict
+        """
+        max_idle = self.idle_timeout if max_idle is None else max_idle
+        now = time.monotonic()
+        with self._lock:
+            idle = [name for name, last_used in self._last_used.items() if now - last_used >= max_idle]
+        return [name for name in idle if self.evict(name)]
+
+    def _reap_loop(self):
+        interval = max(1.0, self.idle_timeout / 4)
+        while not self._reaper_stop.wait(interval):
+            self.evict_idle()
+
+    def close(self):
+        """Dừng reaper thread và evict toàn bộ shards"""
+        self._reaper_stop.set()
+        for name in self.loaded_shards():
+            self.evict(name)
+
+    def _resolve(self, shards: Optional[Sequence[str]]) -> List[Tuple[str, RAGKnowledgeBase]]:
+        """(name, shard) của các shard được query (bỏ qua shard không tồn tại)"""
+        resolved = []
+        for name in dict.fromkeys(shards or self.active_shards):
+            shard = self.get_shard(name)
+            if shard is not None:
+                resolved.append((name, shard))
+        return resolved
+
+    def search(self, query: str, top_k: int = 3, shards: Optional[Sequence[str]] = None) -> List[Dict[str, any]]:
+        """
+        Fan-out search trên các shard rồi merge theo score
+
+        Args:
+            query: User query
+            top_k: Number of top results to return
+            shards: Tên các shard cần query (default: active_shards)
+
+        Returns:
+            List of dicts with content, scores và 'shard', sorted by score
+        """
+        return self.search_batch([query], top_k=top_k, shards=shards)[0]
+
+    def search_batch(self, queries: List[str], top_k: int = 3,
+                     shards: Optional[Sequence[str]] = None) -> List[List[Dict[str, any]]]:
+        """
+        search cho nhiều query: mỗi shard chỉ nhận 1 lời gọi search_batch
+
+        Returns:
+            List kết quả (như search) cho từng query, cùng thứ tự với queries
+        """
+        merged = [[] for _ in queries]
+        for order, (name, shard) in enumerate(self._resolve(shards)):
+            for row, results in enumerate(shard.search_batch(queries, top_k=top_k)):
+                for result in results:
+                    result['shard'] = name
+                    merged[row].append((order, result))
+        # Hòa điểm thì shard đứng trước (thường là shard riêng của channel) được ưu tiên
+        return [[result for _, result in sorted(row, key=lambda item: (-item[1]['score'], item[0]))[:top_k]]
+                for row in merged]
+
+    def get_context(self, query: str, max_length: int = 400, min_score: Optional[float] = None,
+                    max_tokens: Optional[int] = None, shards: Optional[Sequence[str]] = None) -> Optional[str]:
+        """
+        Context từ các shard: lọc theo min_score của từng shard, merge rồi pack chung 1 token budget
+
+        Args:
+            query: User query
+            max_length: Maximum context length (characters)
+            min_score: Minimum score required (default: theo backend)
+            max_tokens: Token budget cho context (default: config 'context_tokens', hoặc max_length / 3)
+            shards: Tên các shard cần query (default: active_shards)
+
+        Returns:
+            Combined context string or None
+        """
+        return self.get_context_batch([query], max_length, min_score, max_tokens, shards=shards)[0]
+
+    def get_context_batch(self, queries: List[str], max_length: int = 400, min_score: Optional[float] = None,
+                          max_tokens: Optional[int] = None,
+                          shards: Optional[Sequence[str]] = None) -> List[Optional[str]]:
+        """
+        get_context cho nhiều query (query đã có trong cache không search lại)
+
+        Returns:
+            Context (hoặc None) cho từng query, cùng thứ tự với queries
+        """
+        resolved = self._resolve(shards)
+        # Cache key gồm generation của từng shard -> reload 1 shard chỉ làm mất cache của query có shard đó
+        generations = tuple((name, id(shard), shard.generation) for name, shard in resolved)
+        contexts, pending = {}, {}
+        for query in queries:
+            normalized = normalize_text(query)
+            if normalized in contexts or normalized in pending:
+                continue
+            context = self._cache.get((generations, normalized, max_length, min_score, max_tokens), default=False)
+            if context is False:
+                pending[normalized] = query
+            else:
+                contexts[normalized] = context
+
+        if pending:
+            token_budget = max_tokens
+            if token_budget is None:
+                token_budget = self.config.get('context_tokens', max_length // 3)
+            top_k = self.config.get('context_entries', 2)
+            pending_queries = list(pending.values())
+
+            merged = [[] for _ in pending_queries]
+            for order, (name, shard) in enumerate(resolved):
+                # Search và passages từ cùng 1 state của shard (watcher có thể reload shard bất cứ lúc nào)
+                batch, index, passages = shard.search_batch_passages(pending_queries, top_k=top_k)
+                shard_min_score = min_score
+                if shard_min_score is None:
+                    shard_min_score = shard.config.get(f'{shard.backend}_min_score', index.default_min_score)
+                for row, results in enumerate(batch):
+                    for result in results:
+                        if result['score'] >= shard_min_score:
+                            merged[row].append((-result['score'], order, result,
+                                                shard._get_passages(passages, result)))
+
+            unchanged = generations == tuple((name, id(shard), shard.generation) for name, shard in resolved)
+            for (normalized, query), candidates in zip(pending.items(), merged):
+                context = None
+                if candidates:
+                    candidates.sort(key=lambda item: item[:2])
+                    ranked = [(result, entry_passages) for _, _, result, entry_passages in candidates[:top_k]]
+                    context = pack_context(query, ranked, max_length, token_budget)
+                else:
+                    logging.info(f"[RAG] No context found in shards {[name for name, _ in resolved]} "
+                                 f"for query: '{query}'")
+                contexts[normalized] = context
+                if unchanged:
+                    self._cache.put((generations, normalized, max_length, min_score, max_tokens), context)
+
+        return [contexts[normalize_text(query)] for query in queries]
+
+    def reload(self, wait: bool = False):
+        """Reload các shard đang load"""
+        with self._lock:
+            shards = list(self._shards.values())
+        for shard in shards:
+            shard.reload(wait=wait)
+
+    def get_cache_stats(self) -> Dict:
+        """Cache counters + trạng thái shards"""
+        return {**self._cache.stats(), 'loaded_shards': self.loaded_shards()}
@@ -0,0 +1,128 @@
+"""
+Knowledge Base Snapshot
+Lưu knowledge đã normalize + index đã build ra 1 file để lần start sau load gần như không cần parse
+
+Format: magic | header length | header (pickle) | payload (pickle protocol 5) | out-of-band buffers
+Numpy arrays trong index được lưu out-of-band và load lại bằng mmap (zero-copy, read-only)
+"""
+import hashlib
+import logging
+import mmap
+import os
+import pickle
+import struct
+from pathlib import Path
+from typing import Any, Optional
+
+MAGIC = b'RAGSNAP1'
+# Tăng khi cấu trúc index (hoặc cách tokenize) thay đổi để snapshot cũ tự bị bỏ qua
+SNAPSHOT_VERSION = 4
+_ALIGN = 64
+
+
+def _file_hash(path: Path) -> str:
+    """sha1 của nội dung file"""
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _source_meta(source_path: Path) -> dict:
+    stat = source_path.stat()
+    return {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+
+
+def save_snapshot(snapshot_path: str, source_path: str, fingerprint: str, payload: Any):
+    """
+    Ghi snapshot (atomically qua file tạm)
+
+    Args:
+        snapshot_path: File snapshot
+        source_path: File knowledge gốc (để validate mtime/hash khi load)
+        fingerprint: Hash của backend + config dùng để build index
+        payload: Object cần lưu (knowledge + index)
+    """
+    snapshot_path = Path(snapshot_path)
+    source_path = Path(source_path)
+
+    buffers = []
+    data = pickle.dumps(payload, protocol=5, buffer_callback=buffers.append)
+    raw_buffers = [buffer.raw() for buffer in buffers]
+
+    header = {
+        'version': SNAPSHOT_VERSION,
+        'fingerprint': fingerprint,
+        'source_hash': _file_hash(source_path),
+        **_source_meta(source_path),
+        'payload_length': len(data),
+        'buffer_lengths': [buffer.nbytes for buffer in raw_buffers],
+    }
+    header_bytes = pickle.dumps(header, protocol=5)
+
+    snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = snapshot_path.with_suffix(snapshot_path.suffix + '.tmp')
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', len(header_bytes)))
+        f.write(header_bytes)
+        f.write(data)
+        for buffer in raw_buffers:
+            f.write(b'\0' * (-f.tell() % _ALIGN))
+            f.write(buffer)
+    os.replace(tmp_path, snapshot_path)
+    logging.info(f"[Snapshot] Saved {snapshot_path} ({len(raw_buffers)} mmap buffers)")
+
+
+def load_snapshot(snapshot_path: str, source_path: str, fingerprint: str) -> Optional[Any]:
+    """
+    Load snapshot nếu còn hợp lệ với file knowledge gốc
+
+    Args:
+        snapshot_path: File snapshot
+        source_path: File knowledge gốc
+        fingerprint: Hash của backend + config hiện tại
+
+    Returns:
+        Payload hoặc None nếu không có / đã cũ / lỗi
+    """
+    snapshot_path = Path(snapshot_path)
+    source_path = Path(source_path)
+    if not snapshot_path.exists() or not source_path.exists():
+        return None
+
+    try:
+        with open(snapshot_path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if mm[:len(MAGIC)] != MAGIC:
+            return None
+        pos = len(MAGIC)
+        header_length, = struct.unpack_from('<Q', mm, pos)
+        pos += 8
+        header = pickle.loads(mm[pos:pos + header_length])
+        pos += header_length
+
+        if header.get('version') != SNAPSHOT_VERSION or header.get('fingerprint') != fingerprint:
+            return None
+        # Fast path: mtime + size không đổi. Nếu đổi (vd. touch/copy) thì so hash nội dung
+        meta = _source_meta(source_path)
+        if (meta['mtime_ns'], meta['size']) != (header['mtime_ns'], header['size']):
+            if _file_hash(source_path) != header['source_hash']:
+                logging.info(f"[Snapshot] {snapshot_path.name} is stale, rebuilding")
+                return None
+
+        view = memoryview(mm)
+        payload_view = view[pos:pos + header['payload_length']]
+        pos += header['payload_length']
+        buffers = []
+        for length in header['buffer_lengths']:
+            pos += -pos % _ALIGN
+            buffers.append(view[pos:pos + length])
+            pos += length
+        payload = pickle.loads(payload_view, buffers=buffers)
+        logging.info(f"[Snapshot] Loaded {snapshot_path.name}")
+        return payload
+    except Exception as e:
+        logging.warning(f"[Snapshot] Could not load {snapshot_path}: {e}")
+        return None
@@ -0,0 +1,221 @@
+"""
+Key Scheduler
+Chọn API key còn nhiều quota nhất (token bucket theo RPM + đếm RPD cho từng key)
+Key bị 429 được nghỉ đúng thời gian Retry-After, request chờ 1 chút khi tạm hết capacity
+"""
+import re
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+DAY_SECONDS = 86400
+# Thời gian nghỉ khi bị 429 mà không có Retry-After (cửa sổ RPM là 1 phút)
+DEFAULT_RATE_LIMIT_COOLDOWN = 60.0
+# Lỗi liên tiếp (không phải 429) trước khi key bị cho nghỉ
+MAX_CONSECUTIVE_ERRORS = 5
+ERROR_COOLDOWN = 60.0
+
+_RETRY_PATTERNS = (
+    re.compile(r'retry[_ ]delay\s*\{\s*seconds:\s*(\d+(?:\.\d+)?)', re.IGNORECASE),
+    re.compile(r'retry(?:-after)?\s*(?:in|after)?\s*:?\s*(\d+(?:\.\d+)?)\s*s', re.IGNORECASE),
+)
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """429 / hết quota"""
+    message = str(error).lower()
+    return "429" in message or "quota" in message or "resource" in message or "rate limit" in message
+
+
+def parse_retry_after(error: Exception) -> Optional[float]:
+    """
+    Số giây phải chờ theo lỗi 429 (header Retry-After hoặc retry_delay trong message)
+
+    Returns:
+        Số giây, None nếu lỗi không nói
+    """
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if headers:
+        value = headers.get('Retry-After') or headers.get('retry-after')
+        try:
+            return float(value) if value is not None else None
+        except ValueError:
+            pass
+    message = str(error)
+    for pattern in _RETRY_PATTERNS:
+        match = pattern.search(message)
+        if match:
+            return float(match.group(1))
+    return None
+
+
+class KeyScheduler:
+    def __init__(self, keys: List[str], rpm: Optional[float] = 10, rpd: Optional[int] = 250,
+                 max_inflight_per_key: Optional[int] = None):
+        """
+        Args:
+            keys: API keys
+            rpm: Số request/phút cho mỗi key (None = không giới hạn)
+            rpd: Số request/ngày cho mỗi key (None = không giới hạn)
+            max_inflight_per_key: Số request đang chạy tối đa trên mỗi key (None = không giới hạn)
+        """
+        self.rpm = rpm
+        self.rpd = rpd
+        self.max_inflight_per_key = max_inflight_per_key
+        self._cond = threading.Condition()
+        now = time.monotonic()
+        self._keys = {
+            key: {
+                'tokens': float(rpm) if rpm else 0.0,
+                'refilled_at': now,
+                'day_start': time.time(),
+                'day_count': 0,
+                'cooldown_until': 0.0,
+                'consecutive_errors': 0,
+                'inflight': 0,
+                'count': 0,
+                'errors': 0,
+                'rate_limited': 0,
+            }
+            for key in keys
+        }
+
+    def remove(self, key: str):
+        with self._cond:
+            self._keys.pop(key, None)
+
+    def _refill(self, state: Dict, now: float):
+        """Token bucket: hồi rpm token mỗi phút, tối đa rpm; reset đếm RPD sau 24h"""
+        if self.rpm:
+            state['tokens'] = min(float(self.rpm), state['tokens'] + (now - state['refilled_at']) * self.rpm / 60)
+        state['refilled_at'] = now
+        if time.time() - state['day_start'] > DAY_SECONDS:
+            state['day_start'] = time.time()
+            state['day_count'] = 0
+
+    def _wait_time(self, state: Dict, now: float) -> Optional[float]:
+        """Số giây đến khi key dùng được (0 = ngay), None nếu hết quota ngày"""
+        if self.rpd and state['day_count'] >= self.rpd:
+            return None
+        wait = max(0.0, state['cooldown_until'] - now)
+        if self.rpm and state['tokens'] < 1:
+            wait = max(wait, (1 - state['tokens']) * 60 / self.rpm)
+        return wait
+
+    def _load(self, state: Dict) -> float:
+        """Tỉ lệ capacity còn lại (cao hơn = ít tải hơn)"""
+        minute = state['tokens'] / self.rpm if self.rpm else 1.0
+        day = 1 - state['day_count'] / self.rpd if self.rpd else 1.0
+        return min(minute, day)
+
+    def acquire(self, timeout: float = 0, exclude: Iterable[str] = ()) -> Optional[str]:
+        """
+        Lấy key rảnh còn nhiều capacity nhất, chờ tối đa timeout giây nếu tạm thời tất cả đều bận / hết
+        Phải gọi release(key) khi request xong
+
+        Args:
+            timeout: Số giây chờ tối đa
+            exclude: Keys không dùng (vd. đã thử trong request này)
+
+        Returns:
+            Key (đã trừ 1 request), None nếu không có key nào trong thời gian chờ
+        """
+        exclude = set(exclude)
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                best, best_load, next_wait = None, -1.0, None
+                # Có key còn quota nhưng đang bận -> chờ release()
+                busy = False
+                for key, state in self._keys.items():
+                    if key in exclude:
+                        continue
+                    self._refill(state, now)
+                    wait = self._wait_time(state, now)
+                    if wait is None:
+                        continue
+                    if self.max_inflight_per_key and state['inflight'] >= self.max_inflight_per_key:
+                        busy = True
+                        continue
+                    if wait > 0:
+                        next_wait = wait if next_wait is None else min(next_wait, wait)
+                        continue
+                    load = self._load(state)
+                    if load > best_load:
+                        best, best_load = key, load
+
+                if best is not None:
+                    state = self._keys[best]
+                    if self.rpm:
+                        state['tokens'] -= 1
+                    state['day_count'] += 1
+                    state['inflight'] += 1
+                    return best
+
+                remaining = deadline - now
+                if next_wait is not None and next_wait <= remaining:
+                    self._cond.wait(next_wait)
+                elif busy and remaining > 0:
+                    self._cond.wait(remaining)
+                else:
+                    return None
+
+    def release(self, key: str):
+        """Request trên key đã xong (thành công hay lỗi)"""
+        with self._cond:
+            state = self._keys.get(key)
+            if state and state['inflight'] > 0:
+                state['inflight'] -= 1
+            self._cond.notify_all()
+
+    def report_success(self, key: str):
+        with self._cond:
+            state = self._keys.get(key)
+            if state:
+                state['count'] += 1
+                state['consecutive_errors'] = 0
+
+    def report_error(self, key: str, error: Exception):
+        """
+        Ghi nhận lỗi: 429 -> nghỉ theo Retry-After (mặc định 60s), lỗi khác liên tục -> nghỉ ERROR_COOLDOWN
+
+        Args:
+            key: Key vừa lỗi
+            error: Exception từ API
+        """
+        with self._cond:
+            state = self._keys.get(key)
+            if not state:
+                return
+            state['errors'] += 1
+            now = time.monotonic()
+            if is_rate_limit_error(error):
+                state['rate_limited'] += 1
+                cooldown = parse_retry_after(error) or DEFAULT_RATE_LIMIT_COOLDOWN
+                state['cooldown_until'] = max(state['cooldown_until'], now + cooldown)
+            else:
+                state['consecutive_errors'] += 1
+                if state['consecutive_errors'] >= MAX_CONSECUTIVE_ERRORS:
+                    state['consecutive_errors'] = 0
+                    state['cooldown_until'] = max(state['cooldown_until'], now + ERROR_COOLDOWN)
+            self._cond.notify_all()
+
+    def capacity(self) -> Dict[str, Dict]:
+        """Capacity còn lại của từng key"""
+        with self._cond:
+            now = time.monotonic()
+            result = {}
+            for key, state in self._keys.items():
+                self._refill(state, now)
+                result[key] = {
+                    'minute_remaining': int(state['tokens']) if self.rpm else None,
+                    'day_remaining': self.rpd - state['day_count'] if self.rpd else None,
+                    'cooldown': max(0.0, state['cooldown_until'] - now),
+                    'inflight': state['inflight'],
+                    'count': state['count'],
+                    'errors': state['errors'],
+                    'rate_limited': state['rate_limited'],
+                }
+            return result
@@ -0,0 +1,96 @@
+"""
+LRU Cache
+Cache có giới hạn kích thước + TTL, thread-safe, đếm hit/miss
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+_MISSING = object()
+
+
+class LRUCache:
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        """
+        Args:
+            maxsize: Số entry tối đa (entry ít dùng nhất bị loại trước)
+            ttl: Số giây một entry còn hiệu lực (None = không hết hạn)
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Lấy value (và đánh dấu vừa dùng), default nếu không có hoặc đã hết hạn"""
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is not _MISSING:
+                value, expires_at = item
+                if expires_at is None or expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """
+        Lưu value
+
+        Args:
+            key: Cache key
+            value: Value
+            ttl: TTL riêng cho entry này (mặc định dùng self.ttl)
+        """
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """Xóa và trả về value"""
+        with self._lock:
+            item = self._data.pop(key, _MISSING)
+            return default if item is _MISSING else item[0]
+
+    def clear(self):
+        """Xóa toàn bộ entries (giữ nguyên hit/miss counters)"""
+        with self._lock:
+            self._data.clear()
+
+    def items(self):
+        """Snapshot các (key, value) còn hạn, theo thứ tự ít dùng -> vừa dùng"""
+        now = time.monotonic()
+        with self._lock:
+            return [(key, value) for key, (value, expires_at) in self._data.items()
+                    if expires_at is None or expires_at > now]
+
+    def items_with_ttl(self) -> List[Tuple[Hashable, Any, Optional[float]]]:
+        """Snapshot các (key, value, số giây còn hiệu lực hoặc None) còn hạn, theo thứ tự ít dùng -> vừa dùng"""
+        now = time.monotonic()
+        with self._lock:
+            return [(key, value, None if expires_at is None else expires_at - now)
+                    for key, (value, expires_at) in self._data.items()
+                    if expires_at is None or expires_at > now]
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters"""
+        total = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 3) if total else 0.0,
+        }
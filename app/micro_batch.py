@@ -0,0 +1,150 @@
+"""
+Micro-batching
+Khi chat bùng nổ, gộp nhiều câu hỏi khác nhau đang chờ vào 1 prompt (1 lần gọi model) rồi tách câu trả lời
+Ít câu hỏi -> gửi ngay từng câu như bình thường; hàng đợi càng dài -> batch càng lớn và chờ gom lâu hơn
+"""
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import List, Optional, Tuple
+
+
+class MicroBatchingHandler:
+    """
+    Đứng trước AI handler có get_batch_response (OllamaHandler)
+    Mọi attribute khác (rag, get_stats, is_available...) được chuyển thẳng cho handler gốc
+    """
+
+    def __init__(self, handler, max_batch: int = 4, max_wait: float = 0.5, concurrency: int = 1):
+        """
+        Args:
+            handler: Handler có get_response + get_batch_response
+            max_batch: Số câu hỏi tối đa trong 1 prompt
+            max_wait: Thời gian chờ gom batch tối đa (giây) khi hàng đợi dài
+            concurrency: Số lời gọi model chạy song song
+        """
+        self.handler = handler
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait
+        self._queue = deque()  # (user_message, user_name, session_id, Future)
+        self._cond = threading.Condition()
+        self._closed = False
+        self.stats = {'questions': 0, 'calls': 0, 'batched_calls': 0, 'fallbacks': 0}
+        self._threads = [
+            threading.Thread(target=self._dispatch_loop, name=f"micro-batch-{i}", daemon=True)
+            for i in range(max(1, concurrency))
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def __getattr__(self, name):
+        if name == 'handler':
+            raise AttributeError(name)
+        return getattr(self.handler, name)
+
+    def get_response(self, user_message: str, user_name: str = "", session_id: Optional[str] = None) -> str:
+        """
+        Xếp câu hỏi vào hàng đợi và chờ câu trả lời (block thread gọi)
+
+        Args:
+            user_message: Câu hỏi của viewer
+            user_name: Tên viewer
+            session_id: channelId của viewer
+
+        Returns:
+            Câu trả lời (có @mention)
+        """
+        future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Micro-batcher is closed")
+            self._queue.append((user_message, user_name, session_id, future))
+            self.stats['questions'] += 1
+            self._cond.notify()
+        return future.result()
+
+    def _wait_window(self, depth: int) -> float:
+        """Thời gian chờ gom thêm câu hỏi: tỉ lệ với độ dài hàng đợi (1 câu -> gần như gửi ngay)"""
+        if depth <= 1:
+            return 0.0
+        return self.max_wait * min(1.0, depth / self.max_batch)
+
+    def _next_batch(self) -> Optional[List[Tuple[str, str, Optional[str], Future]]]:
+        """Lấy batch tiếp theo (None khi đã close)"""
+        with self._cond:
+            while not self._queue and not self._closed:
+                self._cond.wait()
+            if self._closed and not self._queue:
+                return None
+
+            # Hàng đợi đang dài (chat storm) -> chờ thêm 1 chút cho batch đầy hơn
+            deadline = time.monotonic() + self._wait_window(len(self._queue))
+            while len(self._queue) < self.max_batch and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            size = min(len(self._queue), self.max_batch)
+            return [self._queue.popleft() for _ in range(size)]
+
+    def _dispatch_loop(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            if len(batch) == 1:
+                self._answer_single(*batch[0])
+            else:
+                self._answer_batch(batch)
+
+    def _answer_single(self, user_message: str, user_name: str, session_id: Optional[str], future: Future):
+        self.stats['calls'] += 1
+        try:
+            future.set_result(self.handler.get_response(user_message, user_name, session_id=session_id))
+        except Exception as e:
+            future.set_exception(e)
+
+    def _answer_batch(self, batch: List[Tuple[str, str, Optional[str], Future]]):
+        # Câu hỏi tiếp theo của viewer cần lịch sử riêng -> hỏi riêng
+        sessions = getattr(self.handler, 'sessions', None)
+        if sessions is not None:
+            followups, fresh = [], []
+            for item in batch:
+                (followups if sessions.has_history(item[2]) else fresh).append(item)
+            batch = fresh
+            for item in followups:
+                self._answer_single(*item)
+            if len(batch) <= 1:
+                for item in batch:
+                    self._answer_single(*item)
+                return
+
+        self.stats['calls'] += 1
+        self.stats['batched_calls'] += 1
+        logging.info(f"[MicroBatch] {len(batch)} questions in 1 prompt ({len(self._queue)} still queued)")
+        try:
+            answers = self.handler.get_batch_response([(message, name) for message, name, _, _ in batch],
+                                                      session_ids=[session_id for _, _, session_id, _ in batch])
+        except Exception as e:
+            logging.warning(f"[MicroBatch] Batch call failed, answering individually: {e}")
+            answers = [None] * len(batch)
+
+        # Câu model không trả lời / parse lỗi -> hỏi riêng
+        for (user_message, user_name, session_id, future), answer in zip(batch, answers):
+            if answer:
+                future.set_result(answer)
+            else:
+                self.stats['fallbacks'] += 1
+                self._answer_single(user_message, user_name, session_id, future)
+
+    def close(self):
+        """Dừng dispatcher threads (câu hỏi còn trong hàng đợi vẫn được trả lời trước)"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        close = getattr(self.handler, 'close', None)
+        if close:
+            close()
@@ -2,35 +2,82 @@
 Ollama AI Handler
 Connects to a local Ollama instance to get AI responses.
 """
-import ollama
+import json
 import logging
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple, Union
 from colorama import Fore
 
+from .ollama_pool import OllamaHostPool
+from .session_store import create_session_store
+
 try:
-    from .rag_handler import RAGKnowledgeBase
+    from .rag_handler import get_shared_knowledge_base
     HAS_RAG = True
 except ImportError:
     HAS_RAG = False
 
+# Giới hạn độ dài tin nhắn YouTube chat mà bot dùng (gồm cả @mention)
+MAX_MESSAGE_LENGTH = 190
+# Tiếng Việt có dấu + emoji tốn nhiều token hơn tiếng Anh: ~2 ký tự / token khi ước lượng num_predict
+CHARS_PER_TOKEN = 2
+# Kết thúc câu: dấu câu + emoji/ký hiệu đi kèm, theo sau là khoảng trắng (hoặc hết text khi đã xong)
+_SENTENCE_END_RE = re.compile(r'[.!?…]+[^\w\s]*(?=\s)')
+_FINAL_SENTENCE_END_RE = re.compile(r'[.!?…]+[^\w\s]*(?=\s|$)')
+
+
 class OllamaHandler:
-    def __init__(self, model: str, host: str):
+    ERROR_RESPONSE = "Lỗi rồi, không kết nối được với AI local (Ollama). Bạn chắc là đã bật Ollama lên chưa?"
+    # Câu báo lỗi không được cache như câu trả lời thật
+    FALLBACK_RESPONSES = (ERROR_RESPONSE,)
+
+    def __init__(self, model: str, host: Union[str, List], rag_config: Optional[Dict] = None, stream: bool = True,
+                 max_length: int = MAX_MESSAGE_LENGTH, num_predict: Optional[int] = None,
+                 max_sentences: int = 2, min_sentence_chars: int = 30, session_config: Optional[Dict] = None,
+                 keep_alive: Optional[str] = "30m", host_concurrency: int = 4, sessions=None):
         """
         Initialize Ollama handler.
         
         Args:
             model: The name of the Ollama model to use (e.g., 'llama3').
-            host: The URL of the Ollama host (e.g., 'http://localhost:11434').
+            host: The URL of the Ollama host (e.g., 'http://localhost:11434'), or a list of hosts
+                (URLs or {'url': ..., 'max_concurrency': ...}) to load-balance across.
+            rag_config: Optional RAG config ('rag' section of the ai config).
+            stream: Stream tokens and stop generating as soon as the reply fills the chat budget.
+            max_length: Maximum chat message length, including the @mention.
+            num_predict: Output token cap (default: derived from max_length).
+            max_sentences: Stop after this many complete sentences (0 = no limit).
+            min_sentence_chars: Stop at a sentence end when less budget than this is left,
+                since another sentence would not fit anyway.
+            session_config: Per-viewer conversation memory ('sessions' section of the ai config).
+            keep_alive: How long Ollama keeps the model loaded after a request (e.g. '30m', -1 = forever).
+            host_concurrency: Max in-flight requests per host, for hosts that do not set their own.
+            sessions: Shared session store (e.g. behind ProviderRouter); default: own store from session_config.
         """
         self.model = model
         self.host = host
-        self.client = ollama.Client(host=host)
+        self.pool = OllamaHostPool(host, default_concurrency=host_concurrency)
+        self.stream = stream
+        self.max_length = max_length
+        self.num_predict = num_predict
+        self.max_sentences = max_sentences
+        self.min_sentence_chars = min_sentence_chars
+        self.keep_alive = keep_alive
+        self.sessions = sessions if sessions is not None else create_session_store(session_config)
+        self.stats = {'requests': 0, 'early_stops': 0, 'ttft_total': 0.0, 'latency_total': 0.0,
+                      'last_ttft': None}
+        # get_response chạy trên nhiều worker thread (router, micro-batch, single-flight)
+        self._stats_lock = threading.Lock()
         
         # Initialize RAG Knowledge Base
         self.rag = None
         if HAS_RAG:
             try:
-                self.rag = RAGKnowledgeBase('config/knowledge.json')
-                print(Fore.GREEN + f"  ✓ RAG Knowledge Base: {len(self.rag.knowledge)} entries loaded" + Fore.RESET)
+                self.rag = get_shared_knowledge_base('config/knowledge.json', rag_config)
+                print(Fore.GREEN + f"  ✓ RAG Knowledge Base: {len(self.rag)} entries loaded" + Fore.RESET)
             except Exception as e:
                 print(Fore.YELLOW + f"  ⚠ RAG failed to load: {e}" + Fore.RESET)
                 self.rag = None
@@ -49,13 +96,14 @@ QUY TẮC TUYỆT ĐỐI:
 - CONTEXT là sự thật tuyệt đối về ACN, không được thay đổi hoặc bổ sung thêm"""
         logging.info(f"✓ Ollama Handler ready (Model: {model}, Host: {host})")
 
-    def get_response(self, user_message: str, user_name: str = "") -> str:
+    def get_response(self, user_message: str, user_name: str = "", session_id: Optional[str] = None) -> str:
         """
         Get AI response from local Ollama instance.
         
         Args:
             user_message: The user's message.
             user_name: The user's display name.
+            session_id: The user's channelId, for follow-up questions (None = no memory).
             
         Returns:
             AI response string.
@@ -63,7 +111,7 @@ QUY TẮC TUYỆT ĐỐI:
         try:
             # Get RAG context if available
             context = None
-            if self.rag:
+            if self.rag is not None:
                 context = self.rag.get_context(user_message, max_length=300)
                 if context:
                     logging.info(f"[Ollama/RAG] ✓ Found context for: '{user_message[:50]}...'")
@@ -75,11 +123,7 @@ QUY TẮC TUYỆT ĐỐI:
             # Build prompt (with or without context)
             if context:
                 # Có context - trả lời dựa vào knowledge base
-                messages = [
-                    {
-                        'role': 'system',
-                        'content': self.system_prompt
-                    },
+                messages = self._history_messages(session_id) + [
                     {
                         'role': 'user',
                         'content': f"""Dựa vào CONTEXT sau:
@@ -93,39 +137,289 @@ Trả lời câu hỏi của user: "{user_message}"
             else:
                 # Không có context - trả lời bằng kiến thức chung
                 logging.info(f"[Ollama] No RAG context, using general knowledge for: '{user_message}'")
-                messages = [
-                    {
-                        'role': 'system',
-                        'content': self.system_prompt
-                    },
+                messages = self._history_messages(session_id) + [
                     {
                         'role': 'user',
                         'content': f'Trả lời câu hỏi: "{user_message}"'
                     }
                 ]
 
+            # Budget cho phần trả lời (trừ @mention)
+            prefix = f"@{user_name} " if user_name else ""
+            budget = self.max_length - len(prefix)
+
             logging.info(f"[Ollama] Sending request to model: {self.model}")
-            response = self.client.chat(
-                model=self.model,
-                messages=messages
-            )
-            
-            ai_response = response['message']['content'].strip()
+            if self.stream:
+                ai_response = self._generate_streaming(messages, budget)
+            else:
+                with self.pool.client() as client:
+                    response = client.chat(
+                        model=self.model,
+                        messages=messages,
+                        options={'num_predict': self._num_predict(budget)},
+                        keep_alive=self.keep_alive
+                    )
+                complete = response.get('done_reason') != 'length'
+                ai_response = self._fit(response['message']['content'], budget, complete=complete)
+            self.sessions.add_turn(session_id, user_message, ai_response)
             
             # Thêm mention tên user vào đầu response (nếu có user_name)
-            if user_name:
-                ai_response = f"@{user_name} {ai_response}"
-            
-            # Giới hạn độ dài để không bị YouTube API từ chối
-            if len(ai_response) > 190:
-                ai_response = ai_response[:187] + "..."
+            ai_response = prefix + ai_response
 
             logging.info(f"[Ollama] Response: '{ai_response}'")
             return ai_response
 
         except Exception as e:
             logging.error(f"[Ollama] Error: {e}")
-            return "Lỗi rồi, không kết nối được với AI local (Ollama). Bạn chắc là đã bật Ollama lên chưa?"
+            return self.ERROR_RESPONSE
+
+    def warm_up(self) -> Dict:
+        """
+        Load model vào RAM/VRAM và prefill system prompt (prefix chung của mọi request được Ollama cache lại)
+        để viewer đầu tiên không phải chờ load model
+        
+        Returns:
+            {'ok': bool, 'seconds': float, 'detail': str}
+        """
+        start = time.monotonic()
+        
+        def warm(host):
+            try:
+                host.client.chat(
+                    model=self.model,
+                    messages=[
+                        {'role': 'system', 'content': self.system_prompt},
+                        {'role': 'user', 'content': 'ping'}
+                    ],
+                    options={'num_predict': 1},
+                    keep_alive=self.keep_alive
+                )
+                return None
+            except Exception as e:
+                logging.error(f"[Ollama] Warm-up failed on {host.url}: {e}")
+                return e
+        
+        # Mọi host load model song song
+        with ThreadPoolExecutor(max_workers=len(self.pool)) as executor:
+            errors = list(executor.map(warm, self.pool.hosts))
+        ready = sum(error is None for error in errors)
+        for host, error in zip(self.pool.hosts, errors):
+            if error is not None:
+                self.pool.eject(host)
+        seconds = time.monotonic() - start
+        logging.info(f"[Ollama] Warm-up done in {seconds:.1f}s ({ready}/{len(errors)} hosts)")
+        
+        if len(errors) == 1:
+            detail = str(errors[0]) if errors[0] else f"model {self.model} loaded (keep_alive: {self.keep_alive})"
+        else:
+            detail = f"model {self.model} loaded on {ready}/{len(errors)} hosts (keep_alive: {self.keep_alive})"
+        return {'ok': ready > 0, 'seconds': seconds, 'detail': detail}
+    
+    def get_batch_response(self, questions: List[Tuple[str, str]],
+                           session_ids: Optional[List[Optional[str]]] = None) -> List[Optional[str]]:
+        """
+        Trả lời nhiều câu hỏi trong 1 lần gọi model (system prompt chỉ prefill 1 lần)
+        Không dùng lịch sử hội thoại - câu hỏi tiếp theo của viewer nên đi qua get_response
+        
+        Args:
+            questions: List of (user_message, user_name)
+            session_ids: channelId của từng người hỏi (để lưu lượt hỏi-đáp vào session)
+            
+        Returns:
+            Response (có @mention) cho từng câu hỏi, None nếu model không trả lời được câu đó
+        """
+        contexts = [None] * len(questions)
+        if self.rag is not None:
+            try:
+                contexts = self.rag.get_context_batch([q for q, _ in questions], max_length=300)
+            except Exception as e:
+                logging.warning(f"[Ollama/RAG] Batch context failed: {e}")
+        
+        blocks = []
+        for i, ((user_message, _), context) in enumerate(zip(questions, contexts), 1):
+            if context:
+                blocks.append(f"[{i}] CONTEXT:\n---\n{context}\n---\nCâu hỏi: \"{user_message}\"")
+            else:
+                blocks.append(f"[{i}] (Không có CONTEXT, trả lời bằng kiến thức chung) Câu hỏi: \"{user_message}\"")
+        prompt = (f"Có {len(questions)} câu hỏi độc lập từ các viewer khác nhau. Trả lời TỪNG câu theo đúng quy tắc, "
+                  f"câu nào có CONTEXT thì dựa vào CONTEXT của chính câu đó.\n"
+                  f"Chỉ trả về JSON: {{\"answers\": [\"trả lời câu 1\", \"trả lời câu 2\", ...]}} "
+                  f"đúng {len(questions)} phần tử theo thứ tự.\n\n" + "\n\n".join(blocks))
+        messages = [
+            {'role': 'system', 'content': self.system_prompt},
+            {'role': 'user', 'content': prompt}
+        ]
+        
+        prefixes = [f"@{user_name} " if user_name else "" for _, user_name in questions]
+        budgets = [self.max_length - len(prefix) for prefix in prefixes]
+        start = time.monotonic()
+        with self.pool.client() as client:
+            response = client.chat(
+                model=self.model,
+                messages=messages,
+                format='json',
+                options={'num_predict': sum(self._num_predict(budget) for budget in budgets) + 16 * len(questions)},
+                keep_alive=self.keep_alive
+            )
+        answers = self._parse_batch_answers(response['message']['content'], len(questions))
+        logging.info(f"[Ollama] Batch of {len(questions)} answered in {time.monotonic() - start:.2f}s "
+                     f"({sum(a is not None for a in answers)} parsed)")
+        
+        results = []
+        session_ids = session_ids or [None] * len(questions)
+        for (user_message, _), session_id, answer, prefix, budget in zip(questions, session_ids, answers,
+                                                                         prefixes, budgets):
+            answer = self._fit(answer, budget, complete=True) if answer else ""
+            if answer:
+                self.sessions.add_turn(session_id, user_message, answer)
+            results.append(prefix + answer if answer else None)
+        return results
+    
+    def _history_messages(self, session_id: Optional[str]) -> List[Dict]:
+        """System prompt + tóm tắt + lịch sử gần đây của viewer"""
+        messages = [{'role': 'system', 'content': self.system_prompt}]
+        history = self.sessions.get(session_id)
+        if history is not None:
+            if history.summary:
+                messages.append({'role': 'system', 'content': f"Tóm tắt cuộc trò chuyện trước với viewer này: {history.summary}"})
+            messages.extend(history.messages())
+        return messages
+    
+    @staticmethod
+    def _parse_batch_answers(text: str, count: int) -> List[Optional[str]]:
+        """Đọc {"answers": [...]} từ output của model, fallback sang các dòng "[i] ..." """
+        answers = [None] * count
+        try:
+            data = json.loads(text)
+            items = data.get('answers') if isinstance(data, dict) else data
+            if isinstance(items, list):
+                for i, item in enumerate(items[:count]):
+                    if isinstance(item, str) and item.strip():
+                        answers[i] = item.strip()
+                return answers
+        except ValueError:
+            pass
+        for match in re.finditer(r'^\s*\[(\d+)\]\s*(.+)$', text, re.MULTILINE):
+            i = int(match.group(1)) - 1
+            if 0 <= i < count and answers[i] is None:
+                answers[i] = match.group(2).strip()
+        return answers
+    
+    def _generate_streaming(self, messages: List[Dict], budget: int) -> str:
+        """
+        Stream tokens, dừng generation khi reply đã đủ budget (đóng stream -> Ollama ngừng sinh token)
+        
+        Args:
+            messages: Chat messages
+            budget: Số ký tự tối đa của reply
+            
+        Returns:
+            Reply đã cắt ở ranh giới câu trong budget
+        """
+        num_predict = self._num_predict(budget)
+        start = time.monotonic()
+        ttft = None
+        text = ""
+        stopped_early = False
+        # Hết num_predict giữa chừng -> câu cuối chưa xong
+        truncated = False
+
+        with self.pool.client() as client:
+            stream = client.chat(
+                model=self.model,
+                messages=messages,
+                stream=True,
+                options={'num_predict': num_predict},
+                keep_alive=self.keep_alive
+            )
+            try:
+                for chunk in stream:
+                    piece = chunk['message']['content']
+                    if piece and ttft is None:
+                        ttft = time.monotonic() - start
+                    text += piece
+                    truncated = chunk.get('done_reason') == 'length'
+                    if self._should_stop(text.strip(), budget):
+                        stopped_early = True
+                        break
+            finally:
+                # Đóng HTTP stream để Ollama không sinh tiếp token sẽ bị bỏ đi
+                close = getattr(stream, 'close', None)
+                if close:
+                    close()
+
+        latency = time.monotonic() - start
+        with self._stats_lock:
+            self.stats['requests'] += 1
+            self.stats['latency_total'] += latency
+            self.stats['early_stops'] += stopped_early
+            if ttft is not None:
+                self.stats['ttft_total'] += ttft
+                self.stats['last_ttft'] = ttft
+        logging.info(f"[Ollama] TTFT: {ttft if ttft is None else round(ttft, 2)}s, total: {latency:.2f}s, "
+                     f"{len(text)} chars, num_predict={num_predict}{', early stop' if stopped_early else ''}")
+        return self._fit(text, budget, complete=not (stopped_early or truncated))
+
+    def _num_predict(self, budget: int) -> int:
+        """Output token cap: đủ cho budget ký tự, không hơn"""
+        return self.num_predict or max(16, budget // CHARS_PER_TOKEN)
+
+    def _should_stop(self, text: str, budget: int) -> bool:
+        """Reply đã dùng hết budget, hoặc đã có đủ câu / câu tiếp theo chắc chắn không vừa"""
+        if len(text) >= budget:
+            return True
+        ends = [m.end() for m in _SENTENCE_END_RE.finditer(text)]
+        if not ends:
+            return False
+        if self.max_sentences and len(ends) >= self.max_sentences:
+            return True
+        return budget - ends[-1] < self.min_sentence_chars
+
+    def _fit(self, text: str, budget: int, complete: bool) -> str:
+        """
+        Cắt reply vào budget: ưu tiên ranh giới câu, không có thì ranh giới từ + "..."
+        
+        Args:
+            text: Reply text
+            budget: Số ký tự tối đa
+            complete: Model đã tự kết thúc (câu cuối không cần dấu câu)
+        """
+        text = text.strip()
+        if complete and len(text) <= budget:
+            return text
+        pattern = _FINAL_SENTENCE_END_RE if complete else _SENTENCE_END_RE
+        ends = [m.end() for m in pattern.finditer(text) if m.end() <= budget]
+        if ends:
+            return text[:ends[-1]]
+        if len(text) <= budget:
+            return text
+        return text[:budget - 3].rsplit(' ', 1)[0] + "..."
+
+    def get_stats(self) -> str:
+        """Thống kê latency (TTFT, tổng thời gian) của các request streaming + metrics từng host"""
+        with self._stats_lock:
+            stats = dict(self.stats)
+        requests = stats['requests']
+        if not requests:
+            lines = ["No streamed requests yet"]
+        else:
+            lines = [f"{requests} requests, avg TTFT {stats['ttft_total'] / requests:.2f}s, "
+                     f"avg latency {stats['latency_total'] / requests:.2f}s, "
+                     f"{stats['early_stops']} early stops"]
+        if len(self.pool) > 1:
+            for host in self.pool.metrics():
+                latency = host['latency_ewma']
+                lines.append(
+                    f"{host['url']}: {'up' if host['healthy'] else 'ejected'}, "
+                    f"{host['inflight']}/{host['max_concurrency']} in flight, {host['requests']} requests, "
+                    f"{host['failures']} failures, {host['ejections']} ejections, "
+                    f"latency {latency if latency is None else round(latency, 2)}s"
+                )
+        return "\n".join(lines)
+
+    def close(self):
+        """Dừng health probe của host pool"""
+        self.pool.close()
 
     def is_available(self) -> bool:
         """Check if handler is available"""
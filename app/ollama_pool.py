@@ -0,0 +1,183 @@
+"""
+Ollama Host Pool
+Phân phối request qua nhiều Ollama server (nhiều instance / nhiều máy): host ít request đang chạy nhất được chọn,
+mỗi host có giới hạn concurrency, host lỗi liên tục bị loại tạm thời và được probe để quay lại
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Union
+
+import ollama
+
+
+class OllamaHost:
+    def __init__(self, url: str, max_concurrency: int = 2):
+        """
+        Args:
+            url: Ollama host (vd. 'http://localhost:11434')
+            max_concurrency: Số request chạy cùng lúc tối đa trên host này (~ OLLAMA_NUM_PARALLEL)
+        """
+        self.url = url
+        self.max_concurrency = max_concurrency
+        self.client = ollama.Client(host=url)
+        self.inflight = 0
+        self.healthy = True
+        self.ejected_until = 0.0
+        self.consecutive_failures = 0
+        self.requests = 0
+        self.failures = 0
+        self.ejections = 0
+        self.latency_ewma = None
+
+    def record(self, ok: bool, latency: float):
+        self.requests += 1
+        if ok:
+            self.consecutive_failures = 0
+            # EWMA latency: chọn host nhanh hơn khi số request đang chạy bằng nhau
+            self.latency_ewma = latency if self.latency_ewma is None else 0.8 * self.latency_ewma + 0.2 * latency
+        else:
+            self.failures += 1
+            self.consecutive_failures += 1
+
+
+class OllamaHostPool:
+    def __init__(self, hosts: Union[str, List[Union[str, Dict]]], default_concurrency: int = 2,
+                 max_failures: int = 3, eject_time: float = 30, probe_interval: float = 10):
+        """
+        Args:
+            hosts: 1 URL, hoặc list URL / {'url': ..., 'max_concurrency': ...}
+            default_concurrency: max_concurrency cho host không khai báo
+            max_failures: Số lỗi liên tiếp để loại host khỏi pool
+            eject_time: Số giây host bị loại trước khi được probe lại
+            probe_interval: Chu kỳ (giây) probe các host bị loại
+        """
+        if isinstance(hosts, str):
+            hosts = [hosts]
+        self.hosts = []
+        for host in hosts:
+            if isinstance(host, str):
+                host = {'url': host}
+            self.hosts.append(OllamaHost(host['url'], host.get('max_concurrency', default_concurrency)))
+        if not self.hosts:
+            raise ValueError("Ollama host pool cần ít nhất 1 host")
+
+        self.max_failures = max_failures
+        self.eject_time = eject_time
+        self.probe_interval = probe_interval
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._prober = None
+        if len(self.hosts) > 1:
+            self._prober = threading.Thread(target=self._probe_loop, name="ollama-probe", daemon=True)
+            self._prober.start()
+
+    def __len__(self) -> int:
+        return len(self.hosts)
+
+    def acquire(self, timeout: float = 30) -> OllamaHost:
+        """
+        Host healthy có ít request đang chạy nhất (chờ nếu mọi host đều đủ concurrency)
+
+        Raises:
+            TimeoutError: Không có host nào rảnh trong timeout giây
+            ConnectionError: Mọi host đều đang bị loại
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                healthy = [host for host in self.hosts if host.healthy]
+                # 1 host duy nhất (hoặc mọi host đều bị loại) -> vẫn thử, không chặn hẳn !ask
+                if not healthy:
+                    if len(self.hosts) > 1:
+                        raise ConnectionError("All Ollama hosts are ejected")
+                    healthy = self.hosts
+                available = [host for host in healthy if host.inflight < host.max_concurrency]
+                if available:
+                    # Host vừa lỗi xếp sau host khác có cùng số request đang chạy
+                    host = min(available, key=lambda h: (h.inflight, h.consecutive_failures, h.latency_ewma or 0.0))
+                    host.inflight += 1
+                    return host
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError("No Ollama host has free capacity")
+                self._cond.wait(remaining)
+
+    def release(self, host: OllamaHost, ok: bool, latency: float):
+        with self._cond:
+            host.inflight -= 1
+            host.record(ok, latency)
+            if not ok and host.healthy and host.consecutive_failures >= self.max_failures and len(self.hosts) > 1:
+                self._eject(host)
+            self._cond.notify_all()
+
+    @contextmanager
+    def client(self, timeout: float = 30):
+        """
+        with pool.client() as client: client.chat(...)
+        Lỗi trong block được tính cho host đã chọn
+        """
+        host = self.acquire(timeout)
+        start = time.monotonic()
+        ok = False
+        try:
+            yield host.client
+            ok = True
+        finally:
+            self.release(host, ok, time.monotonic() - start)
+
+    def eject(self, host: OllamaHost):
+        """Loại host khỏi pool cho đến lần probe tiếp theo (vd. không qua được warm-up)"""
+        with self._cond:
+            if host.healthy and len(self.hosts) > 1:
+                self._eject(host)
+
+    def _eject(self, host: OllamaHost):
+        host.healthy = False
+        host.ejected_until = time.monotonic() + self.eject_time
+        host.ejections += 1
+        logging.warning(f"[OllamaPool] Ejected {host.url} for {self.eject_time:.0f}s")
+
+    def _probe_loop(self):
+        while not self._stop.wait(self.probe_interval):
+            self.probe()
+
+    def probe(self):
+        """Probe các host bị loại đã hết eject_time: trả lời được -> quay lại pool"""
+        now = time.monotonic()
+        for host in self.hosts:
+            if host.healthy or host.ejected_until > now:
+                continue
+            try:
+                host.client.list()
+            except Exception as e:
+                with self._cond:
+                    host.ejected_until = time.monotonic() + self.eject_time
+                logging.info(f"[OllamaPool] {host.url} still down: {e}")
+                continue
+            with self._cond:
+                host.healthy = True
+                host.consecutive_failures = 0
+                self._cond.notify_all()
+            logging.info(f"[OllamaPool] {host.url} rejoined the pool")
+
+    def metrics(self) -> List[Dict]:
+        """Metrics từng host"""
+        with self._cond:
+            return [
+                {
+                    'url': host.url,
+                    'healthy': host.healthy,
+                    'inflight': host.inflight,
+                    'max_concurrency': host.max_concurrency,
+                    'requests': host.requests,
+                    'failures': host.failures,
+                    'ejections': host.ejections,
+                    'latency_ewma': host.latency_ewma,
+                }
+                for host in self.hosts
+            ]
+
+    def close(self):
+        self._stop.set()
@@ -0,0 +1,301 @@
+"""
+Provider Router
+Định tuyến !ask qua nhiều AI backend (vd. Ollama local + Gemini): đo latency / tỉ lệ lỗi từng backend,
+circuit breaker cho backend đang hỏng, và hedged request (gửi thêm 1 request sang backend khác khi
+backend chính chậm hơn p95 của nó) - câu trả lời nào về trước thì dùng
+"""
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, List, Optional, Tuple
+
+from .answer_cache import strip_mention
+
+
+class CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: float = 0.5, min_requests: int = 5, cooldown: float = 30,
+                 max_consecutive_failures: int = 5):
+        """
+        Args:
+            failure_threshold: Tỉ lệ lỗi (trong rolling window) để mở breaker
+            min_requests: Số request tối thiểu trong window trước khi xét tỉ lệ lỗi
+            cooldown: Số giây breaker mở trước khi cho 1 request thử lại (half-open)
+            max_consecutive_failures: Số lỗi liên tiếp để mở breaker ngay (backend vừa sập)
+        """
+        self.failure_threshold = failure_threshold
+        self.min_requests = min_requests
+        self.cooldown = cooldown
+        self.max_consecutive_failures = max_consecutive_failures
+        self.consecutive_failures = 0
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self._trial_running = False
+
+    def allow(self) -> bool:
+        """Backend có được nhận request không (half-open: chỉ 1 request thử)"""
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.cooldown:
+            self.state = self.HALF_OPEN
+            self._trial_running = False
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.HALF_OPEN and not self._trial_running:
+            self._trial_running = True
+            return True
+        return False
+
+    def record(self, ok: bool, error_rate: float, requests: int):
+        self.consecutive_failures = 0 if ok else self.consecutive_failures + 1
+        if self.state == self.HALF_OPEN:
+            if ok:
+                self.state = self.CLOSED
+            else:
+                self.trip()
+        elif self.state == self.CLOSED and (
+                self.consecutive_failures >= self.max_consecutive_failures
+                or (requests >= self.min_requests and error_rate >= self.failure_threshold)):
+            self.trip()
+
+    def trip(self):
+        """Mở breaker (vd. backend không qua được warm-up)"""
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+        self._trial_running = False
+
+
+class Backend:
+    def __init__(self, name: str, handler, window: int = 50, breaker: Optional[CircuitBreaker] = None):
+        """
+        Args:
+            name: Tên backend ('ollama', 'gemini')
+            handler: AI handler (get_response)
+            window: Số request gần nhất dùng để tính latency / tỉ lệ lỗi
+            breaker: Circuit breaker của backend
+        """
+        self.name = name
+        self.handler = handler
+        self.breaker = breaker or CircuitBreaker()
+        self._results = deque(maxlen=window)  # (ok, latency)
+        self.requests = 0
+        self.failures = 0
+        self.wins = 0
+
+    def record(self, ok: bool, latency: float):
+        self._results.append((ok, latency))
+        self.requests += 1
+        self.failures += not ok
+        state = self.breaker.state
+        self.breaker.record(ok, self.error_rate(), len(self._results))
+        if self.breaker.state != state:
+            logging.warning(f"[Router] {self.name} circuit {state} -> {self.breaker.state}")
+
+    def error_rate(self) -> float:
+        if not self._results:
+            return 0.0
+        return sum(not ok for ok, _ in self._results) / len(self._results)
+
+    def successes(self) -> int:
+        return sum(ok for ok, _ in self._results)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Latency percentile của các request thành công trong window (None nếu chưa có)"""
+        latencies = sorted(latency for ok, latency in self._results if ok)
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+
+class ProviderRouter:
+    """
+    Đứng trước nhiều AI handler, thứ tự trong list = thứ tự ưu tiên
+    Lịch sử viewer nằm trong 1 SessionStore dùng chung: backend chỉ đọc (SessionView), router lưu lượt
+    của câu trả lời được dùng. Mọi attribute khác (rag, max_length...) được chuyển cho backend đầu tiên
+    """
+
+    def __init__(self, backends: List[Tuple[str, object]], hedge: bool = True, hedge_delay: Optional[float] = None,
+                 min_hedge_delay: float = 0.5, min_samples: int = 10, timeout: float = 30, window: int = 50,
+                 failure_threshold: float = 0.5, min_requests: int = 5, cooldown: float = 30,
+                 max_workers: int = 8, sessions=None):
+        """
+        Args:
+            backends: List of (name, handler)
+            hedge: Gửi hedged request sang backend tiếp theo khi backend chính chậm
+            hedge_delay: Số giây chờ trước khi hedge (None = p95 của backend chính)
+            min_hedge_delay: Hedge delay tối thiểu (và mặc định khi chưa đủ min_samples để tính p95)
+            min_samples: Số request thành công tối thiểu trước khi dùng p95
+            timeout: Số giây chờ tối đa cho 1 câu hỏi
+            window: Rolling window (số request) cho latency / tỉ lệ lỗi
+            failure_threshold / min_requests / cooldown: Cấu hình circuit breaker
+            max_workers: Số thread gọi backend
+            sessions: SessionStore dùng chung của các backend (None = backend tự lưu lịch sử)
+        """
+        if not backends:
+            raise ValueError("ProviderRouter cần ít nhất 1 backend")
+        self.backends = [
+            Backend(name, handler, window=window,
+                    breaker=CircuitBreaker(failure_threshold, min_requests, cooldown))
+            for name, handler in backends
+        ]
+        self.hedge = hedge
+        self.hedge_delay = hedge_delay
+        self.min_hedge_delay = min_hedge_delay
+        self.min_samples = min_samples
+        self.timeout = timeout
+        self.hedged = 0
+        self.sessions = sessions
+        self.FALLBACK_RESPONSES = tuple(
+            response for backend in self.backends
+            for response in getattr(backend.handler, 'FALLBACK_RESPONSES', ())
+        )
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ai-router")
+
+    def __getattr__(self, name):
+        if name == 'backends':
+            raise AttributeError(name)
+        return getattr(self.backends[0].handler, name)
+
+    def _is_failure(self, backend: Backend, response: Optional[str]) -> bool:
+        """Handler trả câu báo lỗi thay vì raise -> vẫn tính là lỗi"""
+        return not response or response in getattr(backend.handler, 'FALLBACK_RESPONSES', ())
+
+    def _call(self, backend: Backend, user_message: str, user_name: str, session_id: Optional[str]):
+        """Gọi backend, ghi nhận latency / lỗi (kể cả request thua hedge)"""
+        start = time.monotonic()
+        try:
+            response = backend.handler.get_response(user_message, user_name, session_id=session_id)
+        except Exception as e:
+            logging.warning(f"[Router] {backend.name} error: {e}")
+            response = None
+        ok = not self._is_failure(backend, response)
+        with self._lock:
+            backend.record(ok, time.monotonic() - start)
+        if not ok:
+            raise RuntimeError(f"{backend.name} failed")
+        return backend, response
+
+    def _hedge_after(self, backend: Backend) -> float:
+        if self.hedge_delay is not None:
+            return self.hedge_delay
+        with self._lock:
+            p95 = backend.percentile(0.95) if backend.successes() >= self.min_samples else None
+        return max(self.min_hedge_delay, p95 or 0.0)
+
+    def _next_backend(self, exclude: List[Backend]) -> Optional[Backend]:
+        with self._lock:
+            for backend in self.backends:
+                if backend not in exclude and backend.breaker.allow():
+                    return backend
+        return None
+
+    def get_response(self, user_message: str, user_name: str = "", session_id: Optional[str] = None) -> str:
+        """
+        Câu trả lời từ backend tốt nhất đang hoạt động (hedge / failover sang backend khác nếu cần)
+
+        Args:
+            user_message: Câu hỏi của viewer
+            user_name: Tên viewer
+            session_id: channelId của viewer
+
+        Returns:
+            Câu trả lời (có @mention), hoặc câu báo lỗi nếu mọi backend đều fail
+        """
+        deadline = time.monotonic() + self.timeout
+        started, pending = [], set()
+
+        def launch() -> bool:
+            backend = self._next_backend(started)
+            if backend is None:
+                return False
+            started.append(backend)
+            pending.add(self._executor.submit(self._call, backend, user_message, user_name, session_id))
+            return True
+
+        if not launch():
+            logging.error("[Router] All backends are unavailable (circuit open)")
+            return self.FALLBACK_RESPONSES[0] if self.FALLBACK_RESPONSES else ""
+
+        hedge_at = time.monotonic() + self._hedge_after(started[0]) if self.hedge else None
+        while pending:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            wait_until = min(deadline, hedge_at) if hedge_at else deadline
+            done, pending = wait(pending, timeout=max(0.0, wait_until - now), return_when=FIRST_COMPLETED)
+
+            for future in done:
+                try:
+                    backend, response = future.result()
+                except Exception:
+                    continue
+                with self._lock:
+                    backend.wins += 1
+                if backend is not started[0]:
+                    logging.info(f"[Router] Answered by {backend.name} ({started[0].name} slow / failed)")
+                if self.sessions is not None:
+                    self.sessions.add_turn(session_id, user_message, strip_mention(response, user_name) or response)
+                return response
+
+            if done and not pending:
+                # Tất cả request đang chạy đều lỗi -> failover ngay sang backend tiếp theo
+                launch()
+                hedge_at = None
+            elif not done and hedge_at and time.monotonic() >= hedge_at:
+                # Backend chính chậm hơn p95 -> gửi thêm 1 request sang backend khác
+                if launch():
+                    self.hedged += 1
+                    logging.info(f"[Router] Hedging '{user_message[:40]}' to {started[-1].name}")
+                hedge_at = None
+
+        logging.error(f"[Router] No answer from: {[b.name for b in started]}")
+        return self.FALLBACK_RESPONSES[0] if self.FALLBACK_RESPONSES else ""
+
+    def warm_up(self) -> Dict[str, Dict]:
+        """
+        Warm-up mọi backend song song, backend không sẵn sàng bị ngắt (circuit open) cho đến cooldown
+
+        Returns:
+            {name: {'ok', 'seconds', 'detail'}}
+        """
+        def run(backend):
+            warm_up = getattr(backend.handler, 'warm_up', None)
+            if warm_up is None:
+                return {'ok': True, 'seconds': 0.0, 'detail': 'no warm-up'}
+            try:
+                return warm_up()
+            except Exception as e:
+                return {'ok': False, 'seconds': 0.0, 'detail': str(e)}
+
+        results = dict(zip((backend.name for backend in self.backends),
+                           self._executor.map(run, self.backends)))
+        with self._lock:
+            for backend in self.backends:
+                if not results[backend.name]['ok']:
+                    backend.breaker.trip()
+        return results
+
+    def get_stats(self) -> str:
+        lines = []
+        with self._lock:
+            for backend in self.backends:
+                p50, p95 = backend.percentile(0.5), backend.percentile(0.95)
+                lines.append(
+                    f"{backend.name}: {backend.breaker.state}, {backend.requests} requests, "
+                    f"{backend.error_rate():.0%} errors (recent), "
+                    f"p50 {p50 if p50 is None else round(p50, 2)}s, p95 {p95 if p95 is None else round(p95, 2)}s, "
+                    f"{backend.wins} answers"
+                )
+        lines.append(f"Hedged requests: {self.hedged}")
+        return "\n".join(lines)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        for backend in self.backends:
+            close = getattr(backend.handler, 'close', None)
+            if close:
+                close()
@@ -2,26 +2,276 @@
 RAG Knowledge Base Handler
 Tìm kiếm thông tin từ knowledge base để cung cấp context cho AI
 """
+import hashlib
 import json
 import logging
+import threading
 from typing import Dict, List, Optional
 from pathlib import Path
 
+from .rag_text import normalize_text, split_passages, tokenize, trigrams
+from .bm25_index import BM25Index, HAS_BM25
+from .vector_store import VectorIndex, create_embedder, HAS_NUMPY
+from .fts_store import FTSKnowledgeStore, HAS_FTS5
+from .kb_snapshot import load_snapshot, save_snapshot
+from .lru_cache import LRUCache
+
+
+class KeywordIndex:
+    """
+    Inverted index của knowledge base, compile 1 lần lúc load
+    Search chỉ chạm vào các keyword candidate thay vì scan toàn bộ entries
+    Keywords và query đều được normalize (bỏ dấu, loại stopwords) nên "acn la ai" khớp "acn là ai"
+    """
+    # Tối thiểu 1 exact match hoặc 2 word matches
+    default_min_score = 10
+
+    def __init__(self, knowledge: Dict, fuzzy_threshold: float = 0.4):
+        """
+        Build index từ knowledge dict
+
+        Args:
+            knowledge: Dict entry_key -> {'keywords': [...], 'content': '...'}
+            fuzzy_threshold: Trigram similarity (Dice) tối thiểu để tính là partial match
+        """
+        self.fuzzy_threshold = fuzzy_threshold
+
+        # Entry data (theo thứ tự trong file)
+        self.entry_keys = []
+        self.entry_contents = []
+
+        # Keyword data - keyword id tăng dần theo thứ tự entry rồi thứ tự keyword
+        self.keywords = []
+        self.keyword_lower = []         # keyword đã normalize (dùng cho exact phrase match)
+        self.keyword_entry = []
+
+        self.phrase_prefix_index = {}   # 3 ký tự đầu của phrase -> [kid]  (keyword nằm trong query)
+        self.phrase_trigram_index = {}  # trigram của phrase -> [kid]      (query nằm trong keyword)
+        self.short_phrases = []         # kid của phrase < 3 ký tự, luôn được kiểm tra
+        self.token_index = {}           # word -> [kid]
+        self.fuzzy_word_index = {}      # word (>= 3 ký tự) -> [kid]
+        self.trigram_index = {}         # trigram (có padding) của word -> [word]
+        self.word_trigram_count = {}    # word -> số trigram
+
+        for key, entry in knowledge.items():
+            entry_idx = len(self.entry_keys)
+            self.entry_keys.append(key)
+            self.entry_contents.append(entry.get('content', ''))
+
+            for keyword in entry.get('keywords', []):
+                kid = len(self.keywords)
+                keyword_lower = normalize_text(keyword)
+                self.keywords.append(keyword)
+                self.keyword_lower.append(keyword_lower)
+                self.keyword_entry.append(entry_idx)
+
+                if len(keyword_lower) < 3:
+                    self.short_phrases.append(kid)
+                else:
+                    self.phrase_prefix_index.setdefault(keyword_lower[:3], []).append(kid)
+                    for trigram in trigrams(keyword_lower):
+                        self.phrase_trigram_index.setdefault(trigram, []).append(kid)
+
+                for word in set(tokenize(keyword)):
+                    self.token_index.setdefault(word, []).append(kid)
+                    if len(word) >= 3:
+                        self.fuzzy_word_index.setdefault(word, []).append(kid)
+                        if word not in self.word_trigram_count:
+                            word_trigrams = trigrams(f" {word} ")
+                            self.word_trigram_count[word] = len(word_trigrams)
+                            for trigram in word_trigrams:
+                                self.trigram_index.setdefault(trigram, []).append(word)
+
+    def __len__(self) -> int:
+        return len(self.entry_keys)
+
+    def fuzzy_candidates(self, word: str) -> Dict[str, float]:
+        """
+        Keyword words giống word (typo, viết tắt) theo trigram similarity
+
+        Args:
+            word: Query word (lowercase)
+
+        Returns:
+            Dict keyword word -> Dice similarity (>= fuzzy_threshold)
+        """
+        word_trigrams = trigrams(f" {word} ")
+        shared = {}
+        for trigram in word_trigrams:
+            for k_word in self.trigram_index.get(trigram, ()):
+                shared[k_word] = shared.get(k_word, 0) + 1
+
+        candidates = {}
+        for k_word, count in shared.items():
+            similarity = 2 * count / (len(word_trigrams) + self.word_trigram_count[k_word])
+            if similarity >= self.fuzzy_threshold:
+                candidates[k_word] = similarity
+        return candidates
+
+    def search(self, query: str, top_k: int = 3) -> List[Dict[str, any]]:
+        """
+        Chấm điểm các entry candidate (exact phrase 10, word 5, fuzzy tối đa 2)
+
+        Args:
+            query: User query
+            top_k: Number of top results to return
+
+        Returns:
+            List of dicts with content and scores, sorted by score
+        """
+        query_lower = normalize_text(query)
+        query_words = set(tokenize(query))
+        query_trigrams = trigrams(query_lower)
+
+        # Exact phrase match - bidirectional (keyword in query hoặc query in keyword)
+        exact = set(self.short_phrases)
+        for trigram in query_trigrams:
+            exact.update(self.phrase_prefix_index.get(trigram, ()))
+        if len(query_lower) >= 3:
+            exact.update(self.phrase_trigram_index.get(query_lower[:3], ()))
+        else:
+            exact.update(kid for kid, kw in enumerate(self.keyword_lower) if query_lower in kw)
+        exact = {kid for kid in exact
+                 if self.keyword_lower[kid] in query_lower or query_lower in self.keyword_lower[kid]}
+
+        # Word-level match - số query word trùng với keyword word
+        common_counts = {}
+        for word in query_words:
+            for kid in self.token_index.get(word, ()):
+                common_counts[kid] = common_counts.get(kid, 0) + 1
+
+        # Partial (fuzzy) word match - mỗi query word cộng 2 * similarity với keyword word giống nhất
+        partial_scores = {}
+        for q_word in query_words:
+            if len(q_word) < 3:
+                continue
+            best = {}
+            for k_word, similarity in self.fuzzy_candidates(q_word).items():
+                for kid in self.fuzzy_word_index[k_word]:
+                    if similarity > best.get(kid, 0):
+                        best[kid] = similarity
+            for kid, similarity in best.items():
+                partial_scores[kid] = partial_scores.get(kid, 0) + 2 * similarity
+
+        # Cộng điểm theo thứ tự entry/keyword để giữ nguyên matched_keywords
+        candidates = sorted(exact | common_counts.keys() | partial_scores.keys())
+        scores = {}
+        for kid in candidates:
+            entry_idx = self.keyword_entry[kid]
+            data = scores.get(entry_idx)
+            if data is None:
+                data = scores[entry_idx] = {
+                    'score': 0,
+                    'content': self.entry_contents[entry_idx],
+                    'matched_keywords': [],
+                    'entry_key': self.entry_keys[entry_idx]
+                }
+            keyword = self.keywords[kid]
+            if kid in exact:
+                data['score'] += 10
+                data['matched_keywords'].append(keyword)
+            elif kid in common_counts:
+                data['score'] += 5 * common_counts[kid]
+                data['matched_keywords'].append(keyword)
+            else:
+                data['score'] += partial_scores[kid]
+                if keyword not in data['matched_keywords']:
+                    data['matched_keywords'].append(keyword)
+        for data in scores.values():
+            data['score'] = round(data['score'], 2)
+
+        # Sort by score (stable - hòa điểm thì giữ thứ tự entry)
+        return sorted(scores.values(), key=lambda x: x['score'], reverse=True)[:top_k]
+
+    def search_batch(self, queries: List[str], top_k: int = 3) -> List[List[Dict[str, any]]]:
+        """Search nhiều query (scoring theo dict nên không có bản vectorized, chỉ gộp lời gọi)"""
+        return [self.search(query, top_k=top_k) for query in queries]
+
+
 class RAGKnowledgeBase:
-    def __init__(self, knowledge_path: str = "config/knowledge.json"):
+    BACKENDS = ('keyword', 'bm25', 'vector', 'fts')
+
+    def __init__(self, knowledge_path: str = "config/knowledge.json", config: Optional[Dict] = None):
         """
         Initialize RAG Knowledge Base
         
         Args:
             knowledge_path: Path to knowledge JSON file
+            config: RAG config (section 'rag' trong ai config), ví dụ:
+                {"backend": "bm25", "bm25_k1": 1.5, "bm25_b": 0.75, "bm25_keyword_weight": 2.0}
+                {"backend": "vector", "vector_embedder": "ollama", "vector_model": "nomic-embed-text"}
+                {"backend": "fts", "fts_path": "config/knowledge.db"}
         """
         self.knowledge_path = Path(knowledge_path)
-        self.knowledge = self._load_knowledge()
+        self.config = config or {}
+        self.backend = self.config.get('backend', 'keyword')
+        if self.backend not in self.BACKENDS:
+            logging.warning(f"[RAG] Unknown backend '{self.backend}', using 'keyword'")
+            self.backend = 'keyword'
+        if self.backend == 'bm25' and not HAS_BM25:
+            logging.warning("[RAG] BM25 cần numpy + scipy (pip install numpy scipy), using 'keyword'")
+            self.backend = 'keyword'
+        if self.backend == 'vector' and not HAS_NUMPY:
+            logging.warning("[RAG] Vector backend cần numpy (pip install numpy), using 'keyword'")
+            self.backend = 'keyword'
+        if self.backend == 'fts' and not HAS_FTS5:
+            logging.warning("[RAG] SQLite không hỗ trợ FTS5, using 'keyword'")
+            self.backend = 'keyword'
+        
+        # (knowledge, index, passages) được thay bằng 1 phép gán duy nhất -> query đang chạy không thấy state dở dang
+        self._reload_lock = threading.Lock()
+        self._source_stamp = self._stat_source()
+        self._state = self._load()
+        self._generation = 0
+        self._cache = LRUCache(maxsize=self.config.get('cache_size', 1024),
+                               ttl=self.config.get('cache_ttl', 300))
+        # FTS: database có thể được ghi từ ngoài (python -m app.fts_store upsert) mà không reload
+        self._version_lock = threading.Lock()
+        self._fts_version = self.index.data_version() if self.backend == 'fts' else None
+        self._watch_thread = None
+        self._watch_stop = threading.Event()
         
-        if not self.knowledge:
+        if not len(self):
             logging.warning(f"Knowledge base empty or not found at {knowledge_path}")
         else:
-            logging.info(f"✓ Loaded {len(self.knowledge)} knowledge entries")
+            logging.info(f"✓ Loaded {len(self)} knowledge entries (backend: {self.backend})")
+    
+    def __len__(self) -> int:
+        """Số knowledge entries"""
+        return len(self.index)
+    
+    @property
+    def generation(self) -> int:
+        """Tăng mỗi lần reload / database FTS bị ghi -> cache entries của knowledge cũ không còn được dùng"""
+        if self.backend == 'fts':
+            version = self.index.data_version()
+            with self._version_lock:
+                if version != self._fts_version:
+                    self._fts_version = version
+                    self._generation += 1
+                    self._cache.clear()
+        return self._generation
+    
+    def _snapshot(self):
+        """(generation, state) khớp nhau: reload swap state và tăng generation trong cùng 1 lock"""
+        self.generation  # FTS: kiểm tra database có bị ghi từ ngoài không
+        with self._version_lock:
+            return self._generation, self._state
+    
+    @property
+    def knowledge(self) -> Dict:
+        return self._state[0]
+    
+    @property
+    def index(self):
+        return self._state[1]
+    
+    def _get_passages(self, passages: Dict, result: Dict):
+        """Passages của 1 search result (FTS không có passages dựng sẵn -> tách lúc query)"""
+        entry_passages = passages.get(result['entry_key'])
+        if entry_passages is None:
+            entry_passages = split_passages(result['content'])
+        return entry_passages
     
     def _load_knowledge(self) -> Dict:
         """Load knowledge base from JSON file"""
@@ -38,6 +288,87 @@ class RAGKnowledgeBase:
             logging.error(f"Error loading knowledge base: {e}")
             return {}
     
+    def _snapshot_path(self) -> Optional[Path]:
+        """File snapshot cho backend hiện tại (None nếu backend không dùng snapshot)"""
+        if self.backend not in ('keyword', 'bm25') or not self.config.get('snapshot', True):
+            return None
+        snapshot_dir = Path(self.config.get('snapshot_dir', 'config/rag_cache'))
+        return snapshot_dir / f"{self.knowledge_path.stem}.{self.backend}.snap"
+    
+    def _snapshot_fingerprint(self) -> str:
+        """Hash của backend + config - snapshot build với config khác sẽ bị bỏ qua"""
+        data = json.dumps({'backend': self.backend, 'config': self.config}, sort_keys=True, default=str)
+        return hashlib.sha1(data.encode('utf-8')).hexdigest()
+    
+    def _load(self):
+        """
+        Load knowledge + index: từ snapshot nếu còn hợp lệ, không thì parse JSON, build và lưu snapshot
+        
+        Returns:
+            (knowledge dict, index, passages dict entry_key -> sentence passages)
+        """
+        # FTS backend đọc thẳng từ SQLite, không parse JSON
+        if self.backend == 'fts':
+            return {}, self._open_fts_store(), {}
+        
+        snapshot_path = self._snapshot_path()
+        if snapshot_path and self.knowledge_path.exists():
+            payload = load_snapshot(snapshot_path, self.knowledge_path, self._snapshot_fingerprint())
+            if payload is not None:
+                return payload['knowledge'], payload['index'], payload['passages']
+        
+        knowledge = self._load_knowledge()
+        index = self._build_index(knowledge)
+        passages = {key: split_passages(entry.get('content', '')) for key, entry in knowledge.items()}
+        
+        if snapshot_path and knowledge:
+            try:
+                save_snapshot(snapshot_path, self.knowledge_path, self._snapshot_fingerprint(),
+                              {'knowledge': knowledge, 'index': index, 'passages': passages})
+            except Exception as e:
+                logging.warning(f"[RAG] Could not save snapshot: {e}")
+        return knowledge, index, passages
+    
+    def _build_index(self, knowledge: Dict):
+        """Build index cho backend đang chọn"""
+        if self.backend == 'bm25':
+            return BM25Index(
+                knowledge,
+                k1=self.config.get('bm25_k1', 1.5),
+                b=self.config.get('bm25_b', 0.75),
+                keyword_weight=self.config.get('bm25_keyword_weight', 2.0)
+            )
+        if self.backend == 'vector':
+            return VectorIndex(
+                knowledge,
+                embedder=create_embedder(self.config),
+                cache_dir=self.config.get('vector_cache_dir', 'config/rag_cache'),
+                name=self.knowledge_path.stem,
+                config=self.config
+            )
+        if self.backend == 'fts':
+            return self._open_fts_store()
+        return KeywordIndex(knowledge, fuzzy_threshold=self.config.get('fuzzy_threshold', 0.4))
+    
+    def _open_fts_store(self) -> FTSKnowledgeStore:
+        """Mở SQLite store, tự import từ JSON nếu database chưa tồn tại"""
+        db_path = Path(self.config.get('fts_path', 'config/knowledge.db'))
+        keyword_weight = self.config.get('fts_keyword_weight', 2.0)
+        if not db_path.exists() and self.knowledge_path.exists():
+            logging.info(f"[RAG] {db_path} not found, importing {self.knowledge_path}")
+            FTSKnowledgeStore(str(db_path)).import_json(str(self.knowledge_path))
+        elif db_path.exists():
+            # Mở ghi 1 lần để chuyển database tạo bởi phiên bản cũ sang schema hiện tại
+            try:
+                FTSKnowledgeStore(str(db_path))
+            except Exception as e:
+                logging.warning(f"[RAG] Could not migrate {db_path}: {e}")
+        return FTSKnowledgeStore(
+            str(db_path),
+            read_only=self.config.get('fts_read_only', True),
+            keyword_weight=keyword_weight
+        )
+    
     def search(self, query: str, top_k: int = 3) -> List[Dict[str, any]]:
         """
         Search knowledge base for relevant information
@@ -49,85 +380,137 @@ class RAGKnowledgeBase:
         Returns:
             List of dicts with content and scores
         """
-        if not self.knowledge:
-            return []
-        
-        # Vietnamese stopwords - ignore these common words (but keep question words like 'ai', 'gì')
-        stopwords = {'của', 'và', 'thì', 'với', 'cho', 'từ', 'này', 'đó', 
-                     'như', 'được', 'các', 'để', 'trong', 'ở', 'về',
-                     'hay', 'hoặc', 'nhưng', 'mà', 'thế', 'nào', 'đã', 'sẽ', 'bị'}
+        key = (self.generation, 'search', self._normalize_query(query), top_k)
+        results = self._cache.get(key)
+        if results is None:
+            results = self._search(self.index, query, top_k)
+            self._cache.put(key, results)
+        return [dict(result) for result in results]
+    
+    def search_batch(self, queries: List[str], top_k: int = 3) -> List[List[Dict[str, any]]]:
+        """
+        Search nhiều query trong 1 lần gọi (vd. drain hàng đợi !ask, pre-warm cache, offline eval)
         
-        query_lower = query.lower()
-        query_words = set(query_lower.split()) - stopwords  # Remove stopwords
-        results = []
+        Query trùng nhau (sau normalize) hoặc đã có trong cache chỉ tính 1 lần; phần còn lại được chấm
+        điểm cùng lúc bằng index.search_batch (BM25: sparse query matrix, vector: 1 lần embed + matrix product)
         
-        # Score each knowledge entry based on keyword matches
-        scores = {}
-        for key, entry in self.knowledge.items():
-            keywords = entry.get('keywords', [])
-            content = entry.get('content', '')
-            
-            score = 0
-            matched_keywords = []
-            
-            for keyword in keywords:
-                keyword_lower = keyword.lower()
-                
-                # Exact phrase match (highest priority) - bidirectional
-                if keyword_lower in query_lower or query_lower in keyword_lower:
-                    score += 10
-                    matched_keywords.append(keyword)
-                    continue
-                
-                # Word-level match (medium priority) - check if query words match keyword words
-                keyword_words = set(keyword_lower.split())
-                common_words = query_words & keyword_words
-                if common_words:
-                    score += 5 * len(common_words)
-                    matched_keywords.append(keyword)
-                    continue
-                
-                # Partial word match (low priority)
-                for q_word in query_words:
-                    if len(q_word) > 3:
-                        for k_word in keyword_words:
-                            if len(k_word) > 3:
-                                if q_word[:3] in k_word or k_word[:3] in q_word:
-                                    score += 2
-                                    if keyword not in matched_keywords:
-                                        matched_keywords.append(keyword)
-                                    break
+        Args:
+            queries: List of user queries
+            top_k: Number of top results per query
             
-            if score > 0:
-                scores[key] = {
-                    'score': score,
-                    'content': content,
-                    'matched_keywords': matched_keywords,
-                    'entry_key': key
-                }
+        Returns:
+            List kết quả (như search) cho từng query, cùng thứ tự với queries
+        """
+        generation = self.generation
+        index = self.index
+        results_by_query = self._search_many(index, generation, queries, top_k)
+        return [[dict(result) for result in results_by_query[self._normalize_query(query)]]
+                for query in queries]
+    
+    def search_batch_passages(self, queries: List[str], top_k: int = 3):
+        """
+        search_batch kèm index và passages của cùng 1 state (reload giữa chừng không làm lệch doc ids)
         
-        # Sort by score and get top-k
-        sorted_results = sorted(scores.items(), key=lambda x: x[1]['score'], reverse=True)
+        Returns:
+            (kết quả cho từng query, index, passages)
+        """
+        generation, (_, index, passages) = self._snapshot()
+        results_by_query = self._search_many(index, generation, queries, top_k)
+        results = [[dict(result) for result in results_by_query[self._normalize_query(query)]]
+                   for query in queries]
+        return results, index, passages
+    
+    def _search_many(self, index, generation: int, queries: List[str], top_k: int) -> Dict[str, List[Dict]]:
+        """
+        Kết quả search (qua cache) cho các query khác nhau
         
-        for key, data in sorted_results[:top_k]:
-            results.append(data)
-            logging.info(f"[RAG] Match: {key} (score: {data['score']}, keywords: {data['matched_keywords']})")
+        Returns:
+            Dict normalized query -> results
+        """
+        found, pending = {}, {}
+        for query in queries:
+            normalized = self._normalize_query(query)
+            if normalized in found or normalized in pending:
+                continue
+            results = self._cache.get((generation, 'search', normalized, top_k))
+            if results is None:
+                pending[normalized] = query
+            else:
+                found[normalized] = results
         
+        if pending:
+            batch = index.search_batch(list(pending.values()), top_k=top_k)
+            for normalized, results in zip(pending, batch):
+                self._log_matches(results)
+                found[normalized] = results
+                if generation == self.generation:
+                    self._cache.put((generation, 'search', normalized, top_k), results)
+        return found
+    
+    @staticmethod
+    def _normalize_query(query: str) -> str:
+        """Cache key cho query (có dấu / không dấu dùng chung 1 entry)"""
+        return normalize_text(query)
+    
+    def get_cache_stats(self) -> Dict:
+        """Hit/miss counters của query cache"""
+        return {**self._cache.stats(), 'generation': self.generation}
+    
+    def _search(self, index, query: str, top_k: int) -> List[Dict[str, any]]:
+        """Search trên 1 index cụ thể (snapshot của state hiện tại)"""
+        results = index.search(query, top_k=top_k)
+        self._log_matches(results)
         return results
     
-    def get_context(self, query: str, max_length: int = 400, min_score: int = 10) -> Optional[str]:
+    @staticmethod
+    def _log_matches(results: List[Dict]):
+        for data in results:
+            logging.info(f"[RAG] Match: {data['entry_key']} (score: {data['score']}, keywords: {data['matched_keywords']})")
+    
+    def get_context(self, query: str, max_length: int = 400, min_score: Optional[float] = None,
+                    max_tokens: Optional[int] = None) -> Optional[str]:
         """
         Get combined context from search results
         
+        Chọn các passage (câu) liên quan nhất của các entry đạt min_score cho đến khi hết token budget,
+        không cắt ngang câu
+        
         Args:
             query: User query
-            max_length: Maximum context length
-            min_score: Minimum score required (default: 10, requires at least 1 exact match or 2 word matches)
+            max_length: Maximum context length (characters)
+            min_score: Minimum score required (default: theo backend - keyword: 10, requires at least
+                1 exact match or 2 word matches; bm25/vector/fts: config '<backend>_min_score')
+            max_tokens: Token budget cho context (default: config 'context_tokens', hoặc max_length / 3)
             
         Returns:
             Combined context string or None
         """
-        results = self.search(query, top_k=2)
+        generation = self.generation
+        key = (generation, 'context', self._normalize_query(query), max_length, min_score, max_tokens)
+        context = self._cache.get(key, default=False)
+        if context is not False:
+            logging.info(f"[RAG] Cache hit for query: '{query}'")
+            return context
+        context = self._build_context(query, max_length, min_score, max_tokens)
+        if generation == self.generation:
+            self._cache.put(key, context)
+        return context
+    
+    def _build_context(self, query: str, max_length: int, min_score: Optional[float],
+                       max_tokens: Optional[int]) -> Optional[str]:
+        """Search + passage packing (không qua cache)"""
+        state = self._state
+        results = self._search(state[1], query, top_k=self.config.get('context_entries', 2))
+        return self._context_from_results(state, query, results, max_length, min_score, max_tokens)
+    
+    def _context_from_results(self, state, query: str, results: List[Dict], max_length: int,
+                              min_score: Optional[float], max_tokens: Optional[int]) -> Optional[str]:
+        """Lọc search results theo min_score rồi pack passages"""
+        knowledge, index, passages = state
+        if min_score is None:
+            min_score = self.config.get(f'{self.backend}_min_score', index.default_min_score)
+        if max_tokens is None:
+            max_tokens = self.config.get('context_tokens', max_length // 3)
         
         if not results:
             logging.info(f"[RAG] No context found for query: '{query}'")
@@ -140,19 +523,197 @@ class RAGKnowledgeBase:
             logging.info(f"[RAG] No context with sufficient score (min: {min_score}) for query: '{query}'")
             return None
         
-        # Combine results with priority to highest scored
-        context_parts = [result['content'] for result in filtered_results]
-        context = " ".join(context_parts)
+        ranked = [(result, self._get_passages(passages, result)) for result in filtered_results]
+        return pack_context(query, ranked, max_length, max_tokens)
+    
+    def get_context_batch(self, queries: List[str], max_length: int = 400, min_score: Optional[float] = None,
+                          max_tokens: Optional[int] = None) -> List[Optional[str]]:
+        """
+        get_context cho nhiều query: 1 lần search_batch cho các query chưa có trong cache
         
-        logging.info(f"[RAG] Context matched: {len(filtered_results)} entries, total {len(context)} chars")
+        Args:
+            queries: List of user queries
+            max_length: Maximum context length (characters)
+            min_score: Minimum score required (default: theo backend)
+            max_tokens: Token budget cho context (default: config 'context_tokens', hoặc max_length / 3)
+            
+        Returns:
+            Context (hoặc None) cho từng query, cùng thứ tự với queries
+        """
+        generation, state = self._snapshot()
+        contexts, pending = {}, {}
+        for query in queries:
+            normalized = self._normalize_query(query)
+            if normalized in contexts or normalized in pending:
+                continue
+            context = self._cache.get((generation, 'context', normalized, max_length, min_score, max_tokens),
+                                      default=False)
+            if context is False:
+                pending[normalized] = query
+            else:
+                contexts[normalized] = context
         
-        # Trim if too long
-        if len(context) > max_length:
-            context = context[:max_length] + "..."
+        if pending:
+            top_k = self.config.get('context_entries', 2)
+            results_by_query = self._search_many(state[1], generation, list(pending.values()), top_k)
+            for normalized, query in pending.items():
+                context = self._context_from_results(state, query, [dict(r) for r in results_by_query[normalized]],
+                                                     max_length, min_score, max_tokens)
+                contexts[normalized] = context
+                if generation == self.generation:
+                    self._cache.put((generation, 'context', normalized, max_length, min_score, max_tokens), context)
         
-        return context
+        logging.info(f"[RAG] Context batch: {len(queries)} queries, {len(pending)} computed")
+        return [contexts[self._normalize_query(query)] for query in queries]
+    
+    def reload(self, wait: bool = False):
+        """
+        Reload knowledge base from file trên background thread (FTS: chỉ mở lại database)
+        
+        Args:
+            wait: Chờ reload xong mới return
+        """
+        thread = threading.Thread(target=self._reload_now, name="rag-reload", daemon=True)
+        thread.start()
+        if wait:
+            thread.join()
+    
+    def _reload_now(self):
+        """Build state mới rồi swap vào - query trong lúc build vẫn dùng state cũ"""
+        with self._reload_lock:
+            stamp = self._stat_source()
+            try:
+                state = self._load()
+            except Exception as e:
+                logging.error(f"[RAG] Reload failed, keeping current knowledge: {e}")
+                return
+            # File đang được ghi dở / JSON lỗi -> giữ knowledge cũ, chờ lần sửa tiếp theo
+            if not len(state[1]) and len(self.index) and self.knowledge_path.exists():
+                logging.warning("[RAG] Reload returned no entries, keeping current knowledge")
+                self._source_stamp = stamp
+                return
+            self._source_stamp = stamp
+            with self._version_lock:
+                self._state = state
+                if self.backend == 'fts':
+                    self._fts_version = state[1].data_version()
+                self._generation += 1
+                self._cache.clear()
+        logging.info(f"Knowledge base reloaded: {len(self)} entries")
+    
+    def _stat_source(self):
+        """(mtime, size) của knowledge file, None nếu không tồn tại"""
+        try:
+            stat = self.knowledge_path.stat()
+            return stat.st_mtime_ns, stat.st_size
+        except OSError:
+            return None
+    
+    def start_watching(self, interval: float = 2.0):
+        """
+        Theo dõi knowledge file, tự reload (background) khi file thay đổi
+        
+        Args:
+            interval: Số giây giữa 2 lần kiểm tra
+        """
+        if self.backend == 'fts' or (self._watch_thread and self._watch_thread.is_alive()):
+            return
+        self._watch_stop.clear()
+        self._watch_thread = threading.Thread(target=self._watch_loop, args=(interval,),
+                                              name="rag-watcher", daemon=True)
+        self._watch_thread.start()
+        logging.info(f"[RAG] Watching {self.knowledge_path} for changes (every {interval}s)")
     
-    def reload(self):
-        """Reload knowledge base from file"""
-        self.knowledge = self._load_knowledge()
-        logging.info("Knowledge base reloaded")
+    def stop_watching(self):
+        """Dừng theo dõi knowledge file"""
+        self._watch_stop.set()
+    
+    def _watch_loop(self, interval: float):
+        while not self._watch_stop.wait(interval):
+            if self._stat_source() != self._source_stamp:
+                logging.info(f"[RAG] {self.knowledge_path} changed, reloading")
+                self._reload_now()
+
+
+def pack_context(query: str, ranked: List, max_length: int, max_tokens: int) -> Optional[str]:
+    """
+    Chọn các passage (câu) liên quan nhất cho đến khi hết token budget, không cắt ngang câu
+    
+    Args:
+        query: User query
+        ranked: List of (search result, sentence passages), theo thứ tự rank
+        max_length: Maximum context length (characters)
+        max_tokens: Token budget cho context
+        
+    Returns:
+        Context string, None nếu các entry khớp không có nội dung
+    """
+    # Passage score = entry score * (1 + tỉ lệ query tokens có trong passage)
+    query_tokens = set(tokenize(query))
+    candidates = []
+    for rank, (result, entry_passages) in enumerate(ranked):
+        for position, (text, tokens, n_tokens) in enumerate(entry_passages):
+            overlap = len(query_tokens & tokens) / len(query_tokens) if query_tokens else 0.0
+            candidates.append((result['score'] * (1.0 + overlap), rank, position, text, n_tokens))
+    if not candidates:
+        logging.info(f"[RAG] Matched {len(ranked)} entries with empty content for query: '{query}'")
+        return None
+    
+    # Greedy: passage điểm cao trước, bỏ qua passage không vừa budget còn lại
+    selected = []
+    used_tokens, used_chars = 0, 0
+    for score, rank, position, text, n_tokens in sorted(candidates, key=lambda c: (-c[0], c[1], c[2])):
+        if used_tokens + n_tokens > max_tokens or used_chars + len(text) > max_length:
+            continue
+        selected.append((rank, position, text))
+        used_tokens += n_tokens
+        used_chars += len(text) + 1
+    
+    if not selected:
+        # Passage tốt nhất dài hơn cả budget -> cắt ở ranh giới từ
+        best = min(candidates, key=lambda c: (-c[0], c[1], c[2]))[3]
+        limit = min(max_length, max_tokens * 3)
+        context = best[:limit].rsplit(' ', 1)[0] + "..."
+    else:
+        # Giữ thứ tự gốc (entry rank, vị trí câu) cho dễ đọc
+        context = " ".join(text for _, _, text in sorted(selected))
+    
+    logging.info(f"[RAG] Context matched: {len(ranked)} entries, {len(selected)} passages, "
+                 f"~{used_tokens} tokens, total {len(context)} chars")
+    
+    return context
+
+
+_shared_instances = {}
+_shared_lock = threading.Lock()
+
+
+def get_shared_knowledge_base(knowledge_path: str = "config/knowledge.json",
+                              config: Optional[Dict] = None):
+    """
+    RAGKnowledgeBase dùng chung trong process (1 instance cho mỗi file + config)
+    Instance tự theo dõi file và hot reload trừ khi config 'watch' = false
+    Config có 'shards' / 'shard_dir' -> ShardedKnowledgeBase (knowledge_path bị bỏ qua)
+    
+    Args:
+        knowledge_path: Path to knowledge JSON file
+        config: RAG config
+        
+    Returns:
+        Shared RAGKnowledgeBase / ShardedKnowledgeBase
+    """
+    config = config or {}
+    sharded = bool(config.get('shards') or config.get('shard_dir'))
+    key = ('sharded' if sharded else str(Path(knowledge_path).resolve()),
+           json.dumps(config, sort_keys=True, default=str))
+    with _shared_lock:
+        rag = _shared_instances.get(key)
+        if rag is None and sharded:
+            from .kb_shards import ShardedKnowledgeBase
+            rag = _shared_instances[key] = ShardedKnowledgeBase(config)
+        elif rag is None:
+            rag = RAGKnowledgeBase(knowledge_path, config=config)
+            if config.get('watch', True):
+                rag.start_watching(config.get('watch_interval', 2.0))
+            _shared_instances[key] = rag
+        return rag
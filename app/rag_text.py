@@ -0,0 +1,101 @@
+"""
+RAG Text Utilities
+Normalize (NFC, bỏ dấu), tokenize và stopwords dùng chung cho các index của knowledge base
+Keywords/content được normalize 1 lần lúc build index, query string hay gặp được memoize
+"""
+import re
+import unicodedata
+from functools import lru_cache
+from typing import FrozenSet, Set, Tuple
+
+# Vietnamese stopwords - ignore these common words (but keep question words like 'ai', 'gì')
+STOPWORDS = {'của', 'và', 'thì', 'với', 'cho', 'từ', 'này', 'đó',
+             'như', 'được', 'các', 'để', 'trong', 'ở', 'về',
+             'hay', 'hoặc', 'nhưng', 'mà', 'thế', 'nào', 'đã', 'sẽ', 'bị'}
+
+_WORD_RE = re.compile(r'\w+')
+# đ/Đ không tách được bằng NFD nên map riêng
+_FOLD_TABLE = str.maketrans({'đ': 'd', 'Đ': 'D'})
+
+
+def fold_diacritics(text: str) -> str:
+    """Bỏ dấu tiếng Việt: 'Acn là ai' -> 'Acn la ai', 'đâu' -> 'dau'"""
+    decomposed = unicodedata.normalize('NFD', text)
+    stripped = ''.join(c for c in decomposed if unicodedata.category(c) != 'Mn')
+    return unicodedata.normalize('NFC', stripped).translate(_FOLD_TABLE)
+
+
+@lru_cache(maxsize=8192)
+def normalize_text(text: str) -> str:
+    """
+    Normalize text để so khớp: NFC, lowercase, bỏ dấu, gộp khoảng trắng
+
+    Args:
+        text: Raw text
+
+    Returns:
+        Normalized text (vẫn giữ dấu câu)
+    """
+    text = unicodedata.normalize('NFC', text).lower()
+    return " ".join(fold_diacritics(text).split())
+
+
+# Stopwords ở dạng đã bỏ dấu - chỉ dùng cho text gõ không dấu ("acn cua ai"); text có dấu so với
+# STOPWORDS trước khi bỏ dấu (không thì "mã" -> "ma" trùng "mà", "tủ" -> "tu" trùng "từ", "do" trùng "đó")
+NORMALIZED_STOPWORDS = frozenset(normalize_text(word) for word in STOPWORDS)
+
+
+def trigrams(text: str) -> Set[str]:
+    """Tất cả substring 3 ký tự của text"""
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+@lru_cache(maxsize=8192)
+def tokenize(text: str) -> Tuple[str, ...]:
+    """
+    Normalize, tách word (bỏ dấu câu) và loại stopwords (so trước khi bỏ dấu nếu text có dấu)
+
+    Args:
+        text: Raw text
+
+    Returns:
+        Tuple of tokens (giữ nguyên thứ tự và số lần xuất hiện)
+    """
+    text = unicodedata.normalize('NFC', text).lower()
+    folded_text = fold_diacritics(text)
+    if folded_text == text:
+        # Gõ không dấu -> không phân biệt được "ma" / "mà", bỏ theo dạng không dấu
+        return tuple(word for word in _WORD_RE.findall(folded_text) if word not in NORMALIZED_STOPWORDS)
+    return tuple(fold_diacritics(word) for word in _WORD_RE.findall(text) if word not in STOPWORDS)
+
+# Ranh giới câu: khoảng trắng sau . ! ? …, hoặc xuống dòng
+_SENTENCE_RE = re.compile(r'(?<=[.!?…])\s+|\n+')
+
+
+def estimate_tokens(text: str) -> int:
+    """Ước lượng số LLM tokens (~3 ký tự tiếng Việt / token), không cần tokenizer của model"""
+    return max(1, -(-len(text) // 3))
+
+
+def split_passages(text: str) -> Tuple[Tuple[str, FrozenSet[str], int], ...]:
+    """
+    Tách content thành passages cấp câu
+
+    Args:
+        text: Entry content
+
+    Returns:
+        Tuple of (passage text, token set, estimated tokens)
+    """
+    passages = []
+    for sentence in _SENTENCE_RE.split(text):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        # Câu chỉ có emoji / ký hiệu -> gộp vào câu trước
+        if passages and not _WORD_RE.search(sentence):
+            prev_text = f"{passages[-1][0]} {sentence}"
+            passages[-1] = (prev_text, passages[-1][1], estimate_tokens(prev_text))
+            continue
+        passages.append((sentence, frozenset(tokenize(sentence)), estimate_tokens(sentence)))
+    return tuple(passages)
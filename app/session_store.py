@@ -0,0 +1,167 @@
+"""
+Session Store
+Lịch sử hội thoại riêng cho từng viewer (theo channelId) để hỏi tiếp được câu trước
+Giới hạn số session, tổng token trong bộ nhớ và budget mỗi session; session ít dùng / idle bị loại trước
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .conversation import ConversationWindow
+
+
+def create_session_store(config: Optional[Dict] = None, summarizer=None) -> "SessionStore":
+    """SessionStore từ section 'sessions' của ai config"""
+    config = config or {}
+    return SessionStore(
+        max_sessions=config.get('max_sessions', 1000),
+        idle_timeout=config.get('idle_timeout', 1800),
+        session_tokens=config.get('session_tokens', 600),
+        max_total_tokens=config.get('max_total_tokens', 200000),
+        summarizer=summarizer
+    )
+
+
+class SessionStore:
+    def __init__(self, max_sessions: int = 1000, idle_timeout: float = 1800, session_tokens: int = 600,
+                 max_total_tokens: int = 200000,
+                 summarizer: Optional[Callable[[str, List[Tuple[str, str]]], Optional[str]]] = None):
+        """
+        Args:
+            max_sessions: Số viewer tối đa được giữ lịch sử
+            idle_timeout: Số giây không hỏi gì thì session bị xoá
+            session_tokens: Budget token lịch sử của mỗi viewer
+            max_total_tokens: Tổng token tối đa của mọi session (giới hạn bộ nhớ cứng)
+            summarizer: Tóm tắt lượt cũ của session (xem ConversationWindow)
+        """
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.session_tokens = session_tokens
+        self.max_total_tokens = max_total_tokens
+        self.summarizer = summarizer
+        self.evictions = 0
+        self._sessions = OrderedDict()  # session_id -> [ConversationWindow, last_used, tokens]
+        self._total_tokens = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def get(self, session_id: Optional[str]) -> Optional[ConversationWindow]:
+        """Lịch sử của viewer (None nếu chưa có / không có session_id)"""
+        if not session_id:
+            return None
+        with self._lock:
+            self._evict_idle(time.monotonic())
+            item = self._sessions.get(session_id)
+            if item is None:
+                return None
+            self._sessions.move_to_end(session_id)
+            item[1] = time.monotonic()
+            return item[0]
+
+    def has_history(self, session_id: Optional[str]) -> bool:
+        window = self.get(session_id)
+        return window is not None and (len(window) > 0 or bool(window.summary))
+
+    def add_turn(self, session_id: Optional[str], user_text: str, reply: str):
+        """
+        Lưu 1 lượt hỏi-đáp vào session của viewer (tạo session nếu chưa có)
+
+        Args:
+            session_id: channelId của viewer (None = không lưu)
+            user_text: Tin nhắn của viewer
+            reply: Câu trả lời (không có @mention)
+        """
+        if not session_id:
+            return
+        with self._lock:
+            now = time.monotonic()
+            item = self._sessions.get(session_id)
+            if item is None:
+                window = ConversationWindow(max_tokens=self.session_tokens, summarizer=self.summarizer)
+                window.on_change = lambda: self._window_changed(session_id, window)
+                item = [window, now, 0]
+                self._sessions[session_id] = item
+            self._sessions.move_to_end(session_id)
+            window = item[0]
+            window.add_turn(user_text, reply)
+            item[1] = now
+            self._sync_tokens(item)
+
+            self._evict_idle(now)
+            self._enforce_limits()
+
+    def _window_changed(self, session_id: str, window: ConversationWindow):
+        """Tóm tắt nền vừa thay các lượt cũ bằng đoạn tóm tắt -> cập nhật tổng token"""
+        with self._lock:
+            item = self._sessions.get(session_id)
+            # Session đã bị loại (hoặc tạo lại) trong lúc tóm tắt -> token không còn được tính
+            if item is None or item[0] is not window:
+                return
+            self._sync_tokens(item)
+            self._enforce_limits()
+
+    def _sync_tokens(self, item: List):
+        tokens = item[0].tokens
+        self._total_tokens += tokens - item[2]
+        item[2] = tokens
+
+    def _enforce_limits(self):
+        """Quá số session / tổng token -> bỏ session ít dùng nhất (không bao giờ bỏ session vừa dùng)"""
+        while len(self._sessions) > 1 and (len(self._sessions) > self.max_sessions
+                                           or self._total_tokens > self.max_total_tokens):
+            self._pop_oldest()
+
+    def _evict_idle(self, now: float):
+        """Xoá session idle (OrderedDict theo thứ tự dùng -> chỉ cần xét từ đầu)"""
+        while self._sessions:
+            item = next(iter(self._sessions.values()))
+            if now - item[1] <= self.idle_timeout:
+                break
+            self._pop_oldest()
+
+    def _pop_oldest(self):
+        _, (_, _, tokens) = self._sessions.popitem(last=False)
+        self._total_tokens -= tokens
+        self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._sessions.clear()
+            self._total_tokens = 0
+        logging.info("[Sessions] All sessions cleared")
+
+    def stats(self) -> Dict:
+        return {'sessions': len(self._sessions), 'tokens': self._total_tokens, 'evictions': self.evictions}
+
+
+class SessionView:
+    """
+    SessionStore dùng chung cho nhiều AI backend sau ProviderRouter: đọc lịch sử bình thường,
+    add_turn bị bỏ qua - router chỉ lưu lượt của backend trả lời được dùng (hedge không ghi 2 lần)
+    """
+
+    def __init__(self, store: SessionStore):
+        self.store = store
+
+    def __getattr__(self, name):
+        if name == 'store':
+            raise AttributeError(name)
+        return getattr(self.store, name)
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+    @property
+    def summarizer(self):
+        return self.store.summarizer
+
+    @summarizer.setter
+    def summarizer(self, summarizer):
+        self.store.summarizer = summarizer
+
+    def add_turn(self, session_id: Optional[str], user_text: str, reply: str):
+        pass
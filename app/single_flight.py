@@ -0,0 +1,133 @@
+"""
+Single-flight
+Gộp các request giống nhau đang chạy: 20 viewer cùng hỏi "discord acn" -> 1 lần gọi AI, 20 câu trả lời
+Số request đang chạy có giới hạn, request quá timeout được báo lỗi cho người chờ
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Hashable, Optional
+
+# callback(result, error) - error là Exception (TimeoutError khi quá timeout) hoặc None
+Callback = Callable[[Any, Optional[BaseException]], None]
+
+
+class _Flight:
+    __slots__ = ('callbacks', 'started', 'timer', 'done')
+
+    def __init__(self, callback: Callback):
+        self.callbacks = [callback]
+        self.started = time.monotonic()
+        self.timer = None
+        self.done = False
+
+
+class SingleFlight:
+    LEADER = 'leader'
+    JOINED = 'joined'
+    REJECTED = 'rejected'
+
+    def __init__(self, max_inflight: int = 8, timeout: float = 60.0, max_workers: int = 4):
+        """
+        Args:
+            max_inflight: Số request được chạy / xếp hàng cùng lúc, kể cả request đã timeout nhưng
+                worker chưa xong (quá thì request mới bị từ chối)
+            timeout: Số giây tối đa người hỏi phải chờ (tính cả thời gian xếp hàng)
+            max_workers: Số thread chạy request song song
+        """
+        self.max_inflight = max_inflight
+        self.timeout = timeout
+        self._flights = {}  # key -> _Flight
+        self._pending = 0  # Task trong executor (đang chạy + đang xếp hàng)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="single-flight")
+        self.stats = {'calls': 0, 'coalesced': 0, 'rejected': 0, 'timeouts': 0}
+
+    def __len__(self) -> int:
+        """Số request đang chạy / chờ"""
+        return self._pending
+
+    def submit(self, key: Hashable, fn: Callable[[], Any], callback: Callback) -> str:
+        """
+        Chạy fn trên worker thread, hoặc chờ chung kết quả nếu cùng key đang chạy (không block)
+
+        Args:
+            key: Key của request (vd. câu hỏi đã normalize)
+            fn: Hàm thực hiện request (chỉ được gọi bởi request đầu tiên của key)
+            callback: Gọi trên worker thread khi có kết quả / lỗi / timeout
+
+        Returns:
+            'leader' (chạy fn), 'joined' (chờ request đang chạy) hoặc 'rejected' (quá max_inflight)
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.callbacks.append(callback)
+                self.stats['coalesced'] += 1
+                return self.JOINED
+            # Flight đã timeout rời _flights nhưng task vẫn chiếm worker / hàng đợi -> vẫn tính
+            if self._pending >= self.max_inflight:
+                self.stats['rejected'] += 1
+                return self.REJECTED
+            flight = self._flights[key] = _Flight(callback)
+            self._pending += 1
+            self.stats['calls'] += 1
+            if self.timeout:
+                flight.timer = threading.Timer(self.timeout, self._expire, args=(key, flight))
+                flight.timer.daemon = True
+                flight.timer.start()
+        self._executor.submit(self._run, key, flight, fn)
+        return self.LEADER
+
+    def _finish(self, key: Hashable, flight: _Flight):
+        """Đánh dấu flight xong, trả về callbacks cần gọi (rỗng nếu đã xong trước đó)"""
+        with self._lock:
+            if flight.done:
+                return []
+            flight.done = True
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            if flight.timer:
+                flight.timer.cancel()
+            return flight.callbacks
+
+    def _run(self, key: Hashable, flight: _Flight, fn: Callable[[], Any]):
+        try:
+            if flight.done:
+                # Đã timeout khi còn xếp hàng -> không gọi AI nữa, không ai chờ kết quả
+                logging.info(f"[SingleFlight] '{key}' expired while queued, skipped")
+                return
+            result, error = None, None
+            try:
+                result = fn()
+            except Exception as e:
+                error = e
+        finally:
+            with self._lock:
+                self._pending -= 1
+        callbacks = self._finish(key, flight)
+        if not callbacks:
+            logging.info(f"[SingleFlight] '{key}' finished after timeout "
+                         f"({time.monotonic() - flight.started:.1f}s), result dropped")
+        self._notify(callbacks, result, error)
+
+    def _expire(self, key: Hashable, flight: _Flight):
+        callbacks = self._finish(key, flight)
+        if callbacks:
+            self.stats['timeouts'] += 1
+            logging.warning(f"[SingleFlight] '{key}' timed out after {self.timeout}s, "
+                            f"{len(callbacks)} waiting")
+            self._notify(callbacks, None, TimeoutError(f"Request timed out after {self.timeout}s"))
+
+    @staticmethod
+    def _notify(callbacks, result, error):
+        for callback in callbacks:
+            try:
+                callback(result, error)
+            except Exception as e:
+                logging.error(f"[SingleFlight] Callback error: {e}")
+
+    def shutdown(self, wait: bool = False):
+        """Dừng worker threads"""
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,284 @@
+"""
+Vector Store
+Dense embedding retrieval: embed knowledge entries 1 lần, lưu float32 .npy (mmap) theo content hash
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import zlib
+from pathlib import Path
+from typing import Dict, List, Optional
+
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+
+try:
+    import ollama
+    HAS_OLLAMA = True
+except ImportError:
+    HAS_OLLAMA = False
+
+from .ann_index import build_ann_index
+from .rag_text import tokenize, trigrams
+
+
+class HashingEmbedder:
+    """Embedder offline: feature hashing của tokens + char trigrams (deterministic, không cần model)"""
+
+    def __init__(self, dim: int = 256):
+        if not HAS_NUMPY:
+            raise ImportError("Vector backend cần numpy: pip install numpy")
+        self.dim = dim
+        # Features lấy từ tokens đã bỏ dấu - đổi cách tokenize thì đổi name để không dùng lại cache cũ
+        self.name = f"hashing-folded-{dim}"
+
+    def _features(self, text: str) -> List[str]:
+        features = []
+        for token in tokenize(text):
+            features.append(token)
+            features.extend(trigrams(f" {token} "))
+        return features
+
+    def embed(self, texts: List[str]) -> "np.ndarray":
+        """
+        Embed nhiều texts
+
+        Args:
+            texts: List of texts
+
+        Returns:
+            float32 matrix (len(texts) x dim), L2-normalized
+        """
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                h = zlib.crc32(feature.encode('utf-8'))
+                vectors[row, h % self.dim] += 1.0 if (h >> 31) & 1 else -1.0
+        return _normalize(vectors)
+
+
+class OllamaEmbedder:
+    """Embedder qua endpoint /api/embed của Ollama"""
+
+    def __init__(self, model: str = "nomic-embed-text", host: str = "http://localhost:11434"):
+        if not HAS_NUMPY:
+            raise ImportError("Vector backend cần numpy: pip install numpy")
+        if not HAS_OLLAMA:
+            raise ImportError("Ollama embedder cần ollama: pip install ollama")
+        self.model = model
+        self.client = ollama.Client(host=host)
+        self.name = f"ollama-{model}"
+
+    def embed(self, texts: List[str]) -> "np.ndarray":
+        """
+        Embed nhiều texts trong 1 request
+
+        Args:
+            texts: List of texts
+
+        Returns:
+            float32 matrix (len(texts) x dim), L2-normalized
+        """
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        response = self.client.embed(model=self.model, input=texts)
+        return _normalize(np.asarray(response['embeddings'], dtype=np.float32))
+
+
+def _normalize(vectors: "np.ndarray") -> "np.ndarray":
+    """L2-normalize từng row (để dot product = cosine similarity)"""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def create_embedder(config: Dict):
+    """
+    Tạo embedder theo RAG config
+
+    Args:
+        config: RAG config ('vector_embedder': 'hashing' | 'ollama')
+
+    Returns:
+        Embedder instance
+    """
+    kind = config.get('vector_embedder', 'hashing')
+    if kind == 'ollama':
+        return OllamaEmbedder(
+            model=config.get('vector_model', 'nomic-embed-text'),
+            host=config.get('vector_host', 'http://localhost:11434')
+        )
+    return HashingEmbedder(dim=config.get('vector_dim', 256))
+
+
+def content_hash(text: str) -> str:
+    """Hash ổn định của text (key trong vector store)"""
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class VectorStore:
+    """
+    Matrix float32 trên disk (.npy) + sidecar .json chứa content hash của từng row
+    Row đã embed được dùng lại theo hash, chỉ embed texts mới/đã sửa
+    """
+
+    def __init__(self, cache_dir: str, name: str, embedder):
+        """
+        Args:
+            cache_dir: Thư mục chứa cache
+            name: Tên store (vd. tên knowledge file)
+            embedder: Embedder instance
+        """
+        self.embedder = embedder
+        self.cache_dir = Path(cache_dir)
+        safe_name = re.sub(r'[^A-Za-z0-9_.-]', '_', f"{name}.{embedder.name}")
+        self.path_prefix = str(self.cache_dir / safe_name)
+        self.matrix_path = self.cache_dir / f"{safe_name}.npy"
+        self.meta_path = self.cache_dir / f"{safe_name}.json"
+        self.fingerprint = ""
+
+    def _load_cached(self):
+        """Load (hashes, mmap matrix) từ cache, hoặc ([], None) nếu chưa có/lỗi"""
+        try:
+            if not self.matrix_path.exists() or not self.meta_path.exists():
+                return [], None
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            matrix = np.load(self.matrix_path, mmap_mode='r')
+            hashes = meta.get('hashes', [])
+            if meta.get('embedder') != self.embedder.name or len(hashes) != matrix.shape[0]:
+                return [], None
+            return hashes, matrix
+        except Exception as e:
+            logging.warning(f"[Vector] Cache unreadable, re-embedding: {e}")
+            return [], None
+
+    def load(self, texts: List[str]) -> "np.ndarray":
+        """
+        Lấy matrix embeddings cho texts (theo đúng thứ tự), embed những text chưa có trong cache
+
+        Args:
+            texts: Texts cần vector
+
+        Returns:
+            float32 matrix (len(texts) x dim), memory-mapped khi cache còn nguyên
+        """
+        hashes = [content_hash(text) for text in texts]
+        self.fingerprint = content_hash(self.embedder.name + "".join(hashes))
+        cached_hashes, cached = self._load_cached()
+        if cached is not None and cached_hashes == hashes:
+            logging.info(f"[Vector] Cache hit: {len(hashes)} vectors ({self.matrix_path.name})")
+            return cached
+
+        cached_rows = {h: row for row, h in enumerate(cached_hashes)}
+        missing = [i for i, h in enumerate(hashes) if h not in cached_rows]
+        new_vectors = self.embedder.embed([texts[i] for i in missing]) if missing else None
+
+        dim = cached.shape[1] if cached is not None else (new_vectors.shape[1] if new_vectors is not None else 0)
+        matrix = np.zeros((len(texts), dim), dtype=np.float32)
+        for i, h in enumerate(hashes):
+            if h in cached_rows:
+                matrix[i] = cached[cached_rows[h]]
+        if missing:
+            matrix[missing] = new_vectors
+        logging.info(f"[Vector] Embedded {len(missing)} new texts, reused {len(texts) - len(missing)}")
+        del cached  # Đóng mmap cũ trước khi ghi đè file (Windows)
+
+        try:
+            self._save(hashes, matrix)
+            return np.load(self.matrix_path, mmap_mode='r')
+        except Exception as e:
+            logging.warning(f"[Vector] Could not write cache: {e}")
+            return matrix
+
+    def _save(self, hashes: List[str], matrix: "np.ndarray"):
+        """Ghi cache atomically (file tạm + os.replace)"""
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp_matrix = self.matrix_path.with_suffix('.tmp.npy')
+        tmp_meta = self.meta_path.with_suffix('.tmp.json')
+        np.save(tmp_matrix, matrix)
+        with open(tmp_meta, 'w', encoding='utf-8') as f:
+            json.dump({'embedder': self.embedder.name, 'hashes': hashes}, f)
+        os.replace(tmp_matrix, self.matrix_path)
+        os.replace(tmp_meta, self.meta_path)
+
+
+class VectorIndex:
+    # Cosine similarity tối thiểu để đưa vào context
+    default_min_score = 0.5
+
+    def __init__(self, knowledge: Dict, embedder, cache_dir: str = "config/rag_cache", name: str = "knowledge",
+                 config: Optional[Dict] = None):
+        """
+        Embed (hoặc load từ cache) toàn bộ knowledge entries
+
+        Args:
+            knowledge: Dict entry_key -> {'keywords': [...], 'content': '...'}
+            embedder: Embedder instance (HashingEmbedder / OllamaEmbedder)
+            cache_dir: Thư mục chứa vector cache
+            name: Tên store trong cache_dir
+            config: RAG config cho ANN index ('ann_min_vectors', 'ann_nlist', 'ann_nprobe')
+        """
+        self.embedder = embedder
+        self.entry_keys = list(knowledge.keys())
+        self.entry_contents = [entry.get('content', '') for entry in knowledge.values()]
+        self.entry_keywords = [entry.get('keywords', []) for entry in knowledge.values()]
+        texts = [" | ".join(keywords + [content])
+                 for keywords, content in zip(self.entry_keywords, self.entry_contents)]
+        self.store = VectorStore(cache_dir, name, embedder)
+        self.matrix = self.store.load(texts)
+        self.ann = build_ann_index(self.matrix, config or {}, self.store.path_prefix, self.store.fingerprint)
+
+    def __len__(self) -> int:
+        return len(self.entry_keys)
+
+    def search(self, query: str, top_k: int = 3) -> List[Dict[str, any]]:
+        """
+        Cosine similarity giữa query và các entry (exact hoặc IVF tùy kích thước)
+
+        Args:
+            query: User query
+            top_k: Number of top results to return
+
+        Returns:
+            List of dicts with content and scores, sorted by score
+        """
+        return self.search_batch([query], top_k=top_k)[0]
+
+    def search_batch(self, queries: List[str], top_k: int = 3) -> List[List[Dict[str, any]]]:
+        """
+        Embed tất cả queries trong 1 lần gọi embedder rồi search bằng 1 query matrix
+
+        Args:
+            queries: List of user queries
+            top_k: Number of top results per query
+
+        Returns:
+            List kết quả (như search) cho từng query, cùng thứ tự với queries
+        """
+        if not self.entry_keys or top_k <= 0 or not queries:
+            return [[] for _ in queries]
+
+        query_vectors = self.embedder.embed(list(queries))
+        batch_results = []
+        for query, (doc_ids, scores) in zip(queries, self.ann.search_batch(query_vectors, top_k)):
+            query_tokens = set(tokenize(query))
+            results = []
+            for doc_id, score in zip(doc_ids, scores):
+                score = float(score)
+                if score <= 0:
+                    continue
+                results.append({
+                    'score': round(score, 3),
+                    'content': self.entry_contents[doc_id],
+                    'matched_keywords': [kw for kw in self.entry_keywords[doc_id]
+                                         if query_tokens.intersection(tokenize(kw))],
+                    'entry_key': self.entry_keys[doc_id]
+                })
+            batch_results.append(results)
+        return batch_results
@@ -0,0 +1,390 @@
+"""
+RAG Retrieval Benchmark
+Benchmark offline (không cần Ollama): sinh knowledge base giả lập 100 -> 1M entries, chạy các câu hỏi
+tiếng Việt có gán nhãn qua RAGKnowledgeBase.search / get_context và đo latency, bộ nhớ, recall@k
+
+Usage:
+    python benchmark_rag.py                                    # keyword + bm25, 100 / 1k / 10k entries
+    python benchmark_rag.py --backends keyword bm25 vector fts --sizes 100 10000 100000
+    python benchmark_rag.py --sizes 1000000 --queries 2000 --output logs/bench.json
+    python benchmark_rag.py --compare logs/bench_old.json logs/bench.json
+
+Output JSON: 1 record cho mỗi (backend, size) - so sánh giữa các lần chạy để bắt regression
+"""
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from colorama import Fore, init
+
+from app.rag_handler import RAGKnowledgeBase
+from app.rag_text import fold_diacritics
+
+# Initialize colorama
+init(autoreset=True)
+
+# Âm tiết ghép thành tên riêng (nickname, tên game, tên event...) - mỗi entry có 1 tên duy nhất
+SYLLABLES = [
+    "an", "bảo", "bình", "chi", "cường", "dũng", "đạt", "giang", "hà", "hải", "hiếu", "hoà", "hùng",
+    "huy", "khang", "khoa", "kiên", "lâm", "linh", "long", "mai", "minh", "nam", "ngân", "nghĩa",
+    "ngọc", "nhân", "phát", "phong", "phúc", "quân", "quang", "sơn", "tài", "tâm", "thắng", "thành",
+    "thảo", "thiện", "thịnh", "thu", "tiến", "toàn", "trâm", "trí", "trung", "tú", "tuấn", "uyên",
+    "việt", "vinh", "vũ", "xuân", "yến", "đức", "hạnh", "khánh", "lộc", "nhi", "oanh",
+]
+
+TOPICS = [
+    ("lịch stream", "Lịch stream của {name} là tối thứ {day} lúc {hour} giờ."),
+    ("discord", "Server discord {name} có {count} thành viên, link ở phần mô tả video."),
+    ("cấu hình máy", "Máy của {name} dùng card {gpu}, ram {ram}GB, màn hình {hz}Hz."),
+    ("game", "Game {name} đang chơi là thể loại sinh tồn, chơi cùng team {count} người."),
+    ("donate", "Donate cho {name} qua momo hoặc playerduo, tối thiểu {count}k."),
+    ("sự kiện", "Sự kiện {name} diễn ra vào cuối tháng {month}, có giải thưởng {count} triệu."),
+    ("quy định chat", "Quy định chat kênh {name}: không spam, không link lạ, tôn trọng mọi người."),
+    ("merch", "Áo merch {name} bán trên shop, giá {count}0k, ship toàn quốc."),
+]
+
+FILLER_SENTENCES = [
+    "Ae nhớ bấm subscribe và bật chuông thông báo nhé.",
+    "Thông tin có thể thay đổi, theo dõi fanpage để cập nhật.",
+    "Mọi thắc mắc hỏi mod trong chat.",
+    "Cảm ơn ae đã ủng hộ kênh trong thời gian qua.",
+]
+
+# Template câu hỏi kiểu chat livestream ({kw}: keyword phrase, {name}: tên riêng)
+QUERY_TEMPLATES = [
+    ("exact", "{kw}"),
+    ("question", "{kw} là gì vậy"),
+    ("question", "cho mình hỏi về {kw} với"),
+    ("no_diacritics", "ad ơi {kw_plain} ở đâu"),
+    ("no_diacritics", "{kw_plain}"),
+    ("typo", "{name_typo} {topic}"),
+]
+
+NEGATIVE_QUERIES = [
+    "hôm nay trời đẹp quá", "ăn cơm chưa mọi người", "haha vui quá", "xin chào cả nhà",
+    "mấy giờ rồi nhỉ", "ai xem tới cuối không", "buồn ngủ quá ae ơi", "gg wp",
+]
+
+
+def entry_name(i: int) -> str:
+    """Tên riêng duy nhất cho entry i (viết i theo base len(SYLLABLES), tối thiểu 2 âm tiết)"""
+    base = len(SYLLABLES)
+    # Xáo trộn thứ tự để các entry liền nhau không có tên gần giống nhau (7919 nguyên tố cùng nhau với base)
+    n = (i * 7919) % (base ** 4) + base
+    parts = []
+    while n:
+        parts.append(SYLLABLES[n % base])
+        n //= base
+    return "".join(parts)
+
+
+def generate_knowledge(size: int, seed: int = 0) -> Tuple[Dict, List[Dict]]:
+    """
+    Sinh knowledge base giả lập
+
+    Args:
+        size: Số entries
+        seed: Random seed
+
+    Returns:
+        (knowledge dict, metadata từng entry: key / name / topic / keywords)
+    """
+    rng = random.Random(seed)
+    knowledge, meta = {}, []
+    for i in range(size):
+        name = entry_name(i)
+        topic, template = TOPICS[i % len(TOPICS)]
+        keywords = [f"{topic} {name}", name]
+        if rng.random() < 0.5:
+            keywords.append(f"{name} là ai")
+        content = template.format(
+            name=name, day=rng.randint(2, 7), hour=rng.randint(18, 22), count=rng.randint(2, 500),
+            gpu=rng.choice(["rtx 3060", "rtx 4070", "rx 6700"]), ram=rng.choice([16, 32, 64]),
+            hz=rng.choice([144, 165, 240]), month=rng.randint(1, 12)
+        )
+        content += " " + " ".join(rng.sample(FILLER_SENTENCES, rng.randint(1, 2)))
+        key = f"entry_{i}"
+        knowledge[key] = {'keywords': keywords, 'content': content}
+        meta.append({'key': key, 'name': name, 'topic': topic, 'keywords': keywords})
+    return knowledge, meta
+
+
+def generate_queries(meta: List[Dict], count: int, negative_ratio: float = 0.1,
+                     seed: int = 1) -> List[Dict]:
+    """
+    Sinh câu hỏi có gán nhãn entry đúng (expected = None với câu hỏi không liên quan)
+
+    Args:
+        meta: Metadata entries từ generate_knowledge
+        count: Số câu hỏi
+        negative_ratio: Tỉ lệ câu hỏi không có câu trả lời trong knowledge base
+        seed: Random seed
+
+    Returns:
+        List of {'query', 'kind', 'expected'}
+    """
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        if rng.random() < negative_ratio:
+            queries.append({'query': rng.choice(NEGATIVE_QUERIES), 'kind': 'negative', 'expected': None})
+            continue
+        entry = rng.choice(meta)
+        kind, template = rng.choice(QUERY_TEMPLATES)
+        kw = rng.choice(entry['keywords'])
+        name = entry['name']
+        pos = rng.randrange(1, len(name))
+        queries.append({
+            'query': template.format(kw=kw, kw_plain=fold_diacritics(kw), name=name, topic=entry['topic'],
+                                     name_typo=name[:pos] + name[pos + 1:]),
+            'kind': kind,
+            'expected': entry['key'],
+        })
+    return queries
+
+
+def current_rss_mb() -> Optional[float]:
+    """RSS hiện tại của process (MB), None nếu không đo được"""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # macOS trả về bytes, Linux trả về KB
+        return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+    except ImportError:
+        return None
+
+
+def percentiles(samples_ms: List[float]) -> Dict[str, float]:
+    """p50/p95/p99/mean/max (ms)"""
+    if not samples_ms:
+        return {}
+    ordered = sorted(samples_ms)
+
+    def pick(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+    return {
+        'p50': round(pick(50), 4),
+        'p95': round(pick(95), 4),
+        'p99': round(pick(99), 4),
+        'mean': round(sum(ordered) / len(ordered), 4),
+        'max': round(ordered[-1], 4),
+    }
+
+
+def run_case(backend: str, size: int, queries: List[Dict], knowledge_path: Path, work_dir: Path,
+             top_k: int, base_config: Dict, use_cache: bool) -> Dict:
+    """
+    Benchmark 1 backend trên 1 knowledge base
+
+    Returns:
+        Record kết quả (latency, memory, recall)
+    """
+    config = {
+        'vector_embedder': 'hashing',
+        **base_config,
+        'backend': backend,
+        'watch': False,
+        'snapshot_dir': str(work_dir / 'rag_cache'),
+        'vector_cache_dir': str(work_dir / 'rag_cache'),
+        'fts_path': str(work_dir / f'knowledge_{size}.db'),
+        'fts_read_only': True,
+    }
+    if not use_cache:
+        config['cache_size'] = 0
+
+    gc.collect()
+    rss_before = current_rss_mb()
+    start = time.perf_counter()
+    rag = RAGKnowledgeBase(str(knowledge_path), config=config)
+    build_seconds = time.perf_counter() - start
+    gc.collect()
+    rss_after = current_rss_mb()
+
+    # Lần load thứ 2: snapshot / vector cache / database đã có sẵn
+    start = time.perf_counter()
+    RAGKnowledgeBase(str(knowledge_path), config=config)
+    warm_load_seconds = time.perf_counter() - start
+
+    search_ms, context_ms = [], []
+    hits = {k: 0 for k in range(1, top_k + 1)}
+    reciprocal_rank = 0.0
+    labeled = 0
+    by_kind = {}
+    false_context = negatives = 0
+
+    for item in queries:
+        query = item['query']
+        start = time.perf_counter()
+        results = rag.search(query, top_k=top_k)
+        search_ms.append((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        context = rag.get_context(query, max_length=300)
+        context_ms.append((time.perf_counter() - start) * 1000)
+
+        if item['expected'] is None:
+            negatives += 1
+            false_context += context is not None
+            continue
+
+        labeled += 1
+        keys = [r['entry_key'] for r in results]
+        rank = keys.index(item['expected']) + 1 if item['expected'] in keys else None
+        kind = by_kind.setdefault(item['kind'], {'queries': 0, 'hit@1': 0})
+        kind['queries'] += 1
+        if rank:
+            reciprocal_rank += 1 / rank
+            kind['hit@1'] += rank == 1
+            for k in hits:
+                hits[k] += rank <= k
+
+    # Batch API: cả hàng đợi queries trong 1 lời gọi (chỉ có nghĩa khi cache tắt)
+    batch_ms_per_query = None
+    if not use_cache:
+        start = time.perf_counter()
+        rag.search_batch([item['query'] for item in queries], top_k=top_k)
+        batch_ms_per_query = round((time.perf_counter() - start) * 1000 / max(1, len(queries)), 4)
+
+    return {
+        'backend': rag.backend,
+        'requested_backend': backend,
+        'size': size,
+        'entries': len(rag),
+        'queries': len(queries),
+        'build_seconds': round(build_seconds, 3),
+        'warm_load_seconds': round(warm_load_seconds, 3),
+        'memory_mb': round(rss_after - rss_before, 1) if rss_before is not None else None,
+        'search_ms': percentiles(search_ms),
+        'context_ms': percentiles(context_ms),
+        'search_batch_ms_per_query': batch_ms_per_query,
+        'recall': {f'@{k}': round(hits[k] / labeled, 4) if labeled else None for k in hits},
+        'mrr': round(reciprocal_rank / labeled, 4) if labeled else None,
+        'recall_by_kind': {kind: round(data['hit@1'] / data['queries'], 4)
+                           for kind, data in sorted(by_kind.items())},
+        'false_context_rate': round(false_context / negatives, 4) if negatives else None,
+    }
+
+
+def print_record(record: Dict):
+    """In 1 dòng tóm tắt"""
+    search = record['search_ms']
+    recall = record['recall']
+    print(Fore.GREEN + f"  {record['backend']:<8} {record['size']:>8} entries | "
+          f"build {record['build_seconds']:>7.2f}s | mem {record['memory_mb'] or 0:>7.1f}MB | "
+          f"search p50 {search['p50']:.3f} p95 {search['p95']:.3f} p99 {search['p99']:.3f} ms | "
+          f"batch {record['search_batch_ms_per_query']} ms/q | "
+          f"recall@1 {recall['@1']} MRR {record['mrr']} | "
+          f"false ctx {record['false_context_rate']}" + Fore.RESET)
+
+
+def compare(old_path: str, new_path: str, tolerance: float = 0.2) -> int:
+    """
+    So sánh 2 file kết quả, báo regression (latency p95 tăng > tolerance, recall@1 giảm)
+
+    Returns:
+        Số regression (dùng làm exit code)
+    """
+    with open(old_path, 'r', encoding='utf-8') as f:
+        old = {(r['backend'], r['size']): r for r in json.load(f)['results']}
+    with open(new_path, 'r', encoding='utf-8') as f:
+        new = {(r['backend'], r['size']): r for r in json.load(f)['results']}
+
+    regressions = 0
+    for key in sorted(old.keys() & new.keys()):
+        before, after = old[key], new[key]
+        p95_before, p95_after = before['search_ms']['p95'], after['search_ms']['p95']
+        recall_before, recall_after = before['recall']['@1'] or 0, after['recall']['@1'] or 0
+        slower = p95_after > p95_before * (1 + tolerance)
+        worse = recall_after < recall_before - 0.005
+        regressions += slower + worse
+        color = Fore.RED if slower or worse else Fore.GREEN
+        print(color + f"  {key[0]:<8} {key[1]:>8} | p95 {p95_before:.3f} -> {p95_after:.3f} ms | "
+              f"recall@1 {recall_before} -> {recall_after}" + Fore.RESET)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline RAG retrieval benchmark")
+    parser.add_argument('--backends', nargs='+', default=['keyword', 'bm25'],
+                        choices=RAGKnowledgeBase.BACKENDS)
+    parser.add_argument('--sizes', nargs='+', type=int, default=[100, 1000, 10000])
+    parser.add_argument('--queries', type=int, default=1000, help="Số câu hỏi mỗi knowledge base")
+    parser.add_argument('--negative-ratio', type=float, default=0.1)
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--config', help="File JSON chứa RAG config bổ sung (vd. bm25_k1, ann_nprobe)")
+    parser.add_argument('--cache', action='store_true', help="Bật query cache (mặc định tắt để đo retrieval)")
+    parser.add_argument('--work-dir', help="Thư mục chứa knowledge/cache sinh ra (mặc định: thư mục tạm)")
+    parser.add_argument('--output', default='logs/rag_benchmark.json')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help="So sánh 2 file kết quả")
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare(*args.compare) else 0)
+
+    logging.basicConfig(level=logging.WARNING)
+    base_config = {}
+    if args.config:
+        with open(args.config, 'r', encoding='utf-8') as f:
+            base_config = json.load(f)
+
+    work_dir = Path(args.work_dir) if args.work_dir else Path(tempfile.mkdtemp(prefix='rag_bench_'))
+    work_dir.mkdir(parents=True, exist_ok=True)
+
+    print(Fore.CYAN + "=" * 80)
+    print(Fore.CYAN + "RAG RETRIEVAL BENCHMARK")
+    print(Fore.CYAN + "=" * 80 + Fore.RESET)
+
+    results = []
+    try:
+        for size in args.sizes:
+            print(Fore.YELLOW + f"\nGenerating {size} entries..." + Fore.RESET)
+            knowledge, meta = generate_knowledge(size, seed=args.seed)
+            knowledge_path = work_dir / f'knowledge_{size}.json'
+            with open(knowledge_path, 'w', encoding='utf-8') as f:
+                json.dump(knowledge, f, ensure_ascii=False)
+            queries = generate_queries(meta, args.queries, args.negative_ratio, seed=args.seed + 1)
+            del knowledge, meta
+
+            for backend in args.backends:
+                record = run_case(backend, size, queries, knowledge_path, work_dir,
+                                  args.top_k, base_config, args.cache)
+                results.append(record)
+                print_record(record)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    output = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'args': {k: v for k, v in vars(args).items() if k != 'compare'},
+        'results': results,
+    }
+    output_path = Path(args.output)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(output, f, ensure_ascii=False, indent=2)
+    print(Fore.CYAN + f"\n✓ Results written to {output_path}" + Fore.RESET)
+
+
+if __name__ == "__main__":
+    main()
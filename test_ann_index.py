@@ -0,0 +1,35 @@
+"""
+Test cache của IVF index: đổi tham số build (ann_nlist...) phải build lại, không load index cũ
+Chạy: python -m pytest test_ann_index.py
+"""
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from app.ann_index import IVFIndex, build_ann_index
+
+
+def _vectors(n=400, dim=16):
+    vectors = np.random.default_rng(1).standard_normal((n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def test_cached_index_reused(tmp_path, monkeypatch):
+    vectors = _vectors()
+    prefix = str(tmp_path / "kb")
+    config = {'ann_min_vectors': 1, 'ann_nlist': 8}
+    build_ann_index(vectors, config, prefix, "store")
+
+    def fail_build(*args, **kwargs):
+        raise AssertionError("cached index should have been loaded")
+    monkeypatch.setattr(IVFIndex, 'build', fail_build)
+    assert build_ann_index(vectors, config, prefix, "store").nlist == 8
+
+
+def test_changing_nlist_forces_rebuild(tmp_path):
+    vectors = _vectors()
+    prefix = str(tmp_path / "kb")
+    assert build_ann_index(vectors, {'ann_min_vectors': 1, 'ann_nlist': 8}, prefix, "store").nlist == 8
+    assert build_ann_index(vectors, {'ann_min_vectors': 1, 'ann_nlist': 16}, prefix, "store").nlist == 16
+    # Index mới đã được lưu lại với tham số mới
+    assert build_ann_index(vectors, {'ann_min_vectors': 1, 'ann_nlist': 16}, prefix, "store").nlist == 16
@@ -6,7 +6,7 @@ import sys
 import time
 from colorama import Fore, init
 from app.ollama_handler import OllamaHandler
-from app.rag_handler import RAGKnowledgeBase
+from app.rag_handler import get_shared_knowledge_base
 
 # Initialize colorama
 init(autoreset=True)
@@ -33,8 +33,8 @@ class OllamaRAGTester:
         
         print(Fore.YELLOW + "\nInitializing RAG Knowledge Base..." + Fore.RESET)
         try:
-            self.rag = RAGKnowledgeBase('config/knowledge.json')
-            print(Fore.GREEN + f"✓ RAG Knowledge Base loaded: {len(self.rag.knowledge)} entries" + Fore.RESET)
+            self.rag = get_shared_knowledge_base('config/knowledge.json')
+            print(Fore.GREEN + f"✓ RAG Knowledge Base loaded: {len(self.rag)} entries" + Fore.RESET)
         except Exception as e:
             print(Fore.RED + f"✗ Failed to initialize RAG: {e}" + Fore.RESET)
             sys.exit(1)
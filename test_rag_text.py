@@ -0,0 +1,20 @@
+"""
+Test tokenize của RAG: stopwords không được nuốt từ có nghĩa sau khi bỏ dấu
+Chạy: python -m pytest test_rag_text.py
+"""
+from app.rag_text import tokenize
+
+
+def test_content_words_survive_diacritic_folding():
+    # "mã" -> "ma" trùng "mà", "tủ" -> "tu" trùng "từ" sau khi bỏ dấu
+    assert tokenize("mã nguồn") == ('ma', 'nguon')
+    assert tokenize("món tủ") == ('mon', 'tu')
+    assert tokenize("thể loại nhạc") == ('the', 'loai', 'nhac')
+    assert tokenize("đồ ăn") == ('do', 'an')
+    assert tokenize("bot do ai làm") == ('bot', 'do', 'ai', 'lam')
+
+
+def test_stopwords_removed():
+    assert tokenize("ACN là ai của thế nào") == ('acn', 'la', 'ai')
+    # Gõ không dấu -> stopwords dạng không dấu
+    assert tokenize("acn cua ai") == ('acn', 'ai')